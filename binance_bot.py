@@ -3,141 +3,793 @@
 
 from binance.client import Client, BinanceAPIException
 from binance.websockets import BinanceSocketManager
-from threading import Thread
+from threading import Thread, Condition, Event, Lock
 from twisted.internet import reactor
 from collections import namedtuple
 import time
 import concurrent.futures  # For threading and multiprocessing
-import re
 import atexit
 
 import helpers as hp
 from config import *  # Settings are stored here
 import rebalance
 import traceback
+from plan_compiler import CompiledPlans, PlanKernel, Instruction
+from vector_engine import BatchEngine
+from screening import TopOfBookScreen
+from sizing import market_filters, min_size, optimal_size, passes_filters
+from cycle_detector import CycleDetector
+from feed import AsyncFeed
+from book_bus import BusFeed
+from sharding import ShardRouter
+from order_entry import order_transport
+from bq_sink import BigQuerySink
+from journal import Journal
+from replay import Recorder
+from notifier import SlackNotifier
+from latency import LatencyMonitor, STAGES
+from metrics import Registry, MetricsServer, SECONDS_BUCKETS
+from profiling import Profiler
+from order_book import Book, DiffBook
+from book_loader import BookLoader, save_books, load_cached_books
+from exceptions import BookOutOfSync
+
+
+# Action is execution condition for a market (module level, so plans can be sent to other processes)
+Action = namedtuple("Action", "symbol side quote base decimals exchange")
+
+
+def api_client(api_url, api_key=None, api_secret=None):
+    """Return a Client of the REST API at the URL.
+
+    Client pings its API_URL when it is created, so another API (tools/mock_exchange.py) is set on a
+    subclass first; other clients of the process keep theirs.
+    """
+    if api_url == API_URL:
+        return Client(api_key=api_key, api_secret=api_secret)
+
+    class LocalClient(Client):
+        API_URL = api_url.rstrip("/") + "/api"
+
+    return LocalClient(api_key=api_key, api_secret=api_secret)
+
+
+class UpdateScheduler:
+    """Coalesce book updates into evaluation passes run by one long-lived worker."""
+
+    def __init__(self, evaluate, loop=True, on_error=None):
+        self.evaluate = evaluate  # Called with the set of markets that changed since the last pass
+        self.loop = loop  # If false the worker stops after the first pass
+        self.on_error = on_error  # Called with the traceback of a failed pass, the worker keeps running
+        self.dirty = {}  # Markets waiting for evaluation and the time of their oldest pending update
+        self.condition = Condition()
+        self.busy = False  # Is the worker currently evaluating
+        self.running = False
+        self.worker = None
+
+        # Counters
+        self.updates = 0  # All updates handed to the scheduler
+        self.merged = 0  # Updates merged into a market that was already waiting
+        self.passes = 0  # Finished evaluation passes
+        self.failed = 0  # Passes that raised
+        self.lag = 0.  # How long the oldest update of the last pass waited for evaluation (sec)
+        self.max_lag = 0.
+
+    def start(self):
+        """Start the evaluator worker if it isn't running yet."""
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+        self.worker = Thread(target=self._run, name="evaluator", daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        """Stop the worker after the pass it is currently running."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def mark(self, market):
+        """Schedule market for evaluation, merging it with an already pending update."""
+        with self.condition:
+            self.updates += 1
+            if market in self.dirty:
+                self.merged += 1
+            else:
+                self.dirty[market] = time.perf_counter()
+            self.condition.notify()
+
+    def stats(self):
+        """Return the counters."""
+        return {"updates": self.updates,
+                "merged": self.merged,
+                "passes": self.passes,
+                "failed": self.failed,
+                "pending": len(self.dirty),
+                "lag": self.lag,
+                "max_lag": self.max_lag}
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.dirty:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                dirty, self.dirty = self.dirty, {}
+                self.busy = True
+            self.lag = time.perf_counter() - min(dirty.values())
+            self.max_lag = max(self.max_lag, self.lag)
+            try:
+                self.evaluate(set(dirty))
+            except Exception:
+                self.failed += 1
+                if self.on_error is not None:
+                    self.on_error(traceback.format_exc())
+            finally:
+                self.busy = False
+                self.passes += 1
+            if not self.loop:
+                self.stop()
 
 
 class BinanceBot(BinanceSocketManager):
 
-    def __init__(self, plans, execute=True, test_it=False, loop=True, settings=None):
+    def __init__(self, plans, execute=True, test_it=False, loop=True, settings=None, client=None, sink=None,
+                 notifier=None, order_entry=None):
+        # The client, sink, notifier and order entry can be given instead of the live ones (replay.Replay, tools)
         self.slack_group = SLACK_GROUP if not test_it else SLACK_GROUP_TEST
-        # TODO Add keys to the settings 
-        self.client = Client(api_key=BINANCE_PUBLIC, api_secret=BINANCE_SECRET)
+        self.api_url = (settings or {}).get("api_url", API_URL)  # REST API, e.g. tools/mock_exchange.py for load tests
+        if client is None:
+            # TODO Add keys to the settings 
+            client = api_client(self.api_url, BINANCE_PUBLIC, BINANCE_SECRET)
+        self.client = client
 
         self.execute = execute  # If false no opportunity gets executed
         self.test_it = test_it  # Opportunity gets executed even if unprofitable
         self.loop = loop  # If false it will only check one book update
-        self.busy = False  # Is the bot currently handling one of the books
         self.plans = plans
 
         self.plan_markets = {market for plan in plans for market in plan.path}  # All markets that will be checked by the instance
-        self.books = {}  # Latest books 
-        self.process_books = {}  # Books that will be processed 
+        self.compiled = CompiledPlans(plans, self.plan_markets)  # Plan kernels and market -> plan ids index
+        self.engine = BatchEngine(self.compiled.kernels, self.plan_markets)  # Scores all plans in one vectorized pass
+        self.evaluation = (settings or {}).get("evaluation", EVALUATION)
+        self.detector = None  # Negative cycles of the log-price graph of all plan markets (graph evaluation)
+        self.market_conds = {action.symbol: {"symbol": action.symbol, "quote": action.quote, "base": action.base,
+                                             "decimals": action.decimals, "exchange": action.exchange}
+                             for plan in plans for action in plan.actions}
+        self.home_amounts = {plan.home_asset: plan.start_amount for plan in plans}  # Start amounts of cycle plans
+        self.cycle_plans = {}  # Asset cycle -> (Plan, PlanKernel) of the cycles found so far
+        if self.evaluation == "graph":
+            self.detector = CycleDetector({symbol: (cond["base"], cond["quote"]) for symbol, cond in self.market_conds.items()},
+                                          max_legs=(settings or {}).get("cycle_max_legs", CYCLE_MAX_LEGS))
+        shards = (settings or {}).get("shards", SHARDS)
+        if shards > 1 and self.detector is None:
+            self.scheduler = ShardRouter(self, shards)  # Plans are evaluated in worker processes
+        else:
+            # Runs evaluation passes over changed markets
+            self.scheduler = UpdateScheduler(self.process_updates, loop=loop,
+                                             on_error=lambda error: self.exceptions.append(error))
+        self.depth_mode = (settings or {}).get("depth_mode", DEPTH_MODE)
+        stream = "@depth@100ms" if self.depth_mode == "diff" else "@depth10@100ms"
+        self.stream_symbols = {pair.lower() + stream: pair for pair in self.plan_markets}  # Stream name -> market
+        self.book_ticker = (settings or {}).get("book_ticker", BOOK_TICKER)
+        self.ticker_symbols = {pair.lower() + "@bookTicker": pair for pair in self.plan_markets} if self.book_ticker else {}
+        self.screen = TopOfBookScreen(self.compiled, self.plan_markets) if self.book_ticker else None
+        self.sizing = (settings or {}).get("sizing", SIZING)  # Trade sizes follow the depth
+        self.balances = None  # Free balances that limit trade sizes, loaded when trading starts (None - no limit)
+        self.balances_changed = Event()  # Set after every execution, the balances are reloaded right away
+        self.balance_refresher = None
+        self.filters = None  # Market -> (min quantity, min notional), loaded when trading starts (None - not checked)
+        self.feed_mode = (settings or {}).get("feed", FEED)
+        self.stream_url = (settings or {}).get("stream_url", STREAM_URL)
+        self.feed = None  # feed.AsyncFeed or book_bus.BusFeed
+        self.books = {}  # Latest books (order_book.Book)
+        self.stale = set()  # Markets whose books are cached or kept from before a restart, not traded on
+        self.books_lock = Lock()  # Stream updates and startup snapshots of the partial depth mode replace books under it
+        self.book_loader = BookLoader(self.api_url)  # Startup snapshots, fetched concurrently
+        instance_id = plans[0].instance_id if plans else None
+        # Books cached for the next start, one file per instance
+        self.book_cache_path = (settings or {}).get("book_cache_path", BOOK_CACHE_PATH).format(instance_id=instance_id)
+        self.local_books = {}  # Full books kept from the diff stream (only in the diff mode)
+        self.process_books = {}  # Copies of the books that will be processed
         self.last_book_update = None  # Timestamp of the last book update
         self.exceptions = []  # Store exceptions from all threads here
+        self.record_path = (settings or {}).get("record")  # Save raw market data messages here for replay.Replay
+        self.recorder = None
+        self.on_opportunity = None  # Called with every priced Opportunity that was acted on
+        self.notifier = notifier or SlackNotifier()  # Slack messages are posted in the background
+        on_error = lambda error: self.exceptions.append(error)
+        self.marks = {}  # Market -> perf_counter_ns marks (event, received, ingested) of its last book update
+        self.pass_started = None  # perf_counter_ns of the running evaluation pass
+        # Stage latency histograms, logged periodically
+        self.latency = LatencyMonitor(self.client, on_report=self.log_latency, on_error=on_error) \
+            if (settings or {}).get("latency", LATENCY) else None
+        if sink is not None:
+            self.sink = sink
+        elif (settings or {}).get("journal", JOURNAL):
+            # Logs go to local columnar files of the instance, uploaded in the background
+            self.sink = Journal(directory=(settings or {}).get("journal_dir", JOURNAL_DIR).format(instance_id=instance_id),
+                                on_error=on_error)
+        else:
+            # Logs are inserted in the background, rows that can't be are spilled to the instance's files
+            self.sink = BigQuerySink(spill_dir=(settings or {}).get("spill_dir", SINK_SPILL_DIR).format(instance_id=instance_id),
+                                     on_error=on_error)
+        # Orders of all plans are presigned from templates, sent over REST or the websocket API
+        if order_entry is None:
+            order_entry = order_transport(BINANCE_PUBLIC, BINANCE_SECRET, [action for plan in plans for action in plan.actions],
+                                          (settings or {}).get("order_transport", ORDER_TRANSPORT),
+                                          on_error=lambda exc: self.exceptions.append(exc), url=self.api_url,
+                                          ws_url=(settings or {}).get("ws_api_url", WS_API_URL))
+        self.order_entry = order_entry
+        self.metrics = Registry()
+        self.metrics_port = (settings or {}).get("metrics_port", METRICS_PORT)
+        self.metrics_server = None
+        self.register_metrics()
+        # Idle until a window is started (signal in main.py), then profiles the socket and evaluator threads
+        self.profiler = Profiler(self, mode=(settings or {}).get("profile_mode", PROFILE_MODE),
+                                 memory=(settings or {}).get("profile_memory", PROFILE_MEMORY),
+                                 on_done=self.profile_written, on_error=on_error)
 
         BinanceSocketManager.__init__(self, self.client)
+        if self.stream_url != STREAM_URL:
+            self.STREAM_URL = self.stream_url.rstrip("/") + "/"  # Twisted feed too
+
+    def register_metrics(self):
+        """Create the hot path metrics and the ones read from the other components when scraped."""
+        m = self.metrics
+        self.stream_messages = m.counter("binance_stream_messages_total", "Market data messages", ("stream",))
+        self.plans_evaluated = m.counter("binance_plans_evaluated_total", "Plans priced by the batch engine")
+        self.cycles_found = m.counter("binance_cycles_found_total", "Negative cycles found by the graph evaluation")
+        self.evaluation_seconds = m.histogram("binance_evaluation_seconds", "Evaluation pass duration", SECONDS_BUCKETS)
+        self.opportunities_found = m.counter("binance_opportunities_total",
+                                             "Profitable opportunities by execution status", ("status",))
+
+        def stat(component, key):
+            # Components can be swapped (restart, replay), so they are looked up on every scrape
+            return lambda: getattr(self, component).stats().get(key)
+
+        m.counter("binance_book_updates_total", "Book updates handed to the scheduler", fn=stat("scheduler", "updates"))
+        m.counter("binance_updates_merged_total", "Updates merged into a pending one while the evaluator was busy",
+                  fn=stat("scheduler", "merged"))
+        m.counter("binance_evaluation_passes_total", "Evaluation passes", fn=stat("scheduler", "passes"))
+        m.counter("binance_evaluation_failures_total", "Evaluation passes that raised", fn=stat("scheduler", "failed"))
+        m.gauge("binance_evaluation_pending_markets", "Markets waiting for evaluation", fn=stat("scheduler", "pending"))
+        m.gauge("binance_evaluation_lag_seconds", "Wait of the oldest update of the last pass", fn=stat("scheduler", "lag"))
+        m.gauge("binance_book_update_age_seconds", "Time since the last book update",
+                fn=lambda: time.time() - self.last_book_update if self.last_book_update else None)
+        m.gauge("binance_books", "Books in sync", fn=lambda: len(self.books))
+        m.counter("binance_feed_reconnects_total", "Market data reconnects (asyncio feed)",
+                  fn=lambda: getattr(self.feed, "reconnects", None))
+
+        m.gauge("binance_sink_queue_depth", "Row batches waiting for the BigQuery sink", fn=stat("sink", "queued"))
+        m.gauge("binance_sink_buffered_rows", "Rows waiting for the next insert", fn=stat("sink", "buffered"))
+        m.counter("binance_sink_rows_total", "Rows logged", fn=stat("sink", "rows"))
+        m.counter("binance_sink_rejected_rows_total", "Rows BigQuery didn't accept", fn=stat("sink", "rejected"))
+        m.counter("binance_sink_spilled_rows_total", "Rows spilled to disk", fn=stat("sink", "spilled"))
+        m.counter("binance_sink_truncated_rows_total", "Journal rows whose fills or book levels were cut off",
+                  fn=stat("sink", "truncated"))
+        m.gauge("binance_notifier_queue_depth", "Slack messages waiting to be posted", fn=stat("notifier", "queued"))
+        m.counter("binance_notifier_sent_total", "Slack messages posted", fn=stat("notifier", "sent"))
+        m.counter("binance_notifier_dropped_total", "Slack messages dropped on a full queue", fn=stat("notifier", "dropped"))
+        m.counter("binance_notifier_rate_limited_total", "Slack posts rejected with 429", fn=stat("notifier", "rate_limited"))
+
+        m.counter("binance_orders_total", "Orders sent", fn=stat("order_entry", "orders"))
+        m.counter("binance_order_fallbacks_total", "Orders sent over REST while the websocket session was down",
+                  fn=stat("order_entry", "fallbacks"))
+        m.gauge("binance_order_count_10s", "Orders in the last 10 seconds, as the exchange counts them",
+                fn=stat("order_entry", "order_count"))
+        m.gauge("binance_rest_used_weight", "Request weight used in the current minute, from the last response",
+                ("source",), fn=lambda: {("client",): self.used_weight(),
+                                         ("orders",): self.order_entry.stats().get("used_weight")})
+
+    def profile_written(self, paths):
+        """Tell where the profiling window's files are."""
+        msg = "Profile written:\n" + "\n".join(paths)
+        print(msg)
+        self.notifier.send(msg, self.slack_group, emoji=':blocky-sweat:')
+
+    def used_weight(self):
+        """Return the weight header of the client's last REST response."""
+        response = getattr(self.client, "response", None)  # python-binance keeps the last response
+        weight = response.headers.get("x-mbx-used-weight-1m") if response is not None else None
+        return int(weight) if weight is not None else None
 
     def handle_message(self, msg):
         """React to the book update."""
+        # Feeds that stamp the socket receive time keep it on the feed while the handler runs
+        received = getattr(self.feed, "received", None) or time.perf_counter_ns()
         if msg.get("e") == 'error':
-            hp.send_to_slack(str(msg), SLACK_KEY, SLACK_GROUP, emoji=':blocky-sweat:')
-        pair = re.findall(r"^[a-z]*", msg["stream"])[0].upper()  # Find out for which market was the book update
-        self.books[pair] = msg["data"]  # Save new books (and overwrite the old ones)
-        self.last_book_update = self.books[pair]["timestamp"] = time.time()
-
-        # If not busy and all assets books are available
-        if not self.busy and len(self.books) == len(self.plan_markets):
-            self.busy = True  # Acts as a lock 
-            self.process_books = self.books.copy()  # Makes sure these books won't be overwritten while processing
-            Thread(target=self.process_plans, args=(pair,)).start()
+            self.notifier.send(str(msg), SLACK_GROUP, emoji=':blocky-sweat:', digest="socket errors")
+            return
+        self.stream_messages.inc((msg["stream"],))
+        if msg["stream"] in self.ticker_symbols:
+            if self.recorder is not None:
+                self.recorder.write(msg, time.time())
+            self.handle_ticker(self.ticker_symbols[msg["stream"]], msg["data"])
+            return
+        pair = self.stream_symbols[msg["stream"]]  # Find out for which market was the book update
+        self.last_book_update = time.time()
+        if self.recorder is not None:
+            self.recorder.write(msg, self.last_book_update)
+        if self.depth_mode == "diff":
+            if not self.apply_diff(pair, msg["data"]):
+                return  # Also while the events are buffered for the snapshot, a cached book stays stale
+            self.stale.discard(pair)  # The live book replaced the cached one
+        else:
+            with self.books_lock:
+                self.stale.discard(pair)
+                book = self.books.get(pair)
+                if book is None:
+                    book = self.books[pair] = Book(pair)
+            book.fill(msg["data"], self.last_book_update)  # Overwrite the old levels in place
+        if self.latency is not None:
+            self.mark_ingest(pair, msg["data"].get("E"), received)
+        self.book_updated(pair)
+
+    def handle_bus_update(self, pair, book):
+        """React to the book update published by the book bus feed process."""
+        received = time.perf_counter_ns()
+        self.last_book_update = time.time()
+        self.books[pair] = book
+        if self.latency is not None:
+            self.mark_ingest(pair, None, received)
+        self.book_updated(pair)
+
+    def mark_ingest(self, pair, event_ms, received):
+        """Keep the marks of the market's book update and record its ingest stages."""
+        ingested = time.perf_counter_ns()
+        event = self.latency.clock.to_local_ns(event_ms) if event_ms else None
+        self.marks[pair] = (event, received, ingested)
+        if event is not None:
+            self.latency.record("exchangeToReceive", received - event)
+        self.latency.record("receiveToIngest", ingested - received)
+
+    def book_updated(self, pair):
+        """Schedule evaluation of the market whose book changed."""
+        if self.screen is not None:
+            book = self.books[pair]
+            passed = self.screen.update(pair, book.bid_px[0] if book.bid_len else 0, book.ask_px[0] if book.ask_len else float("inf"))
+        else:
+            passed = True
+        # If all assets books are available
+        if passed and len(self.books) == len(self.plan_markets):
+            self.scheduler.mark(pair)
 
         if self.exceptions:
             # Take all the exceptions from threads and message them to Slack group
             msg = " >" + "\n".join([str(exc) for exc in self.exceptions])
             self.exceptions = []
-            hp.send_to_slack(msg, SLACK_KEY, self.slack_group, emoji=':blocky-money:')
-
-    def process_plans(self, pair):
+            self.notifier.send(msg, self.slack_group, emoji=':blocky-money:', digest="exceptions")
+
+    def handle_ticker(self, pair, ticker):
+        """React to the best bid/ask update; evaluate the depth only if a plan could become profitable."""
+        bid, ask = float(ticker["b"]), float(ticker["a"])
+        if not self.screen.update(pair, bid, ask):
+            return
+        book = self.books.get(pair)
+        if book is None or len(self.books) < len(self.plan_markets):
+            return
+        if book.last_update_id is not None and ticker["u"] > book.last_update_id:
+            # Ticker is ahead of the last depth update
+            local = self.local_books.get(pair)
+            if local is None:
+                book.apply_top(bid, float(ticker["B"]), ask, float(ticker["A"]), ticker["u"], time.time())
+            elif not local.apply_top(bid, float(ticker["B"]), ask, float(ticker["A"]), ticker["u"], time.time()):
+                return  # The diff book went out of sync meanwhile
+        self.scheduler.mark(pair)
+
+    def apply_diff(self, pair, event):
+        """Apply diff depth event to the local book; return True if the book changed."""
+        local = self.local_books[pair]
+        try:
+            changed = local.apply(event, self.last_book_update)
+        except BookOutOfSync as e:
+            # Only the affected symbol waits for a new snapshot, its plans are skipped meanwhile
+            self.books.pop(pair, None)
+            local.reset()
+            self.exceptions.append(str(e))
+            Thread(target=self.resync, args=(pair,), daemon=True).start()
+            return False
+        if changed and self.books.get(pair) is not local.book and local.synced:
+            self.books[pair] = local.book  # Also replaces a cached book
+        return changed
+
+    def resync(self, pair):
+        """Load a fresh REST snapshot into the local diff book, retrying with backoff until one loads."""
+        attempt = 0
+        while not self.local_books[pair].synced:  # Or another snapshot got there first
+            try:
+                snapshot = self.client.get_order_book(symbol=pair, limit=DIFF_SNAPSHOT_LIMIT)
+                if self.local_books[pair].synced:
+                    return  # Another snapshot got there while this one loaded (replay.SimClient waits for the recorded one)
+                if self.recorder is not None:
+                    self.recorder.snapshot(pair, snapshot, time.time())
+                self.local_books[pair].load_snapshot(snapshot, time.time())
+            except Exception:
+                self.exceptions.append(traceback.format_exc())
+                time.sleep(min(0.5 * 2 ** attempt, RESYNC_MAX_BACKOFF))
+                attempt += 1
+            else:
+                self.books[pair] = self.local_books[pair].book
+                self.stale.discard(pair)
+                return
+
+    def process_updates(self, pairs):
+        """Evaluate plans affected by the markets that changed since the last pass."""
+        self.pass_started = time.perf_counter_ns()
+        self.snapshot_books()
+        if self.detector is not None:
+            self.process_cycles(pairs)
+        else:
+            self.process_plans(pairs)
+        finished = time.perf_counter_ns()
+        self.evaluation_seconds.observe((finished - self.pass_started) / 1e9)
+        if self.latency is not None:
+            self.mark_evaluation(pairs, self.pass_started, finished)
+
+    def mark_evaluation(self, pairs, started, finished):
+        """Record the evaluation stages of the pass over the markets."""
+        self.latency.record("evaluation", finished - started)
+        for pair in pairs:
+            marks = self.marks.get(pair)
+            if marks is None or marks[2] > started:
+                continue  # Book was updated again during the pass
+            self.latency.record("ingestToEvaluation", started - marks[2])
+            self.latency.record("receiveToDecision", finished - marks[1])
+
+    def decision_latency(self, plan):
+        """Return stage latencies (us) from the update that triggered the plan's evaluation to now."""
+        decided = time.perf_counter_ns()
+        marks = [self.marks[market] for market in plan.path
+                 if market in self.marks and self.marks[market][2] <= self.pass_started]
+        if not marks:
+            return {}
+        event, received, ingested = max(marks, key=lambda marks_: marks_[2])  # Latest update before the pass
+        latency = {"receiveToIngest": (ingested - received) / 1e3,
+                   "ingestToEvaluation": (self.pass_started - ingested) / 1e3,
+                   "evaluation": (decided - self.pass_started) / 1e3,
+                   "receiveToDecision": (decided - received) / 1e3}
+        if event is not None:
+            latency["exchangeToReceive"] = (received - event) / 1e3
+        return latency
+
+    def log_latency(self, rows):
+        """Queue the periodic stage latency report for BigQuery."""
+        for row in rows:
+            row["botId"] = self.plans[0].instance_id if self.plans else None
+        self.sink.append("bullseye", "latency", rows)
+
+    def snapshot_books(self):
+        """Copy the latest books into process_books."""
+        for pair in list(self.process_books):
+            if pair not in self.books:
+                del self.process_books[pair]  # Book is out of sync
+        # Makes sure these books won't be overwritten while processing
+        for pair, book in list(self.books.items()):
+            snapshot = self.process_books.get(pair)
+            if snapshot is None:
+                snapshot = self.process_books[pair] = Book(pair, book.capacity)
+            book.copy_into(snapshot)
+
+    def process_plans(self, pairs):
         """Check if book updates produced profitable opportunities and act if so."""
         try:
-            valid_plans = [plan for plan in self.plans if pair in plan.path]  # Only proccess plans which include updated market
+            valid_ids = self.compiled.affected(pairs)  # Only proccess plans which include updated markets
+            if len(self.process_books) < len(self.plan_markets):
+                # Skip plans that read books which are being resynced
+                valid_ids = [i for i in valid_ids if all(market in self.process_books for market in self.compiled[i].markets)]
+            estimates = self.engine.evaluate(self.process_books, valid_ids)
+            self.plans_evaluated.inc(value=len(valid_ids))
+            # Plans that lose at start_amount may still earn at a smaller size
+            sizable = self.engine.top_returns(valid_ids) > 0 if self.sizing else None
+            self.act_on_estimates(valid_ids, estimates, sizable)
 
-            for plan in valid_plans:
-                opportunity = Opportunity(self, plan)
+        except Exception as e:
+            e_str = traceback.format_exc()
+            self.exceptions.append(e_str)
+
+    def act_on_estimates(self, valid_ids, estimates, sizable=None):
+        """Price candidate plans with Opportunity on process_books and execute the profitable ones.
+
+        sizable: per plan, True if its top-of-book return is positive (sized even if the estimate isn't).
+        """
+        valid_plans = [self.plans[i] for i in valid_ids]
+        for n, (plan_id, plan, estimate) in enumerate(zip(valid_ids, valid_plans, estimates)):
+            # Only candidates are priced again with Opportunity; NaN means the engine couldn't price the plan
+            if not (estimate > 0 or estimate != estimate or (sizable is not None and sizable[n])
+                    or (self.test_it and plan == valid_plans[-1])):
+                continue
+            amount = None
+            if self.sizing:
+                amount = self.trade_size(self.compiled[plan_id])
+                if amount is None and not (self.test_it and plan == valid_plans[-1]):
+                    continue  # Balances don't allow the smallest trade
+            opportunity = Opportunity(self, plan, self.compiled[plan_id], amount)
+            opportunity.find_opportunity()
+            if opportunity.profit > 0 or (self.test_it and plan == valid_plans[-1]):
+                self.act_on_opportunity(opportunity, {market for plan in valid_plans for market in plan.path})
+
+    def process_cycles(self, pairs):
+        """Find negative cycles through the markets that changed and act on the ones that are profitable at depth."""
+        try:
+            tops = {}
+            # Books that came before the first pass were never marked, their edges are set with it
+            unknown = [pair for pair in self.process_books if pair not in self.detector.known]
+            for pair in list(pairs) + unknown:
+                book = self.process_books.get(pair)
+                if book is not None:  # Missing while it's resynced
+                    tops[pair] = (float(book.bid_px[0]) if book.bid_len else None,
+                                  float(book.ask_px[0]) if book.ask_len else None)
+            for _, cycle in self.detector.cycles(tops):
+                self.cycles_found.inc()
+                plan, kernel = self.cycle_plan(cycle)
+                if plan is None or any(market not in self.process_books for market in kernel.markets):
+                    continue
+                amount = None
+                if self.sizing:
+                    amount = self.trade_size(kernel)
+                    if amount is None:
+                        continue
+                opportunity = Opportunity(self, plan, kernel, amount)
                 opportunity.find_opportunity()
-                if opportunity.profit > 0 or (self.test_it and plan == valid_plans[-1]):
-                    # Save used books before releasing the lock, so they dont get overwritten
-                    used_markets = {market for plan in valid_plans for market in plan.path}
-                    used_books = dict([(market, book) for market, book in self.process_books.items()
-                                       if market in used_markets])
-                    if self.execute:
-                        responses = opportunity.execute(async_=True)
-                        opportunity.actual_profit = format(opportunity.review_execution(responses)["balance"], ".8f") + " " + opportunity.plan.home_asset
-                        opportunity.log_responses(responses)
-                    # Log data even if execution is turned off
-                    opportunity.log_opportunity()
-                    opportunity.log_books(used_books)
-                    opportunity.to_slack()
+                if opportunity.profit > 0:
+                    self.act_on_opportunity(opportunity, set(kernel.markets))
 
         except Exception as e:
             e_str = traceback.format_exc()
             self.exceptions.append(e_str)
-        finally:
-            # Release the lock if even if exception was raised
-            self.busy = False if self.loop else True
+
+    def cycle_plan(self, cycle):
+        """Return the plan and kernel of trading around the asset cycle, (None, None) if it can't be priced.
+
+        The plan starts from the first asset of the cycle that is a home asset of the deployment and
+        has a market with every other asset of the cycle, so the leftovers can be valued.
+        """
+        if cycle in self.cycle_plans:
+            return self.cycle_plans[cycle]
+        result = (None, None)
+        for start, home in enumerate(cycle):
+            if home not in self.home_amounts:
+                continue
+            if not all(asset == home or asset + home in self.plan_markets or home + asset in self.plan_markets
+                       for asset in cycle):
+                continue
+            assets = cycle[start:] + cycle[:start]
+            market_conds = [self.market_conds[self.detector.symbol(asset, next_asset)]
+                            for asset, next_asset in zip(assets, assets[1:] + assets[:1])]
+            plan = Plan(market_conds, home, self.home_amounts[home], self.plans[0].instance_id, "ARBITRAGE", home, home)
+            result = (plan, PlanKernel(None, plan, self.plan_markets))
+            break
+        self.cycle_plans[cycle] = result
+        return result
+
+    def act_on_opportunity(self, opportunity, used_markets):
+        """Execute the priced opportunity and log it with the books of the markets."""
+        plan = opportunity.plan
+        if self.latency is not None:
+            opportunity.latency = self.decision_latency(plan)
+        # Save used books, so they dont get overwritten by the next pass
+        used_books = dict([(market, book) for market, book in self.process_books.items()
+                           if market in used_markets])
+        if (self.execute and not self.stale.intersection(used_markets)
+                and (self.filters is None or passes_filters(opportunity.instructions, self.filters))):
+            responses = opportunity.execute(async_=True)
+            if self.latency is not None and responses:
+                opportunity.order_latency(responses)  # Before log_responses drops transactTime
+            if self.balances is not None and responses:
+                self.apply_fills(opportunity.plan, responses)  # Until the account is reloaded
+                self.balances_changed.set()
+            opportunity.actual_balance = opportunity.review_execution(responses)["balance"]
+            opportunity.actual_profit = format(opportunity.actual_balance, ".8f") + " " + opportunity.plan.home_asset
+            opportunity.log_responses(responses)
+        self.opportunities_found.inc((opportunity.execution_status,))
+        # Log data even if execution is turned off
+        opportunity.log_opportunity()
+        opportunity.log_books(used_books)
+        opportunity.to_slack()
+        if self.on_opportunity is not None:
+            self.on_opportunity(opportunity)
+
+    def trade_size(self, kernel):
+        """Return the most profitable start amount of the plan kernel on process_books, within the size limits."""
+        balances = None
+        if self.balances is not None:
+            balances = {asset: amount * SIZING_BALANCE_SHARE for asset, amount in self.balances.items()}
+        low = 0.
+        if self.filters is not None:
+            low = min_size(kernel, self.process_books, self.filters)  # Smallest trade the exchange accepts
+            if low is None:
+                return None
+        return optimal_size(kernel, self.process_books, FEE, low=low, high=kernel.start_amount * SIZING_MAX_MULTIPLE,
+                            balances=balances)
+
+    def apply_fills(self, plan, responses):
+        """Move the filled amounts and commissions of the orders between the known balances."""
+        assets = {action.symbol: (action.base, action.quote) for action in plan.actions}
+        for response in responses:
+            base, quote = assets[response["symbol"]]
+            sign = 1 if response["side"] == "BUY" else -1
+            self.balances[base] = self.balances.get(base, 0.) + sign * float(response["executedQty"])
+            self.balances[quote] = self.balances.get(quote, 0.) - sign * float(response["cummulativeQuoteQty"])
+            for fill in response.get("fills", ()):
+                asset = fill["commissionAsset"]
+                if asset is None:
+                    continue  # Reconciled order, the commission is unknown
+                self.balances[asset] = self.balances.get(asset, 0.) - float(fill["commission"])
+
+    def refresh_balances(self):
+        """Reload the free balances every BALANCE_REFRESH_INTERVAL and right after every execution.
+
+        Fills move the balances as soon as the orders return (apply_fills); the reload also takes the
+        deposits, withdrawals and trades that other clients of the account made.
+        """
+        while True:
+            self.balances_changed.wait(BALANCE_REFRESH_INTERVAL)
+            self.balances_changed.clear()
+            try:
+                self.balances = rebalance.get_account_balances(self.client)
+            except Exception:
+                self.exceptions.append(traceback.format_exc())
 
     def start_listening(self):
         """Start the websocket."""
-        stream_names = [pair.lower() + "@depth10@100ms" for pair in self.plan_markets]
-        self.start_multiplex_socket(stream_names, self.handle_message)
-        if not reactor.running: self.start()  # Start the reactor if not running (for the restart)
+        stream_names = list(self.stream_symbols) + list(self.ticker_symbols)
+        if self.record_path and self.recorder is None:
+            self.recorder = Recorder(self.record_path)
+        if self.depth_mode == "diff":
+            self.local_books = {pair: DiffBook(pair) for pair in self.plan_markets}  # Buffer events until snapshots arrive
+        if self.feed_mode == "asyncio":
+            self.feed = AsyncFeed(stream_names, self.handle_message, url=self.stream_url,
+                                  on_error=lambda exc: self.exceptions.append(exc))
+            self.feed.start()
+        elif self.feed_mode == "bus":
+            self.books = {}  # Filled from the bus, no REST snapshots needed
+            self.feed = BusFeed(self.plan_markets, self.handle_bus_update)
+            self.feed.start()
+        else:
+            self.start_multiplex_socket(stream_names, self.handle_message)
+            if not reactor.running: self.start()  # Start the reactor if not running (for the restart)
+        self.scheduler.start()  # Keeps running through restarts
+        if self.metrics_port is not None and self.metrics_server is None:
+            metrics_server = MetricsServer(self.metrics, port=self.metrics_port)
+            try:
+                metrics_server.start()
+                self.metrics_server = metrics_server
+            except OSError:
+                # E.g. the port is taken by another instance; the bot trades without the endpoint
+                self.exceptions.append(traceback.format_exc())
+        if self.latency is not None:
+            self.latency.start()
+        self.sink.start()
+        self.notifier.start()
+        if self.execute:
+            self.order_entry.start()
+            if self.filters is None:
+                self.filters = market_filters(self.client.get_exchange_info(), self.plan_markets)
+            if self.sizing and self.balances is None:
+                self.balances = rebalance.get_account_balances(self.client)
+            if self.sizing and self.balance_refresher is None:
+                self.balance_refresher = Thread(target=self.refresh_balances, name="balances", daemon=True)
+                self.balance_refresher.start()
         atexit.register(self.upon_closure)  # Close the sockets when you close the terminal
-        self.books = self.get_intial_books(self.plan_markets)  # Get initial books
+        if self.feed_mode != "bus":
+            self.load_books()
         self.last_book_update = time.time()
 
+    def close(self):
+        """Close the market data connections."""
+        if self.feed is not None:
+            self.feed.stop()
+            self.feed = None
+        else:
+            BinanceSocketManager.close(self)
+        if self.feed_mode != "bus" and self.books:
+            self.save_books()  # The next start begins from them
+
     def upon_closure(self):
         """Exit the thread and stop the reactor when the bot stops."""
+        self.scheduler.stop()
+        self.order_entry.stop()
+        if self.latency is not None:
+            self.latency.stop()  # Last report goes to the sink before it stops
+        self.sink.stop()
+        self.notifier.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
         self.close()
         if reactor.running: reactor.stop()
         print("GOODBYE!")
 
-    def get_intial_books(self, pairs):
-        """Return the initial books for all markets via REST API calls."""
-        print("Fetching initial books".center(80, "~"))
-        t1 = time.time()
-        books = {}
-        counter = 0
-        for pair in pairs:
-            print(f"{pair} fetched!")
-            books[pair] = self.client.get_order_book(symbol=pair)
-            books[pair]["timestamp"] = time.time()
-            # If there were 5 API calls in less than a second wait a second before continuing
-            if counter == 5 and (time.time()-t1 < 1):
-                time.sleep(1)
-                counter = 0
-                t1 = time.time()
-            else:
-                counter += 1
-        print(f"Finished! Time taken: {time.time() - t1} sec.")
-        os.system("clear")
+    def load_books(self):
+        """Start from the books at hand and load fresh snapshots of all markets.
+
+        Books kept through a restart or cached by the last run (not older than BOOK_CACHE_MAX_AGE) are
+        evaluated right away while the snapshots load in the background; their opportunities aren't
+        executed until a live book replaces them: the market's snapshot, or in the partial depth mode
+        also its first stream update. Without them the snapshots are waited for.
+        """
+        now = time.time()
+        books = {pair: book for pair, book in self.books.items()
+                 if book.timestamp is not None and now - book.timestamp <= BOOK_CACHE_MAX_AGE}
+        if len(books) < len(self.plan_markets):
+            for pair, data in load_cached_books(self.book_cache_path, BOOK_CACHE_MAX_AGE).items():
+                if pair in self.plan_markets and pair not in books:
+                    books[pair] = Book(pair)
+                    books[pair].fill(data, data["timestamp"])
+        self.stale = set(books)
+        self.books = books
+        if len(books) == len(self.plan_markets):
+            print(f"Starting from {len(books)} cached books, fetching fresh ones in the background.")
+            for pair in books:
+                self.book_updated(pair)
+            Thread(target=self.refresh_books, daemon=True).start()
+        else:
+            self.refresh_books()
 
-        return books
+    def refresh_books(self):
+        """Fetch snapshots of all markets within the REST weight budget and cache the books."""
+        print("Fetching initial books".center(80, "~"))
+        limit = DIFF_SNAPSHOT_LIMIT if self.depth_mode == "diff" else 100
+        failed = self.book_loader.load(list(self.plan_markets), self.on_snapshot, limit=limit,
+                                       on_error=self.exceptions.append)
+        print(f"Finished! {len(self.plan_markets) - len(failed)} books in {self.book_loader.seconds:.2f} sec.")
+        for pair in failed:
+            if self.depth_mode == "diff":
+                Thread(target=self.resync, args=(pair,), daemon=True).start()
+        self.save_books()
+
+    def on_snapshot(self, pair, snapshot, timestamp):
+        """Replace the market's book with the fetched snapshot unless the stream updated it first."""
+        if self.depth_mode == "diff":
+            if self.recorder is not None:
+                self.recorder.snapshot(pair, snapshot, timestamp)
+            local = self.local_books[pair]
+            local.load_snapshot(snapshot, timestamp)
+            if not local.synced:
+                return  # Went out of sync meanwhile, resync loads the next snapshot
+            self.books[pair] = local.book
+            self.stale.discard(pair)
+        else:
+            book = Book(pair)
+            book.fill(snapshot, timestamp)
+            with self.books_lock:  # So a stream update can't land between the check and the replacement
+                if pair in self.books and pair not in self.stale:
+                    return  # The stream got there first
+                self.books[pair] = book
+                self.stale.discard(pair)
+        self.book_updated(pair)
+
+    def save_books(self):
+        """Write the current books to the snapshot cache."""
+        try:
+            save_books(self.books, self.book_cache_path)
+        except Exception:
+            self.exceptions.append(traceback.format_exc())
 
 
 class Opportunity:
     """Plan with the current markets' books."""
 
-    def __init__(self, bot, plan):
+    def __init__(self, bot, plan, kernel=None, amount=None):
         self.bot = bot  # Instance of the bot
         self.plan = plan  # Opportunity's plan
+        self.kernel = kernel or PlanKernel(None, plan, bot.plan_markets)  # Precompiled legs and wallet layout
+        self.start_amount = plan.start_amount if amount is None else amount  # Sized to the depth or the plan's
 
         self.profit = None
         self.instructions = None
         self.final_balance = None
         self.fees = None
         self.execution_time = None
+        self.order_timings = []  # perf_counter_ns marks of every order (order_entry)
+        self.latency = {}  # Stage -> us, from the book update that triggered the opportunity to the orders
         self.actual_profit = None
+        self.actual_balance = None  # Result of review_execution in the home asset
         self.success_ratio = None
         self.execution_msg = ""
         self._async = False
@@ -148,7 +800,7 @@ class Opportunity:
 
     def find_opportunity(self):
         """Find if plan is profitable based on current order books."""
-        results = self.simulate_trade(self.plan.actions, self.plan.start_amount, self.plan.home_asset, FEE)
+        results = self.simulate_trade(self.kernel, FEE)
         norm_wallet = self.normalize_wallet(results["wallet"], self.plan.home_asset)  # Convert all remaining assets to normalizing asset
         norm_fees = self.normalize_wallet(results["fees"], self.plan.home_asset)  # Convert all fee assets into normalizing asset
         final_balance = sum(norm_wallet.values())  # Final balance, without the fees
@@ -156,56 +808,40 @@ class Opportunity:
         self.instructions = results["instructions"]
         self.final_balance = final_balance
         self.fees = sum(norm_fees.values())
-        self.profit = self.final_balance - self.plan.start_amount - self.fees
+        self.profit = self.final_balance - self.start_amount - self.fees
 
-    def simulate_trade(self, actions, starting_amount, start_asset, fee):
+    def simulate_trade(self, kernel, fee):
         """Simulate plan execution with the current order books and return the results."""
-
-        def rebalance_wallet(wallet_, asset, qnt):
-            """Add the asset amount to the wallet and return rebalanced wallet."""
-            if asset not in wallet_.keys():
-                wallet_[asset] = qnt
-            else:
-                wallet_[asset] += qnt
-
-            return wallet_
-
-        Instruction = namedtuple("Instruction", "price amount side symbol")
         instructions = []
-        wallet = {start_asset: starting_amount}
-        fees = {}  # Separate wallet for the fees
-        holding = starting_amount
-
-        for action in actions:
-            side = {"BUY": "asks", "SELL": "bids"}[action.side]
-
-            if action.side == 'BUY':
-                best_orders, price = self.market_price(action.symbol, side, holding, inverse=True)
+        wallet = [0.] * len(kernel.assets)  # Indexed by the kernel's wallet slots
+        wallet[0] = self.start_amount
+        fees = [0.] * len(kernel.assets)  # Separate wallet for the fees
+        holding = self.start_amount
+
+        for leg in kernel.legs:
+            best_orders, price = self.market_price(leg.symbol, leg.book_side, holding, inverse=leg.inverse)
+            if leg.inverse:
                 # If multiple orders with different prices fill our action then select the one with the lowest price
                 # This works because the the platform looks for order with specified price or better one
                 worst_price = max(best_orders, key=lambda x: x[0])[0]
                 money_in_full = holding * price  # Amount before the qnt_filter is applied
-                money_in = self.apply_qnt_filter(money_in_full, action)  # Rounds to the allowed decimal place for the market
-                asset_in = action.base
+                money_in = int(money_in_full * leg.scale) / leg.scale  # Rounds down to the allowed decimal place for the market
                 money_out = money_in / price
-                asset_out = action.quote
-                instructions.append(Instruction(price=worst_price, amount=money_in, side="BUY", symbol=action.symbol))
+                instructions.append(Instruction(price=worst_price, amount=money_in, side="BUY", symbol=leg.symbol))
             else:
-                best_orders, price = self.market_price(action.symbol, side, holding)
                 worst_price = min(best_orders, key=lambda x: x[0])[0]
-                money_out_full = holding
-                money_out = self.apply_qnt_filter(money_out_full, action)
-                asset_out = action.base
+                money_out = int(holding * leg.scale) / leg.scale
                 money_in = money_out * price
-                asset_in = action.quote
-                instructions.append(Instruction(price=worst_price, amount=money_out, side="SELL", symbol=action.symbol))
+                instructions.append(Instruction(price=worst_price, amount=money_out, side="SELL", symbol=leg.symbol))
             # Rebalance the wallets
-            wallet = rebalance_wallet(wallet, asset_out, -money_out)
-            wallet = rebalance_wallet(wallet, asset_in, money_in)
-            fees = rebalance_wallet(fees, asset_in, money_in * fee)
+            wallet[leg.asset_out] -= money_out
+            wallet[leg.asset_in] += money_in
+            fees[leg.asset_in] += money_in * fee
             holding = money_in
 
-        return {"wallet": wallet, "fees": fees, "instructions": instructions}
+        return {"wallet": dict(zip(kernel.assets, wallet)),
+                "fees": dict([(kernel.assets[slot], fees[slot]) for slot in kernel.fee_slots]),
+                "instructions": instructions}
 
     def normalize_wallet(self, wallet_, normalizing_to):
         """Return wallet in which all assets are normalized to one normalizing asset."""
@@ -229,7 +865,7 @@ class Opportunity:
         """Returns the best price for the action and amount."""
         if pair not in self.bot.process_books:
             raise Exception(f"Pair {pair} not in the books.")
-        orders = self.bot.process_books[pair][side]
+        orders = self.bot.process_books[pair].orders(side)
         return self.get_best_orders(orders, amount, inverse=inverse)
 
     def apply_qnt_filter(self, qnt, action, round_type='down'):
@@ -240,11 +876,10 @@ class Opportunity:
 
     @staticmethod
     def get_best_orders(orders, money_in, inverse=False):
-        """Return best orders and overall price for the orders and input-amount."""
+        """Return best orders and overall price for the orders (float price, amount pairs) and input-amount."""
         avl = money_in
         money_out = []  # Best orders (price, amount)
         for price, amount in orders:
-            price, amount = float(price), float(amount)
             diff = avl - (amount if not inverse else amount * price)
             if diff <= 0:
                 remaining = avl if not inverse else avl / price
@@ -274,8 +909,8 @@ class Opportunity:
               f"_OrdersExecution time:_ *{self.execution_time}*\n" \
               f"_Status_: *{self.execution_status}*\n" \
               f"_Execution msg_: *{self.execution_msg}*\n" \
-              f"_Start amount:_ *{self.plan.start_amount} {self.plan.home_asset}*\n"
-        hp.send_to_slack(msg, SLACK_KEY, self.bot.slack_group, emoji=':blocky-money:')
+              f"_Start amount:_ *{self.start_amount:.8f} {self.plan.home_asset}*\n"
+        self.bot.notifier.send(msg, self.bot.slack_group, emoji=':blocky-money:', digest="opportunities")
 
     def execute(self, async_=False):
         """Execute the opportunity and return the response."""
@@ -292,13 +927,11 @@ class Opportunity:
         """Execute opportunity synchronously."""
         # TODO Needs to be updated
         responses = []
-        for instruction in self.instructions:
-            response = self.bot.client.create_order(symbol=instruction.symbol,
-                                                    side=instruction.side,
-                                                    type="LIMIT",
-                                                    timeInForce="FOK",
-                                                    quantity=instruction.amount,
-                                                    price=instruction.price)
+        decimals = [action.decimals for action in self.plan.actions]
+        for instruction, decimals_ in zip(self.instructions, decimals):
+            order = self.bot.order_entry.place([instruction], "FOK", [decimals_])[0]
+            response = order.result(ORDER_RESULT_TIMEOUT)
+            self.order_timings.append(order.timing)
             if response["status"] == "EXPIRED":
                 self.execution_status = f"FAIL - {len(responses)} steps completed"
                 return responses
@@ -313,46 +946,39 @@ class Opportunity:
         self.execution_status = "PASS"
         success_message = "| "
         responses = []
-        threads = []
-        with concurrent.futures.ThreadPoolExecutor() as executor:
-            for instruction in self.instructions:
-                thread = executor.submit(self.bot.client.create_order,
-                                         symbol=instruction.symbol,
-                                         side=instruction.side,
-                                         type="LIMIT",
-                                         timeInForce="IOC",
-                                         quantity=instruction.amount,
-                                         price=instruction.price
-                                         )
-                threads.append(thread)
-
-            for num, thread in enumerate(threads):
-                try:
-                    response = thread.result()
-                    response["localTimestamp"] = time.time()
-                    responses.append(response)
-                except BinanceAPIException as e:
-                    executor.shutdown(wait=True)  # Wait for all the threads to execute
-                    self.bot.busy = False if self.bot.loop else True  # Release the lock as soon as the execution is finished
-
-                    if e.code == -2010:
-                        failed_action = self.plan.actions[num]
-                        failed_asset = failed_action.base if failed_action.side == "SELL" else failed_action.quote
-                        msg = f"> *{failed_asset}* balance is too low!"
-                        # msg += f"\n```{rebalance.main()}```"
-                        self.execution_status = "MISSED"
-                        success_message += f"{failed_action.symbol} 0% | "
-                    else:
-                        msg = f"_Status_code_: *{e.status_code}*\n" \
-                              f"_Code_: *{e.code}*\n" \
-                              f"_Message_: *{e.message}*\n"
-                    hp.send_to_slack(msg, SLACK_KEY, self.bot.slack_group, emoji=':blocky-sweat:')
-                    if e.status_code == 429: os._exit(1)  # Exit if limit is reached
-                    break  # Stop wasting the resources and time if whole opporunity won't be filled
-            else:
-                self.bot.busy = False if self.bot.loop else True  # Release the lock as soon as the execution is finished
+        # Orders are signed here and sent by the order entry's sender threads
+        orders = self.bot.order_entry.place(self.instructions, "IOC", [action.decimals for action in self.plan.actions])
+        # All legs are sent at once, so the responses of the others are kept when one fails
+        for num, order in enumerate(orders):
+            try:
+                response = order.result(ORDER_RESULT_TIMEOUT)
+                response["localTimestamp"] = time.time()
+                responses.append(response)
+                self.order_timings.append(order.timing)  # Same order as responses
+            except (ConnectionError, concurrent.futures.TimeoutError) as e:
+                # Order response was lost and the order wasn't found over REST (order_entry.WsOrderEntry), or no
+                # response came at all
+                self.execution_status = "MISSED"
+                success_message += f"{self.plan.actions[num].symbol} ? | "
+                msg = f"> *{self.plan.actions[num].symbol}* order: {str(e) or f'No response in {ORDER_RESULT_TIMEOUT} sec.'}"
+                self.bot.notifier.send(msg, self.bot.slack_group, emoji=':blocky-sweat:', digest="order errors")
+            except BinanceAPIException as e:
+                if e.code == -2010:
+                    failed_action = self.plan.actions[num]
+                    failed_asset = failed_action.base if failed_action.side == "SELL" else failed_action.quote
+                    msg = f"> *{failed_asset}* balance is too low!"
+                    # msg += f"\n```{rebalance.main()}```"
+                    self.execution_status = "MISSED"
+                    success_message += f"{failed_action.symbol} 0% | "
+                else:
+                    msg = f"_Status_code_: *{e.status_code}*\n" \
+                          f"_Code_: *{e.code}*\n" \
+                          f"_Message_: *{e.message}*\n"
+                self.bot.notifier.send(msg, self.bot.slack_group, emoji=':blocky-sweat:', digest="order errors")
+                if e.status_code == 429:
+                    self.bot.notifier.stop()  # Post the queued messages first
+                    os._exit(1)  # Exit if limit is reached
 
-            executor.shutdown(wait=True)  # Wait for all the threads to execute
 
         self.success_ratio = 0
         for response in responses:
@@ -407,8 +1033,25 @@ class Opportunity:
 
         return {'end_wallet': norm_wallet, 'fills': orders_fills, 'balance': sum(norm_wallet.values())}
 
+    def order_latency(self, responses):
+        """Add order stages of the slowest order to the latency and record every order's stages."""
+        monitor = self.bot.latency
+        stages = {}
+        for timing, response in zip(self.order_timings, responses):
+            if "sent" not in timing:
+                continue
+            order_stages = {"decisionToSend": timing["sent"] - timing["decided"]}
+            if "received" in timing:
+                order_stages["roundTrip"] = timing["received"] - timing["sent"]
+            if "transactTime" in response:
+                order_stages["sendToExchange"] = monitor.clock.to_local_ns(response["transactTime"]) - timing["sent"]
+            for stage, ns in order_stages.items():
+                monitor.record(stage, ns)
+                stages[stage] = max(stages.get(stage, ns), ns)
+        self.latency.update({stage: ns / 1e3 for stage, ns in stages.items()})
+
     def log_responses(self, responses):
-        """Log execution reponses to BigQuery."""
+        """Queue execution reponses for BigQuery."""
         responses_rows = []
         for response in responses:
             response["id"] = hash(str(response["orderId"]) + response["symbol"] + PLATFORM)
@@ -421,16 +1064,14 @@ class Opportunity:
             del response["orderListId"]
             del response["cummulativeQuoteQty"]
             responses_rows.append(response)
-        errors = hp.append_rows(rows=responses_rows, dataset="bullseye", table="trades")
-        if errors:
-            raise Exception(errors)
+        self.bot.sink.append("bullseye", "trades", responses_rows)
 
     def log_opportunity(self):
-        """Log opportunity to BigQuery."""
+        """Queue opportunity for BigQuery."""
         opportunity = {
             "id": self.id,
             "foundAtTimestamp": self.timestamp,
-            "startAmount": self.plan.start_amount,
+            "startAmount": self.start_amount,
             "startCurrency": self.plan.home_asset,
             "estimatedProfitAmount": round(self.final_balance - self.fees, 9),
             "estimatedProfitCurrency": self.plan.profit_asset,
@@ -439,27 +1080,25 @@ class Opportunity:
             "strategyType": self.plan.strategy,
             "botId": self.plan.instance_id
         }
-        errors = hp.append_rows(rows=[opportunity], dataset="bullseye", table="opportunities")
-        if errors:
-            raise Exception(errors)
+        if self.bot.latency is not None:  # Stage columns only exist with the latency schema
+            opportunity.update({f"{stage}Us": self.latency.get(stage) for stage in STAGES})
+        self.bot.sink.append("bullseye", "opportunities", [opportunity])
 
     def log_books(self, books):
-        """Log books to BigQuery"""
+        """Queue books for BigQuery."""
         books_rows = []
         for symbol, book in books.items():
             book_row = {
-                "id": hash(str(book["lastUpdateId"]) + symbol + "BINANCE"),
-                "receivedAtTimestamp": book["timestamp"],
+                "id": hash(str(book.last_update_id) + symbol + "BINANCE"),
+                "receivedAtTimestamp": book.timestamp,
                 "opportunityId": self.id,
                 "exchange": PLATFORM,
                 "symbol": symbol,
-                "bids": [{"price": order[0], "qty": order[1]} for order in book["bids"]],
-                "asks": [{"price": order[0], "qty": order[1]} for order in book["asks"]]
+                "bids": [{"price": format(price, ".8f"), "qty": format(qty, ".8f")} for price, qty in book.orders("bids")],
+                "asks": [{"price": format(price, ".8f"), "qty": format(qty, ".8f")} for price, qty in book.orders("asks")]
             }
             books_rows.append(book_row)
-        errors = hp.append_rows(rows=books_rows, dataset="bullseye", table="books")
-        if errors:
-            raise Exception(errors)
+        self.bot.sink.append("bullseye", "books", books_rows)
 
 
 class Plan:
@@ -477,9 +1116,6 @@ class Plan:
 
     def _get_actions(self, plan):
         """Return list of actions."""
-        # Action is execution condition for a market
-        Action = namedtuple("Action", "symbol side quote base decimals exchange")
-
         current_asset = self.home_asset
         actions = []
         for market_cond in plan:
@@ -0,0 +1,261 @@
+"""Latest order books shared between processes through shared memory.
+
+One feed process writes the books of all subscribed symbols into a shared memory region, bot instances
+and tools map it and read from it. Every symbol slot has a sequence number that is odd while the feed is
+writing it (seqlock), so readers retry instead of reading half-written books.
+
+Run the feed process with:
+    python book_bus.py [deployment settings files ...]
+"""
+
+
+import sys
+import json
+import time
+import atexit
+from threading import Thread
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+from config import BOOK_BUS_NAME, BOOK_BUS_DEPTH, BOOK_BUS_POLL_INTERVAL, DEPLOYMENT_SETTINGS_SOURCE, STREAM_URL, API_URL
+from order_book import Book
+from exceptions import NotABookBus
+
+
+MAGIC = 0x424f4f4b42555331  # "BOOKBUS1"
+NAME_SIZE = 16  # Bytes per symbol name
+HEADER = 4  # int64: magic, symbols, depth, reserved
+META = 4  # int64 per symbol: sequence, last update id, bid levels, ask levels
+
+
+class _Layout:
+    """Numpy views of the shared memory region."""
+
+    def __init__(self, buf, symbols, depth):
+        n = len(symbols)
+        offset = HEADER * 8
+        self.names = np.ndarray((n,), dtype=f"S{NAME_SIZE}", buffer=buf, offset=offset)
+        offset += n * NAME_SIZE
+        offset += -offset % 8  # Align to 8 bytes
+        self.meta = np.ndarray((n, META), dtype=np.int64, buffer=buf, offset=offset)
+        offset += n * META * 8
+        self.timestamps = np.ndarray((n,), dtype=np.float64, buffer=buf, offset=offset)
+        offset += n * 8
+        self.levels = np.ndarray((n, 4, depth), dtype=np.float64, buffer=buf, offset=offset)  # bid px, bid qty, ask px, ask qty
+
+    @staticmethod
+    def size(symbols, depth):
+        n = len(symbols)
+        names = n * NAME_SIZE + (-(HEADER * 8 + n * NAME_SIZE) % 8)
+        return HEADER * 8 + names + n * META * 8 + n * 8 + n * 4 * depth * 8
+
+
+class BookBusWriter:
+    """Feed side of the bus: creates the region and publishes books into it.
+
+    The seqlock allows one writer, so all books must be published from the same thread.
+    """
+
+    def __init__(self, symbols, name=BOOK_BUS_NAME, depth=BOOK_BUS_DEPTH):
+        self.symbols = list(symbols)
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.depth = depth
+        size = _Layout.size(self.symbols, depth)
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # Left by a feed that didn't exit cleanly; readers still mapping it reopen the new one on restart
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((HEADER,), dtype=np.int64, buffer=self.shm.buf)
+        self.layout = _Layout(self.shm.buf, self.symbols, depth)
+        self.layout.names[:] = [symbol.encode() for symbol in self.symbols]
+        self.layout.meta[:] = 0
+        header[:] = (MAGIC, len(self.symbols), depth, 0)
+
+    def publish(self, book):
+        """Write the book's levels (up to the bus depth) into its slot."""
+        i = self.index[book.symbol]
+        meta, levels = self.layout.meta[i], self.layout.levels[i]
+        bid_len, ask_len = min(book.bid_len, self.depth), min(book.ask_len, self.depth)
+        meta[0] += 1  # Odd - write in progress
+        levels[0, :bid_len] = book.bid_px[:bid_len]
+        levels[1, :bid_len] = book.bid_qty[:bid_len]
+        levels[2, :ask_len] = book.ask_px[:ask_len]
+        levels[3, :ask_len] = book.ask_qty[:ask_len]
+        meta[1] = book.last_update_id or 0
+        meta[2], meta[3] = bid_len, ask_len
+        self.layout.timestamps[i] = book.timestamp
+        meta[0] += 1
+
+    def close(self):
+        """Release and remove the region."""
+        self.layout = None
+        self.shm.close()
+        self.shm.unlink()
+
+
+class BookBusReader:
+    """Bot or tool side of the bus: maps the region with read-only views."""
+
+    def __init__(self, name=BOOK_BUS_NAME):
+        self.shm = shared_memory.SharedMemory(name=name)
+        try:
+            # Readers must not remove the region when they exit, the feed owns it
+            resource_tracker.unregister(self.shm._name, "shared_memory")
+        except Exception:
+            pass
+        if self.shm.size < HEADER * 8 or np.ndarray((HEADER,), dtype=np.int64, buffer=self.shm.buf)[0] != MAGIC:
+            self.shm.close()
+            raise NotABookBus(f"Shared memory {name} is not a book bus.")
+        header = np.ndarray((HEADER,), dtype=np.int64, buffer=self.shm.buf)
+        n, self.depth = int(header[1]), int(header[2])
+        self.layout = _Layout(self.shm.buf, [None] * n, self.depth)
+        for array in (self.layout.names, self.layout.meta, self.layout.timestamps, self.layout.levels):
+            array.flags.writeable = False
+        self.symbols = [name.decode() for name in self.layout.names]
+        self.index = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+    def sequences(self):
+        """Return a copy of the slots' sequence numbers."""
+        return self.layout.meta[:, 0].copy()
+
+    def read(self, symbol, book=None):
+        """Copy a consistent state of the symbol's book into book (new one by default) and return it."""
+        i = self.index[symbol]
+        book = book or Book(symbol, self.depth)
+        meta, levels = self.layout.meta[i], self.layout.levels[i]
+        while True:
+            sequence = meta[0]
+            if sequence % 2:
+                continue  # Feed is writing
+            bid_len, ask_len = int(meta[2]), int(meta[3])
+            bid_px, bid_qty = levels[0, :bid_len].copy(), levels[1, :bid_len].copy()
+            ask_px, ask_qty = levels[2, :ask_len].copy(), levels[3, :ask_len].copy()
+            last_update_id, timestamp = int(meta[1]), float(self.layout.timestamps[i])
+            if meta[0] == sequence:
+                break
+        book.load(bid_px, bid_qty, ask_px, ask_qty, last_update_id or None, timestamp)
+        return book
+
+    def ready(self, symbol):
+        """Return True if the feed has published the symbol at least once."""
+        return self.layout.meta[self.index[symbol], 0] > 0
+
+    def close(self):
+        self.layout = None
+        self.shm.close()
+
+
+class BusFeed:
+    """Stand-in for a websocket feed that follows the bus and reports changed books.
+
+    `on_update(symbol, book)` is called from the polling thread with the bot's copy of the book.
+    """
+
+    def __init__(self, symbols, on_update, name=BOOK_BUS_NAME, poll_interval=BOOK_BUS_POLL_INTERVAL):
+        self.reader = BookBusReader(name)
+        missing = set(symbols) - set(self.reader.index)
+        if missing:
+            raise Exception(f"Book bus {name} doesn't carry {sorted(missing)}.")
+        self.slots = np.array([self.reader.index[symbol] for symbol in symbols], dtype=np.int64)
+        self.symbols = list(symbols)
+        self.books = {symbol: Book(symbol, self.reader.depth) for symbol in symbols}
+        self.on_update = on_update
+        self.poll_interval = poll_interval
+        self.running = False
+        self.thread = None
+        self.messages = 0
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self._run, name="bus", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout)
+        self.reader.close()
+
+    def _run(self):
+        seen = np.zeros(len(self.slots), dtype=np.int64)
+        while self.running:
+            sequences = self.reader.layout.meta[self.slots, 0]
+            changed = np.nonzero((sequences != seen) & (sequences % 2 == 0))[0]
+            if not len(changed):
+                time.sleep(self.poll_interval)
+                continue
+            for j in changed:
+                symbol = self.symbols[j]
+                self.reader.read(symbol, self.books[symbol])
+                seen[j] = sequences[j]
+                self.messages += 1
+                self.on_update(symbol, self.books[symbol])
+
+
+def latest_prices(name=BOOK_BUS_NAME):
+    """Return {symbol: mid price string} for all symbols on the bus, None if there is no bus to read.
+
+    Callers then take the prices from the REST API, as logger_manual does.
+    """
+    try:
+        reader = BookBusReader(name)
+    except (FileNotFoundError, NotABookBus):
+        return None
+    prices = {}
+    for symbol in reader.symbols:
+        if not reader.ready(symbol):
+            continue
+        book = reader.read(symbol)
+        if book.bid_len and book.ask_len:
+            prices[symbol] = format((book.bid_px[0] + book.ask_px[0]) / 2, ".8f")
+    reader.close()
+
+    return prices
+
+
+def run_feed(markets, name=BOOK_BUS_NAME, url=STREAM_URL, api_url=API_URL):
+    """Keep the bus filled with the latest books of the markets until interrupted.
+
+    REST snapshots are published before the stream starts, after that only the feed thread writes.
+    """
+    from book_loader import BookLoader
+    from feed import AsyncFeed
+
+    writer = BookBusWriter(sorted(markets), name=name)
+    atexit.register(writer.close)
+    streams = {market.lower() + "@depth10@100ms": market for market in markets}
+    books = {market: Book(market) for market in markets}
+
+    def on_snapshot(market, snapshot, timestamp):
+        books[market].fill(snapshot, timestamp)
+        writer.publish(books[market])
+
+    failed = BookLoader(api_url).load(sorted(markets), on_snapshot, on_error=print)  # Calls on_snapshot in this thread
+    if failed:
+        print(f"No snapshot of {failed}, they are published with the first stream update.")
+
+    def on_message(msg):
+        pair = streams[msg["stream"]]
+        books[pair].fill(msg["data"], time.time())
+        writer.publish(books[pair])
+
+    feed = AsyncFeed(list(streams), on_message, url=url, on_error=print)
+    feed.start()
+    print(f"Publishing {len(markets)} books to {name}.")
+    while True:
+        time.sleep(60)
+        print(f"{feed.messages} messages, {feed.reconnects} reconnects, {len(feed.connected)} connections")
+
+
+if __name__ == "__main__":
+    markets = set()
+    for path in sys.argv[1:] or [DEPLOYMENT_SETTINGS_SOURCE]:
+        with open(path) as ds_file:
+            deployment = json.load(ds_file)
+        markets.update(market["symbol"] for plan in deployment["plans"] for market in plan["markets"])
+    run_feed(markets)
@@ -0,0 +1,180 @@
+"""Book snapshots at startup: fetched concurrently within the REST weight budget, cached for restarts."""
+
+
+import gzip
+import json
+import os
+import tempfile
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from threading import Lock, local
+
+import requests
+from binance.client import BinanceAPIException
+
+from config import (API_URL, BOOK_LOAD_WORKERS, BOOK_LOAD_WEIGHT_BUDGET, BOOK_LOAD_RETRIES, BOOK_CACHE_MAX_AGE,
+                    ORDER_TIMEOUT)
+
+
+def depth_weight(limit):
+    """Return the request weight of a depth snapshot of `limit` levels."""
+    if limit <= 100:
+        return 1
+    if limit <= 500:
+        return 5
+    if limit <= 1000:
+        return 10
+    return 50
+
+
+class WeightBudget:
+    """Request weight per minute that the loader may use.
+
+    Counts the loader's own requests over a sliding minute and takes the exchange's used weight header
+    (all requests of the IP, orders included) when it's higher, so other traffic keeps its share.
+    """
+
+    def __init__(self, budget=BOOK_LOAD_WEIGHT_BUDGET):
+        self.budget = budget
+        self.requests = deque()  # (time, weight)
+        self.reported = (0., 0)  # (time, used weight) of the last header
+        self.lock = Lock()
+        self.waited = 0.  # Time spent waiting for the budget (sec)
+
+    def used(self, now):
+        while self.requests and self.requests[0][0] <= now - 60:
+            self.requests.popleft()
+        own = sum(weight for _, weight in self.requests)
+        reported_at, reported = self.reported
+        return max(own, reported if now - reported_at < 60 else 0)
+
+    def acquire(self, weight):
+        """Wait until the request fits in the budget and count it."""
+        while True:
+            with self.lock:
+                now = time.time()
+                reported_at, reported = self.reported
+                if now - reported_at < 60 and reported + weight > self.budget:
+                    # The exchange counts more than the loader sent, its count covers the minute before the header
+                    wait = max(reported_at + 60 - now, 0.05)
+                elif self.used(now) + weight <= self.budget or not self.requests:
+                    # Without other requests of the loader, even a request heavier than the budget goes
+                    self.requests.append((now, weight))
+                    return
+                else:
+                    wait = max(self.requests[0][0] + 60 - now, 0.05)
+            time.sleep(min(wait, 1.))
+            self.waited += min(wait, 1.)
+
+    def report(self, used):
+        """Take the used weight header of a response."""
+        with self.lock:
+            self.reported = (time.time(), used)
+
+
+class BookLoader:
+    """Fetch depth snapshots of many markets over a few warm connections, within the weight budget.
+
+    `on_book(symbol, snapshot, timestamp)` is called in the thread that runs `load` as snapshots arrive.
+    Failed requests are retried; 429/418 responses wait for their Retry-After.
+    """
+
+    def __init__(self, url=API_URL, workers=BOOK_LOAD_WORKERS, budget=None, retries=BOOK_LOAD_RETRIES,
+                 timeout=ORDER_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.workers = workers
+        self.budget = budget or WeightBudget()
+        self.retries = retries
+        self.timeout = timeout
+        self.sessions = local()  # One session (connection) per worker thread
+        # Counters
+        self.fetched = 0
+        self.failed = 0
+        self.seconds = None  # Duration of the last load
+
+    def _session(self):
+        session = getattr(self.sessions, "session", None)
+        if session is None:
+            session = self.sessions.session = requests.Session()
+        return session
+
+    def fetch(self, symbol, limit=100):
+        """Return the depth snapshot of the symbol."""
+        weight = depth_weight(limit)
+        for attempt in range(self.retries + 1):
+            self.budget.acquire(weight)
+            try:
+                response = self._session().get(f"{self.url}/api/v3/depth", params={"symbol": symbol, "limit": limit},
+                                               timeout=self.timeout)
+            except requests.RequestException:
+                if attempt == self.retries:
+                    raise
+                time.sleep(0.5 * 2 ** attempt)
+                continue
+            used = response.headers.get("X-MBX-USED-WEIGHT-1M")
+            if used is not None:
+                self.budget.report(int(used))
+            if response.status_code in (418, 429) and attempt < self.retries:
+                time.sleep(float(response.headers.get("Retry-After", 1)))
+                continue
+            if not 200 <= response.status_code < 300:
+                raise BinanceAPIException(response)
+            return response.json()
+
+    def load(self, symbols, on_book, limit=100, on_error=None):
+        """Fetch snapshots of all symbols; return the ones that failed (`on_error` gets their tracebacks)."""
+        start = time.perf_counter()
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="book-loader") as pool:
+            futures = {pool.submit(self.fetch, symbol, limit): symbol for symbol in symbols}
+            for future in as_completed(futures):
+                symbol = futures[future]
+                try:
+                    on_book(symbol, future.result(), time.time())
+                    self.fetched += 1
+                except Exception:
+                    self.failed += 1
+                    failed.append(symbol)
+                    if on_error is not None:
+                        on_error(traceback.format_exc())
+        self.seconds = time.perf_counter() - start
+        return failed
+
+    def stats(self):
+        return {"fetched": self.fetched, "failed": self.failed, "seconds": self.seconds, "waited": self.budget.waited}
+
+
+def save_books(books, path):
+    """Write the books (order_book.Book) to the snapshot cache, replacing it at once.
+
+    Every instance has its own cache (BOOK_CACHE_PATH), the temporary file is unique to the write.
+    """
+    snapshot = {symbol: {"lastUpdateId": book.last_update_id,
+                         "timestamp": book.timestamp,
+                         "bids": book.orders("bids"),
+                         "asks": book.orders("asks")} for symbol, book in list(books.items())}
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=directory, prefix=f"{os.path.basename(path)}.", suffix=".tmp",
+                                     delete=False) as temporary:
+        try:
+            with gzip.open(temporary, "wt") as cache_file:
+                json.dump({"savedAt": time.time(), "books": snapshot}, cache_file)
+        except BaseException:
+            os.unlink(temporary.name)
+            raise
+    os.replace(temporary.name, path)
+
+
+def load_cached_books(path, max_age=BOOK_CACHE_MAX_AGE):
+    """Return symbol -> depth data of the cached books that aren't older than max_age; {} without a cache."""
+    try:
+        with gzip.open(path, "rt") as cache_file:
+            cache = json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+    now = time.time()
+    return {symbol: data for symbol, data in cache["books"].items()
+            if data["timestamp"] is not None and now - data["timestamp"] <= max_age}
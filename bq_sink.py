@@ -0,0 +1,176 @@
+"""Background BigQuery sink, so logging never blocks the evaluation thread."""
+
+
+import json
+import os
+import queue
+import time
+import traceback
+from threading import Thread, Lock
+
+import helpers as hp
+from config import SINK_QUEUE_SIZE, SINK_BATCH_ROWS, SINK_FLUSH_INTERVAL, SINK_RETRIES, SINK_SPILL_DIR
+
+
+class BigQuerySink:
+    """Batch rows per table and insert them from a background thread.
+
+    `append` only puts the rows on a bounded queue; when the queue is full, rows are spilled to a
+    file per table instead. A table's rows are inserted once there are `batch_rows` of them or the
+    oldest has waited `flush_interval` seconds. Failed inserts are retried with a backoff and spilled
+    when all retries fail. Spilled rows are inserted again once the sink is idle. The spill directory
+    belongs to one instance, no other process writes to its files.
+    """
+
+    def __init__(self, queue_size=SINK_QUEUE_SIZE, batch_rows=SINK_BATCH_ROWS, flush_interval=SINK_FLUSH_INTERVAL,
+                 retries=SINK_RETRIES, spill_dir=None, on_error=None, instance_id=None):
+        self.queue = queue.Queue(queue_size)
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self.spill_dir = spill_dir if spill_dir is not None else SINK_SPILL_DIR.format(instance_id=instance_id)
+        self.on_error = on_error  # Called with the error string of rows that couldn't be inserted
+        self.buffers = {}  # (dataset, table) -> rows waiting for the insert
+        self.since = {}  # (dataset, table) -> time of the oldest row in the buffer
+        self.spill_lock = Lock()
+        self.thread = None
+        self.running = False
+
+        # Counters
+        self.rows = 0  # Rows inserted
+        self.rejected = 0  # Rows of inserts that came back with row errors
+        self.batches = 0
+        self.retried = 0
+        self.spilled = 0  # Rows written to the spill files
+
+    def start(self):
+        """Start the sender thread if it isn't running."""
+        if self.running:
+            return
+        self.running = True
+        self.thread = Thread(target=self._run, name="bq-sink", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=30):
+        """Insert everything that is waiting and stop the sender thread."""
+        if not self.running:
+            return
+        self.running = False
+        self.queue.put(None)  # Blocks until there is space, the thread keeps draining
+        self.thread.join(timeout)
+
+    def append(self, dataset, table, rows):
+        """Queue rows for the insert into the table."""
+        if not rows:
+            return
+        try:
+            self.queue.put_nowait((dataset, table, rows))
+        except queue.Full:
+            self._spill(dataset, table, rows)
+
+    def stats(self):
+        """Return the counters."""
+        return {"rows": self.rows,
+                "rejected": self.rejected,
+                "batches": self.batches,
+                "retried": self.retried,
+                "spilled": self.spilled,
+                "queued": self.queue.qsize(),
+                "buffered": sum(len(rows) for rows in self.buffers.values())}
+
+    def _run(self):
+        self._load_spilled()
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval / 4)
+            except queue.Empty:
+                item = False
+            if item is None:
+                break
+            if item:
+                dataset, table, rows = item
+                key = (dataset, table)
+                self.buffers.setdefault(key, []).extend(rows)
+                self.since.setdefault(key, time.time())
+            now = time.time()
+            for key in list(self.buffers):
+                if len(self.buffers[key]) >= self.batch_rows or now - self.since[key] >= self.flush_interval:
+                    self._flush(key)
+            if item is False and not self.buffers:
+                self._load_spilled()  # Idle, try the spilled rows again
+
+        # Stop: insert what is left
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item:
+                self.buffers.setdefault(item[:2], []).extend(item[2])
+        for key in list(self.buffers):
+            self._flush(key)
+
+    def _flush(self, key):
+        rows = self.buffers.pop(key)
+        self.since.pop(key, None)
+        for start in range(0, len(rows), self.batch_rows):
+            self._insert(key, rows[start:start + self.batch_rows])
+
+    def _insert(self, key, rows):
+        dataset, table = key
+        delay = 1
+        for attempt in range(self.retries + 1):
+            try:
+                errors = hp.client.insert_rows(hp.get_table(dataset, table), rows)  # API request
+            except Exception:
+                error = traceback.format_exc()
+                if attempt < self.retries:
+                    self.retried += 1
+                    time.sleep(delay)
+                    delay = min(delay * 2, 30)
+                continue
+            self.batches += 1
+            # Every row that wasn't inserted has errors; without skip_invalid_rows one invalid row
+            # stops the whole batch and the others are listed as "stopped"
+            failed = len({error["index"] for error in errors})
+            self.rows += len(rows) - failed
+            self.rejected += failed
+            if errors:
+                # Rejected rows won't be accepted on a retry either
+                self._error(f"BigQuery {dataset}.{table} rejected rows: {errors}")
+            return
+        self._spill(dataset, table, rows)
+        self._error(f"BigQuery {dataset}.{table}: {len(rows)} rows spilled to disk.\n{error}")
+
+    def _error(self, msg):
+        if self.on_error is not None:
+            self.on_error(msg)
+
+    def _spill_path(self, dataset, table):
+        return os.path.join(self.spill_dir, f"{dataset}.{table}.jsonl")
+
+    def _spill(self, dataset, table, rows):
+        """Append the rows to the table's spill file."""
+        with self.spill_lock:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(self._spill_path(dataset, table), "a") as spill_file:
+                for row in rows:
+                    spill_file.write(json.dumps(row) + "\n")
+            self.spilled += len(rows)
+
+    def _load_spilled(self):
+        """Move rows from the spill files into the buffers."""
+        if not os.path.isdir(self.spill_dir):
+            return
+        with self.spill_lock:
+            for filename in os.listdir(self.spill_dir):
+                if not filename.endswith(".jsonl"):
+                    continue
+                dataset, table = filename[:-len(".jsonl")].split(".", 1)
+                path = os.path.join(self.spill_dir, filename)
+                with open(path) as spill_file:
+                    rows = [json.loads(line) for line in spill_file if line.strip()]
+                os.remove(path)
+                if rows:
+                    self.buffers.setdefault((dataset, table), []).extend(rows)
+                    self.since.setdefault((dataset, table), time.time())
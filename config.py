@@ -16,9 +16,82 @@ BINANCE_SECRET = os.getenv("BINANCE_SECRET")
 SLACK_KEY = os.getenv("SLACK_KEY")
 SLACK_GROUP_TEST = "UHN9J9DLG"
 SLACK_GROUP = "bullseye"
+SLACK_DIGEST = True  # Post the first opportunity or error right away, merge the ones that follow into periodic summaries (notifier.SlackNotifier)
+SLACK_DIGEST_INTERVAL = 60  # sec
+SLACK_DIGEST_ITEMS = 5  # Distinct messages shown in a summary
+SLACK_MIN_INTERVAL = 1  # Slack allows about one message per second (sec)
+SLACK_MAX_QUEUE = 1000  # Messages waiting to be posted; more are dropped
 
 FEE = 0.00075
 PLATFORM = "BINANCE"
+SIZING = False  # Size every trade to the depth (sizing.optimal_size) instead of trading the plan's fixed start_amount
+SIZING_MAX_MULTIPLE = 10  # Largest trade as a multiple of start_amount
+SIZING_BALANCE_SHARE = 0.95  # Share of an asset's free balance that one trade may sell
+BALANCE_REFRESH_INTERVAL = 60  # Free balances are reloaded from the account this often and after every execution (sec)
+
+DEPTH_MODE = "partial"  # "partial" - 10 level snapshots, "diff" - full books kept from the diff depth stream
+DIFF_SNAPSHOT_LIMIT = 1000  # Levels of the REST snapshot a diff book starts from
+RESYNC_MAX_BACKOFF = 30  # Longest wait between the snapshot retries of a book out of sync (sec)
+BOOK_TICKER = False  # Screen plans with the real-time best bid/ask (@bookTicker) before walking the depth
+SCREEN_MARGIN = 0.001  # Top-of-book return may be this much below break-even and still pass the screen
+
+FEED = "twisted"  # Market data engine: "twisted" (python-binance socket manager), "asyncio" (feed.AsyncFeed) or "bus" (book_bus.BusFeed)
+STREAM_URL = "wss://stream.binance.com:9443"
+MAX_STREAMS_PER_CONNECTION = 1024  # Binance limit for one combined-stream connection
+FEED_CONNECTIONS = 2  # Streams are spread over at least this many connections
+
+BOOK_BUS_NAME = "binance_books"  # Shared memory region of book_bus.py
+BOOK_BUS_DEPTH = 100  # Levels per side kept on the bus
+BOOK_BUS_POLL_INTERVAL = 0.0005  # How often readers check the bus for new books (sec)
+
+EVALUATION = "plans"  # "plans" - the deployment's plans (vector_engine.BatchEngine), "graph" - negative cycles of all plan markets (cycle_detector.CycleDetector)
+CYCLE_MAX_LEGS = 4  # Longest cycle the graph evaluation looks for
+CYCLE_MIN_RETURN = 1.  # Top-of-book return (fees included) a cycle needs before its depth is priced
+
+SHARDS = 1  # Evaluation processes; with more than one, plans are split between sharding.run_shard workers
+
+API_URL = "https://api.binance.com"
+WS_API_URL = "wss://ws-api.binance.com:443/ws-api/v3"  # Websocket trading API
+ORDER_TRANSPORT = "rest"  # "rest" (order_entry.OrderEntry) or "websocket" (order_entry.WsOrderEntry, REST while it's down)
+ORDER_SENDERS = 3  # Sender threads of order_entry.OrderEntry, one warm connection each
+ORDER_KEEPALIVE_INTERVAL = 30  # Idle senders ping the API this often to keep their connections open (sec)
+ORDER_TIMEOUT = 10  # Order request timeout (sec)
+ORDER_RESULT_TIMEOUT = 30  # Longest wait for an order response, including its lookup when the response is lost (sec)
+
+BOOK_LOAD_WORKERS = 8  # Concurrent startup snapshot requests (book_loader.BookLoader)
+BOOK_LOAD_WEIGHT_BUDGET = 600  # Request weight per minute the snapshots may use, the rest is left for orders
+BOOK_LOAD_RETRIES = 3  # Retries of a failed snapshot request
+BOOK_CACHE_PATH = "./data/book_cache/{instance_id}.json.gz"  # Last books of the instance, it starts from them while fresh snapshots load
+BOOK_CACHE_MAX_AGE = 300  # Older cached books aren't used (sec)
+
+SINK_QUEUE_SIZE = 10000  # Row batches bq_sink.BigQuerySink holds before it spills to disk
+SINK_BATCH_ROWS = 500  # Rows per insert
+SINK_FLUSH_INTERVAL = 2  # Longest time rows wait for the insert (sec)
+SINK_RETRIES = 5  # Insert retries before the rows are spilled
+SINK_SPILL_DIR = "./data/spill/{instance_id}"  # Rows that couldn't be inserted, one directory per instance
+
+JOURNAL = False  # Log to the local journal (journal.Journal) instead of straight to BigQuery
+JOURNAL_DIR = "./data/journal/{instance_id}"  # One journal per instance, its segments are only written and sealed by it
+JOURNAL_BLOCK_ROWS = 64  # Rows buffered in memory before they are written to the column files
+JOURNAL_SEGMENT_ROWS = 100000  # Rows per segment
+JOURNAL_SEGMENT_AGE = 600  # Segments are sealed after this long even if they aren't full (sec)
+JOURNAL_UPLOAD = True  # Insert sealed segments into BigQuery
+JOURNAL_BOOK_LEVELS = DIFF_SNAPSHOT_LIMIT if DEPTH_MODE == "diff" else BOOK_BUS_DEPTH  # Levels per side of a journaled book; deeper ones are cut off and counted
+JOURNAL_FILLS = 64  # Fills of a journaled order; more are cut off and counted
+
+LATENCY = False  # Record hot path stage latencies (latency.LatencyMonitor); needs the bullseye.latency table and the opportunities ...Us columns
+LATENCY_REPORT_INTERVAL = 60  # Stage histograms are logged to bullseye.latency this often (sec)
+CLOCK_SYNC_INTERVAL = 600  # Server clock offset is measured again this often (sec)
+CLOCK_SYNC_SAMPLES = 5  # get_server_time requests per measurement, the fastest one counts
+
+METRICS_HOST = "127.0.0.1"  # Prometheus metrics endpoint (metrics.MetricsServer), local only
+METRICS_PORT = None  # E.g. 9108, None - no endpoint; give every instance on a host its own port ("metrics_port" setting)
+
+PROFILE_DIR = "./data/profiles"
+PROFILE_DURATION = 30  # Length of a profiling window (profiling.Profiler) (sec)
+PROFILE_MODE = "sample"  # "sample" - stack samples of all threads, "cprofile" - cProfile of the socket and evaluator threads
+PROFILE_SAMPLE_INTERVAL = 0.005  # sec
+PROFILE_MEMORY = False  # Also write the tracemalloc difference over the window
 
 
 SUPPORTED_MARKETS = [
@@ -0,0 +1,123 @@
+"""Negative cycles of the log-price graph of all markets, found from the edges that change."""
+
+
+import math
+
+import numpy as np
+
+from config import FEE, CYCLE_MAX_LEGS, CYCLE_MIN_RETURN
+
+
+class CycleDetector:
+    """Assets are nodes; every market is two edges weighted -log(rate * (1 - fee)) at the top of its book.
+
+    Selling the base at the bid gives `bid` quote per base and buying it at the ask 1/ask base per
+    quote. A cycle of negative total weight returns more than it started with, fees included. When an
+    edge gets cheaper, the cheapest walks of up to `max_legs - 1` markets back from its end to its
+    start are found by min-plus steps over the weight matrix, so the cost of an update grows with the
+    number of assets, never with the number of cycles.
+    """
+
+    def __init__(self, markets, fee=FEE, max_legs=CYCLE_MAX_LEGS, min_return=CYCLE_MIN_RETURN):
+        """markets: symbol -> (base, quote)."""
+        self.markets = dict(markets)
+        self.assets = sorted({asset for pair in self.markets.values() for asset in pair})
+        self.index = {asset: i for i, asset in enumerate(self.assets)}
+        self.log_fee = -math.log(1 - fee)
+        self.max_legs = max_legs
+        self.threshold = -math.log(min_return)  # Cycles must weigh less than this
+        self.weights = np.full((len(self.assets), len(self.assets)), np.inf)  # [from, to]
+        self.symbols = {}  # (from, to) index pair -> symbol
+        for symbol, (base, quote) in self.markets.items():
+            self.symbols[(self.index[base], self.index[quote])] = symbol
+            self.symbols[(self.index[quote], self.index[base])] = symbol
+        self.known = set()  # Markets whose edges were set
+        # Counters
+        self.updates = 0
+        self.searches = 0
+        self.found = 0
+
+    def update(self, symbol, bid, ask):
+        """Set the market's edges from its best prices (None - empty side); return edges that got cheaper."""
+        self.updates += 1
+        self.known.add(symbol)
+        base, quote = self.markets[symbol]
+        b, q = self.index[base], self.index[quote]
+        cheaper = []
+        for u, v, weight in ((b, q, -math.log(bid) + self.log_fee if bid else np.inf),
+                             (q, b, math.log(ask) + self.log_fee if ask else np.inf)):
+            if weight < self.weights[u, v]:
+                cheaper.append((u, v))
+            self.weights[u, v] = weight
+        return cheaper
+
+    def search(self, u, v):
+        """Return (weight, asset cycle) of the cheapest negative cycle through edge u -> v, starting with u.
+
+        Walks may not pass through u or v on the way back, so cycles of up to 4 legs are always
+        simple; longer walks that repeat an asset are skipped.
+        """
+        self.searches += 1
+        edge = self.weights[u, v]
+        if edge == np.inf:
+            return None
+        reach = self.weights[v].copy()  # Cheapest walk v -> node of k markets
+        reach[u] = np.inf  # u ends a walk, so it can't be passed through
+        reach[v] = np.inf
+        last = self.weights[:, u]
+        parents = []
+        best = None
+        for k in range(1, self.max_legs - 1):
+            # Walk of k markets to j, then j -> u and u -> v close a cycle of k + 2 legs
+            back = reach + last
+            j = int(back.argmin())
+            weight = back[j] + edge
+            if weight < self.threshold and (best is None or weight < best[0]):
+                best = (weight, j, list(parents))
+            if k + 2 < self.max_legs:
+                totals = reach[:, None] + self.weights
+                parent = totals.argmin(axis=0)
+                parents.append(parent)
+                reach = totals[parent, np.arange(len(parent))]
+                reach[u] = np.inf
+                reach[v] = np.inf
+        if best is None:
+            return None
+        weight, j, layer_parents = best
+        path = [j]  # Back from the node before u to v
+        for parent in reversed(layer_parents):
+            path.append(int(parent[path[-1]]))
+        path.append(v)
+        nodes = [u] + path[::-1]
+        if len(set(nodes)) != len(nodes):
+            return None
+        self.found += 1
+        return float(weight), tuple(self.assets[node] for node in nodes)
+
+    def cycles(self, symbols):
+        """Return negative cycles through the markets' edges that got cheaper since the last update.
+
+        symbols: symbol -> (best bid, best ask). Cycles are (weight, assets), cheapest first, each once.
+        """
+        cheaper = []
+        for symbol, (bid, ask) in symbols.items():
+            cheaper.extend(self.update(symbol, bid, ask))
+        found = {}
+        for u, v in cheaper:
+            result = self.search(u, v)
+            if result is None:
+                continue
+            weight, cycle = result
+            # The same cycle is found from any of its edges, starting there
+            start = cycle.index(min(cycle))
+            key = cycle[start:] + cycle[:start]
+            if key not in found or weight < found[key][0]:
+                found[key] = (weight, cycle)
+        return sorted(found.values())
+
+    def symbol(self, asset, next_asset):
+        """Return the market between two assets."""
+        return self.symbols[(self.index[asset], self.index[next_asset])]
+
+    def stats(self):
+        return {"updates": self.updates, "searches": self.searches, "found": self.found}
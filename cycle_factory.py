@@ -0,0 +1,191 @@
+"""Deployment plans from the cycles of the exchange's asset graph.
+
+    python cycle_factory.py [--legs 4] [--home USDT BTC] [--min-volume 100000] [--output path]
+
+Assets are nodes and markets are edges. Every simple cycle of 3 to `--legs` markets through a home
+asset becomes a plan in each direction, starting from each home asset on it. Markets that aren't
+trading or that traded less than `--min-volume` (normalizing asset) in the last 24 hours are left
+out. The cycles are enumerated by depth-first search, shortest first. A search never takes a step
+from which home is further than the legs it has left.
+"""
+
+
+import argparse
+import json
+import time
+
+from config import DEPLOYMENT_SETTINGS_SOURCE, PLATFORM
+
+
+NORMALIZING_ASSET = "USDT"
+NORMALIZED_START_AMOUNT = 12  # Start amount of every plan in the normalizing asset
+HOME_ASSETS = ("USDT", "BTC", "ETH", "BNB")
+MAX_LEGS = 4
+MIN_VOLUME = 100000  # 24h volume of a market in the normalizing asset
+
+
+def markets_from_exchange_info(exchange_info):
+    """Return symbol -> base, quote and decimals of the trading markets of get_exchange_info."""
+    markets = {}
+    for symbol_data in exchange_info["symbols"]:
+        if symbol_data.get("status", "TRADING") != "TRADING":
+            continue
+        lot_size = next(f for f in symbol_data["filters"] if f["filterType"] == "LOT_SIZE")
+        markets[symbol_data["symbol"]] = {"base": symbol_data["baseAsset"],
+                                          "quote": symbol_data["quoteAsset"],
+                                          "decimals": lot_size["stepSize"].rstrip("0").count("0")}
+    return markets
+
+
+def asset_values(markets, prices, volumes=None, normalizing_asset=NORMALIZING_ASSET):
+    """Return asset -> value in the normalizing asset, through the most traded markets first."""
+    values = {normalizing_asset: 1.}
+    ranked = sorted((symbol for symbol in markets if prices.get(symbol)),
+                    key=lambda symbol: -(volumes or {}).get(symbol, 0.))
+    changed = True
+    while changed:
+        changed = False
+        for symbol in ranked:
+            base, quote = markets[symbol]["base"], markets[symbol]["quote"]
+            if quote in values and base not in values:
+                values[base] = prices[symbol] * values[quote]
+                changed = True
+            elif base in values and quote not in values:
+                values[quote] = values[base] / prices[symbol]
+                changed = True
+    return values
+
+
+def liquid_markets(markets, volumes, values, min_volume=MIN_VOLUME):
+    """Return markets whose 24h quote volume is worth at least min_volume of the normalizing asset."""
+    return {symbol: info for symbol, info in markets.items()
+            if volumes.get(symbol, 0.) * values.get(info["quote"], 0.) >= min_volume}
+
+
+def asset_graph(markets, volumes=None):
+    """Return asset -> {asset: symbol}, neighbours ordered from the most traded market."""
+    graph = {}
+    for symbol in sorted(markets, key=lambda symbol: -(volumes or {}).get(symbol, 0.)):
+        base, quote = markets[symbol]["base"], markets[symbol]["quote"]
+        graph.setdefault(base, {})[quote] = symbol
+        graph.setdefault(quote, {})[base] = symbol
+    return graph
+
+
+def distances(graph, target):
+    """Return asset -> least markets between it and the target."""
+    found = {target: 0}
+    frontier = [target]
+    while frontier:
+        following = []
+        for asset in frontier:
+            for neighbour in graph[asset]:
+                if neighbour not in found:
+                    found[neighbour] = found[asset] + 1
+                    following.append(neighbour)
+        frontier = following
+    return found
+
+
+def find_cycles(graph, home, max_legs=MAX_LEGS, min_legs=3):
+    """Yield asset cycles (home first, home not repeated) of min_legs to max_legs markets, shortest first.
+
+    Both directions of a cycle are yielded.
+    """
+    if home not in graph:
+        return
+    distance = distances(graph, home)
+    for legs in range(min_legs, max_legs + 1):
+        path = [home]
+        on_path = {home}
+
+        def extend(asset):
+            left = legs - len(path)  # Markets left after the one taken from `asset`
+            for neighbour in graph[asset]:
+                if neighbour == home:
+                    if left == 0 and len(path) > 2:
+                        yield tuple(path)
+                elif left > 0 and neighbour not in on_path and distance.get(neighbour, legs) <= left:
+                    path.append(neighbour)
+                    on_path.add(neighbour)
+                    yield from extend(neighbour)
+                    path.pop()
+                    on_path.discard(neighbour)
+
+        yield from extend(home)
+
+
+def plan_markets(markets):
+    """Return symbol -> market entry of the plans; plans share the entries."""
+    return {symbol: {"symbol": symbol,
+                     "quote": info["quote"],
+                     "base": info["base"],
+                     "decimals": info["decimals"],
+                     "exchange": PLATFORM} for symbol, info in markets.items()}
+
+
+def cycle_plan(graph, entries, cycle, start_amount, plan_no):
+    """Return the deployment plan of trading around the asset cycle from its first asset."""
+    return {"markets": [entries[graph[asset][next_asset]] for asset, next_asset in zip(cycle, cycle[1:] + cycle[:1])],
+            "start_currency": cycle[0],
+            "start_amount": start_amount,
+            "fee_asset": cycle[0],
+            "profit_asset": cycle[0],
+            "strategy": "ARBITRAGE",
+            "plan_no": plan_no}
+
+
+def generate_plans(markets, values, home_assets=HOME_ASSETS, max_legs=MAX_LEGS, volumes=None, max_plans=None):
+    """Return plans of all cycles through the home assets (those with a value), shortest cycles first."""
+    graph = asset_graph(markets, volumes)
+    entries = plan_markets(markets)
+    start_amounts = {home: str(round(NORMALIZED_START_AMOUNT / values[home], 8)) for home in home_assets if home in values}
+    plans = []
+    for legs in range(3, max_legs + 1):
+        for home, start_amount in start_amounts.items():
+            for cycle in find_cycles(graph, home, legs, min_legs=legs):
+                if max_plans is not None and len(plans) >= max_plans:
+                    return plans
+                plans.append(cycle_plan(graph, entries, cycle, start_amount, len(plans)))
+    return plans
+
+
+def main(args):
+    from binance.client import Client  # Only the command needs the API
+    from config import BINANCE_PUBLIC, BINANCE_SECRET
+
+    start = time.time()
+    client = Client(api_key=BINANCE_PUBLIC, api_secret=BINANCE_SECRET)
+    markets = markets_from_exchange_info(client.get_exchange_info())
+    tickers = client.get_ticker()  # 24h statistics of all markets
+    prices = {ticker["symbol"]: float(ticker["lastPrice"]) for ticker in tickers}
+    volumes = {ticker["symbol"]: float(ticker["quoteVolume"]) for ticker in tickers}
+    values = asset_values(markets, prices, volumes)
+    liquid = liquid_markets(markets, volumes, values, args.min_volume)
+    print(f"{len(liquid)} of {len(markets)} markets traded at least {args.min_volume} {NORMALIZING_ASSET} in 24h.")
+
+    plans = generate_plans(liquid, values, args.home, args.legs, volumes, args.max_plans)
+    by_legs = {}
+    for plan in plans:
+        by_legs[len(plan["markets"])] = by_legs.get(len(plan["markets"]), 0) + 1
+    print(f"{len(plans)} plans ({', '.join(f'{count} with {legs} legs' for legs, count in sorted(by_legs.items()))}) "
+          f"in {time.time() - start:.1f} sec.")
+
+    deployment_settings = {"instance_id": args.instance_id,
+                           "global_settings": {"fees": {PLATFORM: "0.00075"}},
+                           "plans": plans}
+    with open(args.output, "w") as ds_file:
+        json.dump(deployment_settings, ds_file, indent=4)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--legs", type=int, default=MAX_LEGS, help="Most markets in a plan")
+    parser.add_argument("--home", nargs="+", default=HOME_ASSETS, help="Assets plans start and end with")
+    parser.add_argument("--min-volume", type=float, default=MIN_VOLUME,
+                        help=f"Least 24h volume of a market in {NORMALIZING_ASSET}")
+    parser.add_argument("--max-plans", type=int, default=None, help="Stop after this many plans")
+    parser.add_argument("--instance-id", default="Bot 1")
+    parser.add_argument("--output", default=DEPLOYMENT_SETTINGS_SOURCE)
+
+    main(parser.parse_args())
@@ -12,6 +12,7 @@ from binance.client import Client
 
 import helpers as hp
 from config import *
+import book_bus
 
 
 VALID_STRATEGIES = ["TEST", "ARBITRAGE"]
@@ -37,9 +38,12 @@ class ValidityChecker:
 			self.deployment_file = json.load(dfile)
 
 		client = Client(api_key=BINANCE_PUBLIC, api_secret=BINANCE_SECRET)
-		# Get the last prices	
-		prices_raw = client.get_all_tickers()
-		self.prices = dict([(market["symbol"], market["price"]) for market in prices_raw])
+		# Get the last prices, from the book bus if it carries all the deployment's markets
+		symbols = {market["symbol"] for plan in self.deployment_file["plans"] for market in plan["markets"]}
+		self.prices = book_bus.latest_prices()
+		if not self.prices or not symbols <= set(self.prices):
+			prices_raw = client.get_all_tickers()
+			self.prices = dict([(market["symbol"], market["price"]) for market in prices_raw])
 		# Get the trade-information
 		symbols_info_raw = client.get_exchange_info()
 		symbol_info = {}
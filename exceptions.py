@@ -20,3 +20,11 @@ class BookTooSmall(Exception):
 
 class StopBot(Exception):
     pass
+
+
+class BookOutOfSync(Exception):
+    pass
+
+
+class NotABookBus(Exception):
+    pass
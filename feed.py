@@ -0,0 +1,111 @@
+"""Market data feed on an asyncio event loop."""
+
+
+import asyncio
+import json
+import time
+import traceback
+from threading import Thread
+
+import websockets
+
+from config import STREAM_URL, MAX_STREAMS_PER_CONNECTION, FEED_CONNECTIONS
+
+
+class AsyncFeed:
+    """Combined-stream websocket connections owned by one event loop.
+
+    Streams are spread across connections, each within the per-connection stream limit. Every decoded
+    message is handed to `on_message` on the loop thread, so the callback must be quick (the bot only
+    updates a book and schedules the evaluation). Dropped connections are reopened with a backoff.
+    """
+
+    def __init__(self, streams, on_message, url=STREAM_URL, connections=FEED_CONNECTIONS,
+                 max_streams=MAX_STREAMS_PER_CONNECTION, on_error=None, reconnect_delay=1, max_reconnect_delay=30):
+        self.on_message = on_message
+        self.on_error = on_error  # Called with the traceback string when a connection breaks
+        self.url = url.rstrip("/")
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.groups = self.split_streams(streams, connections, max_streams)
+
+        self.loop = None
+        self.thread = None
+        self.running = False
+        self.connected = set()  # Indices of the groups with an open connection
+        self.received = None  # perf_counter_ns of the message being handled
+        self.messages = 0
+        self.reconnects = 0
+
+    @staticmethod
+    def split_streams(streams, connections, max_streams):
+        """Deal streams round-robin into at least `connections` groups of at most `max_streams`."""
+        streams = list(streams)
+        count = max(connections, -(-len(streams) // max_streams), 1)
+        count = min(count, max(len(streams), 1))
+        groups = [streams[i::count] for i in range(count)]
+        return [group for group in groups if group]
+
+    def start(self):
+        """Open the connections on a new event loop thread."""
+        self.running = True
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self._run, name="feed", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        """Close the connections and wait for the loop thread to finish."""
+        self.running = False
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self._cancel_all)
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            self.loop.close()
+
+    def _cancel_all(self):
+        for task in asyncio.all_tasks(self.loop):
+            task.cancel()
+
+    def _error(self):
+        if self.on_error is not None:
+            self.on_error(traceback.format_exc())
+
+    async def _main(self):
+        tasks = [self.loop.create_task(self._connection(i, group)) for i, group in enumerate(self.groups)]
+        try:
+            await asyncio.gather(*tasks)
+        except asyncio.CancelledError:
+            pass
+
+    async def _connection(self, i, streams):
+        """Keep one combined-stream connection open until the feed stops."""
+        uri = f"{self.url}/stream?streams={'/'.join(streams)}"
+        delay = self.reconnect_delay
+        while self.running:
+            try:
+                async with websockets.connect(uri, max_queue=None) as socket_:
+                    self.connected.add(i)
+                    delay = self.reconnect_delay
+                    async for raw in socket_:
+                        self.received = time.perf_counter_ns()
+                        self.messages += 1
+                        try:
+                            self.on_message(json.loads(raw))
+                        except Exception:
+                            self._error()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self._error()
+            finally:
+                self.connected.discard(i)
+            if self.running:
+                self.reconnects += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
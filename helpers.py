@@ -14,9 +14,10 @@ load_dotenv()  # Load env variables - GOOGLE_APPLICATION_CREDENTIALS are require
 if (platform == "linux" or platform == "linux2") and (os.getenv("GOOGLE_APPLICATION_CREDENTIALS").startswith("C:")):
     os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.getenv("GOOGLE_APPLICATION_CREDENTIALS_LINUX")
 client = bigquery.Client(project='blocklytics-data')
+tables = {}  # (dataset, table) -> BigQuery table with its schema
 
 
-def send_to_slack(msg, api_key, channel, emoji=':blocky-money:'):
+def send_to_slack(msg, api_key, channel, emoji=':blocky-money:', session=None):
     # Sending a slack message to the telegram-bot chat-room
     params = {'token': api_key,
               'channel': channel,
@@ -25,7 +26,7 @@ def send_to_slack(msg, api_key, channel, emoji=':blocky-money:'):
               'username': 'Binance Bot',
               'pretty': 1}
     url = 'https://slack.com/api/chat.postMessage'
-    requests.post(url, params)
+    return (session or requests).post(url, params, timeout=10)
 
 
 def round_up(x, m):
@@ -60,15 +61,19 @@ def get_avg(elements):
     return sum([element[0] * element[1] for element in elements]) / sum([element[1] for element in elements])
 
 
+def get_table(dataset, table):
+    """Return BigQuery table, its schema is fetched only on the first call."""
+    key = (dataset, table)
+    if key not in tables:
+        tables[key] = client.get_table(client.dataset(dataset).table(table))  # API request
+    return tables[key]
+
+
 def append_rows(dataset, table, rows):
     """Append rows to BigQuery table."""
     if not rows:
         return
-    table_ref = client.dataset(dataset).table(table)
-    job_config = bigquery.QueryJobConfig()
-    job_config.destination = table_ref
-    job_config.write_disposition = bigquery.WriteDisposition.WRITE_APPEND
-    table = client.get_table(table_ref)  # API request
+    table = get_table(dataset, table)
     errors = client.insert_rows(table, rows)  # API request
 
     return errors
@@ -0,0 +1,404 @@
+"""Local append-only journal of opportunities, trades and books in columnar files.
+
+Every table is a directory of segments, every segment a directory with one raw file per column.
+Rows are written in blocks to the end of the column files; a segment is sealed once it has
+`segment_rows` rows or is `segment_age` seconds old, after which it never changes and the uploader
+inserts it into BigQuery. Columns of a segment can be memory-mapped with numpy, so scanning them
+doesn't load anything into memory. Every bot instance has its own journal directory:
+
+    for segment in scan("bullseye.trades", ["symbol", "executedQty"], instance_id="bot-1"):
+        ...
+"""
+
+
+import json
+import os
+import time
+import traceback
+from threading import Thread, Lock
+
+import numpy as np
+
+import helpers as hp
+from latency import STAGES
+from config import (JOURNAL_DIR, JOURNAL_BLOCK_ROWS, JOURNAL_SEGMENT_ROWS, JOURNAL_SEGMENT_AGE, JOURNAL_UPLOAD,
+                    JOURNAL_BOOK_LEVELS, JOURNAL_FILLS, SINK_BATCH_ROWS)
+
+
+SEALED = "SEALED"  # Marker file with the row count of a finished segment
+UPLOADED = "UPLOADED"  # Rows of the segment that are in BigQuery
+DTYPE = "DTYPE"  # Record dtype the segment was written with, so a new depth doesn't misread old segments
+DECIMAL = "dec"  # Decimal string in the records, float64 in the journal, 8 decimals on the way back
+OPTIONAL = "opt"  # float64 in the journal, left out of the row when it wasn't recorded (the table may not have it)
+
+
+class Entries:
+    """List of dicts in a record (fills, book levels), at most `depth` of them; the rest are cut off.
+
+    Numeric keys get a (depth,) float64 column each and `ids` a (depth,) int64 column each (-1 - unknown),
+    `tags` are string keys that are the same for all entries and are kept once, from the first entry.
+    """
+
+    def __init__(self, keys, depth, tags=(), ids=()):
+        self.keys = keys
+        self.depth = depth
+        self.tags = tags
+        self.ids = ids
+
+    def fields(self, name):
+        return ([(f"{name}_len", "i4")] + [(f"{name}_{key}", "f8", (self.depth,)) for key in self.keys]
+                + [(f"{name}_{key}", "i8", (self.depth,)) for key in self.ids]
+                + [(f"{name}_{tag}", "S16") for tag in self.tags])
+
+    def encode(self, entries):
+        entries = entries[:self.depth]
+        values = [len(entries)]
+        for key in self.keys:
+            column = np.zeros(self.depth)
+            column[:len(entries)] = [float(entry[key]) for entry in entries]
+            values.append(column)
+        for key in self.ids:
+            column = np.full(self.depth, -1, np.int64)
+            column[:len(entries)] = [-1 if entry.get(key) is None else int(entry[key]) for entry in entries]
+            values.append(column)
+        values += [(entries[0][tag] or "").encode() if entries else b"" for tag in self.tags]  # None - unknown
+        return values
+
+    def decode(self, name, record):
+        count = int(record[f"{name}_len"])
+        tags = {tag: record[f"{name}_{tag}"].decode() or None for tag in self.tags}
+        columns = [record[f"{name}_{key}"] for key in self.keys]
+        id_columns = [record[f"{name}_{key}"] for key in self.ids]
+        return [dict(zip(self.keys, (format(column[i], ".8f") for column in columns)),
+                     **{key: None if column[i] < 0 else int(column[i]) for key, column in zip(self.ids, id_columns)},
+                     **tags) for i in range(count)]
+
+
+# Columns of the BigQuery tables the bot logs to; the kind is a numpy dtype, DECIMAL or Entries
+SCHEMAS = {
+    "bullseye.opportunities": [("id", "S32"), ("foundAtTimestamp", "f8"), ("startAmount", "f8"), ("startCurrency", "S16"),
+                               ("estimatedProfitAmount", "f8"), ("estimatedProfitCurrency", "S16"),
+                               ("estimatedFeeAmount", "f8"), ("estimatedFeeCurrency", "S16"),
+                               ("strategyType", "S16"), ("botId", "S32")]
+                              + [(f"{stage}Us", OPTIONAL) for stage in STAGES],  # Only logged with the latency schema
+    "bullseye.trades": [("id", "i8"), ("opportunityId", "S32"), ("exchange", "S16"), ("symbol", "S16"), ("orderId", "i8"),
+                        ("side", "S4"), ("type", "S8"), ("timeInForce", "S4"), ("status", "S16"), ("price", DECIMAL),
+                        ("origQty", DECIMAL), ("executedQty", DECIMAL), ("exchangeTimestamp", "f8"),
+                        ("localTimestamp", "f8"), ("fills", Entries(("price", "qty", "commission"), JOURNAL_FILLS, ("commissionAsset",), ("tradeId",)))],
+    "bullseye.books": [("id", "i8"), ("opportunityId", "S32"), ("exchange", "S16"), ("symbol", "S16"),
+                       ("receivedAtTimestamp", "f8"), ("bids", Entries(("price", "qty"), JOURNAL_BOOK_LEVELS)),
+                       ("asks", Entries(("price", "qty"), JOURNAL_BOOK_LEVELS))],
+    "bullseye.latency": [("timestamp", "f8"), ("botId", "S32"), ("intervalSeconds", "f8"), ("stage", "S32"),
+                         ("count", "i8"), ("meanUs", "f8"), ("p50Us", "f8"), ("p90Us", "f8"), ("p99Us", "f8"),
+                         ("p999Us", "f8"), ("maxUs", "f8"), ("clockOffsetMs", "f8"), ("clockRttMs", "f8")],
+}
+
+
+def record_dtype(schema):
+    """Return the numpy dtype of a record of the schema."""
+    fields = []
+    for name, kind in schema:
+        if isinstance(kind, Entries):
+            fields += kind.fields(name)
+        else:
+            fields.append((name, "f8" if kind in (DECIMAL, OPTIONAL) else kind))
+    return np.dtype(fields)
+
+
+def encode(schema, row, truncated=None):
+    """Return a record tuple of the row; columns whose entries were cut off are counted in `truncated`."""
+    values = []
+    for name, kind in schema:
+        value = row.get(name)
+        if isinstance(kind, Entries):
+            if truncated is not None and len(value or []) > kind.depth:
+                truncated[name] = truncated.get(name, 0) + 1
+            values += kind.encode(value or [])
+        elif kind in (DECIMAL, OPTIONAL, "f8"):
+            values.append(float(value) if value is not None else np.nan)
+        elif kind[0] == "S":
+            values.append(str(value).encode() if value is not None else b"")
+        else:
+            values.append(value if value is not None else 0)
+    return tuple(values)
+
+
+def decode(schema, record):
+    """Return the row of a record, as it would be inserted into BigQuery."""
+    row = {}
+    for name, kind in schema:
+        if isinstance(kind, Entries):
+            row[name] = kind.decode(name, record)
+        elif kind == DECIMAL:
+            row[name] = format(record[name], ".8f")
+        elif kind == OPTIONAL:
+            if record[name] == record[name]:  # NaN - not recorded
+                row[name] = record[name].item()
+        elif kind[0] == "S":
+            row[name] = record[name].decode()
+        else:
+            value = record[name].item()
+            row[name] = None if value != value else value  # NaN was a missing value
+    return row
+
+
+def segment_rows(path, dtype):
+    """Return the number of complete rows in the segment."""
+    try:
+        with open(os.path.join(path, SEALED)) as sealed:
+            return json.load(sealed)["rows"]
+    except FileNotFoundError:
+        # Unsealed: the last block may be partly written
+        sizes = [os.path.getsize(os.path.join(path, f"{name}.bin")) // dtype[name].itemsize
+                 if os.path.exists(os.path.join(path, f"{name}.bin")) else 0 for name in dtype.names]
+        return min(sizes)
+
+
+def segment_dtype(path, dtype=None):
+    """Return the record dtype the segment was written with (segments without one have the given or current dtype)."""
+    try:
+        with open(os.path.join(path, DTYPE)) as descr:
+            return np.dtype([tuple(field[:2]) + tuple(tuple(shape) for shape in field[2:]) for field in json.load(descr)])
+    except FileNotFoundError:
+        if dtype is None:
+            dtype = record_dtype(SCHEMAS[os.path.basename(os.path.dirname(path))])
+        return dtype
+
+
+def read_segment(path, columns=None, dtype=None):
+    """Return {column: read-only memory-mapped array} of the segment."""
+    dtype = segment_dtype(path, dtype)
+    rows = segment_rows(path, dtype)
+    arrays = {}
+    for name in columns or dtype.names:
+        field = dtype[name]
+        if rows == 0:
+            arrays[name] = np.zeros((0,) + field.shape, field.base)
+        else:
+            arrays[name] = np.memmap(os.path.join(path, f"{name}.bin"), dtype=field.base, mode="r",
+                                     shape=(rows,) + field.shape)
+    return arrays
+
+
+def journal_dir(instance_id):
+    """Return the journal directory of the bot instance."""
+    return JOURNAL_DIR.format(instance_id=instance_id)
+
+
+def segments(table, directory, sealed_only=True):
+    """Return paths of the table's segments, oldest first."""
+    table_dir = os.path.join(directory, table)
+    if not os.path.isdir(table_dir):
+        return []
+    paths = [os.path.join(table_dir, name) for name in sorted(os.listdir(table_dir))]
+    return [path for path in paths if not sealed_only or os.path.exists(os.path.join(path, SEALED))]
+
+
+def scan(table, columns=None, directory=None, sealed_only=True, instance_id=None):
+    """Yield columns of every segment of the table, in the directory or the journal of the instance."""
+    dtype = record_dtype(SCHEMAS[table])
+    for path in segments(table, directory if directory is not None else journal_dir(instance_id), sealed_only):
+        yield read_segment(path, columns, dtype)
+
+
+class TableWriter:
+    """Append rows of one table to its current segment.
+
+    The directory belongs to one instance, so the segments left open in it are from its previous run.
+    """
+
+    def __init__(self, directory, table, block_rows, segment_rows_, segment_age, on_error=None):
+        self.directory = os.path.join(directory, table)
+        self.schema = SCHEMAS[table]
+        self.dtype = record_dtype(self.schema)
+        self.block = np.zeros(block_rows, self.dtype)
+        self.filled = 0  # Rows in the block
+        self.segment_rows = segment_rows_
+        self.segment_age = segment_age
+        self.lock = Lock()
+        self.on_error = on_error  # Called with a message on the first truncation of every column
+        self.truncated = {}  # Column -> rows whose entries were cut off
+
+        os.makedirs(self.directory, exist_ok=True)
+        existing = sorted(os.listdir(self.directory))
+        for name in existing:
+            path = os.path.join(self.directory, name)
+            if not os.path.exists(os.path.join(path, SEALED)):
+                self._seal(path, segment_rows(path, segment_dtype(path, self.dtype)))  # Left open by a crash
+        self.number = int(existing[-1]) + 1 if existing else 0
+        self.path = None
+        self.files = {}
+        self.rows = 0  # Rows in the current segment
+        self.opened = None
+
+    def append(self, rows):
+        with self.lock:
+            for row in rows:
+                counted = len(self.truncated)
+                self.block[self.filled] = encode(self.schema, row, self.truncated)
+                self.filled += 1
+                if len(self.truncated) > counted and self.on_error is not None:
+                    column = next(reversed(self.truncated))
+                    kind = dict(self.schema)[column]
+                    self.on_error(f"Journal cut {self.directory} {column} to {kind.depth} entries, "
+                                  f"further truncations are only counted")
+                if self.filled == len(self.block):
+                    self._write()
+
+    def flush(self, seal=False):
+        """Write the partial block; seal the segment if asked or if it's old enough."""
+        with self.lock:
+            if self.filled:
+                self._write()
+            if self.path is not None and (seal or time.time() - self.opened >= self.segment_age):
+                self._close()
+
+    def _write(self):
+        if self.path is None:
+            self._open()
+        block = self.block[:self.filled]
+        for name, column_file in self.files.items():
+            column_file.write(block[name].tobytes())
+            column_file.flush()
+        self.rows += self.filled
+        self.filled = 0
+        if self.rows >= self.segment_rows:
+            self._close()
+
+    def _open(self):
+        while True:
+            self.path = os.path.join(self.directory, f"{self.number:08d}")
+            self.number += 1
+            try:
+                os.makedirs(self.path)
+            except FileExistsError:
+                continue  # Taken by another writer of the directory
+            break
+        with open(os.path.join(self.path, DTYPE), "w") as descr:
+            json.dump(self.dtype.descr, descr)
+        self.files = {name: open(os.path.join(self.path, f"{name}.bin"), "ab") for name in self.dtype.names}
+        self.rows = 0
+        self.opened = time.time()
+
+    def _close(self):
+        for column_file in self.files.values():
+            column_file.close()
+        self._seal(self.path, self.rows)
+        self.path = None
+        self.files = {}
+
+    @staticmethod
+    def _seal(path, rows):
+        with open(os.path.join(path, SEALED), "w") as sealed:
+            json.dump({"rows": rows}, sealed)
+
+
+class Journal:
+    """Journal of all tables; has the same interface as bq_sink.BigQuerySink.
+
+    A background thread writes partial blocks every second, seals segments that are old enough and,
+    with `upload`, inserts the sealed segments into BigQuery.
+    """
+
+    def __init__(self, directory=None, block_rows=JOURNAL_BLOCK_ROWS, segment_rows_=JOURNAL_SEGMENT_ROWS,
+                 segment_age=JOURNAL_SEGMENT_AGE, upload=JOURNAL_UPLOAD, on_error=None, instance_id=None):
+        self.directory = directory if directory is not None else journal_dir(instance_id)
+        self.block_rows = block_rows
+        self.segment_rows = segment_rows_
+        self.segment_age = segment_age
+        self.upload = upload
+        self.on_error = on_error  # Called with the traceback string when an upload fails, or a truncation message
+        self.writers = {}  # Table -> TableWriter
+        self.lock = Lock()
+        self.thread = None
+        self.running = False
+
+        # Counters
+        self.rows = 0  # Rows appended
+        self.uploaded = 0  # Rows inserted into BigQuery
+
+    def writer(self, table):
+        writer = self.writers.get(table)
+        if writer is None:
+            with self.lock:
+                writer = self.writers.get(table)
+                if writer is None:
+                    writer = self.writers[table] = TableWriter(self.directory, table, self.block_rows,
+                                                               self.segment_rows, self.segment_age, self.on_error)
+        return writer
+
+    def append(self, dataset, table, rows):
+        """Append rows of the BigQuery table."""
+        self.writer(f"{dataset}.{table}").append(rows)
+        self.rows += len(rows)
+
+    def start(self):
+        """Start the flushing (and uploading) thread."""
+        if self.running:
+            return
+        self.running = True
+        self.thread = Thread(target=self._run, name="journal", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=30):
+        """Seal all segments and stop the thread after the last upload."""
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(timeout)
+        for writer in list(self.writers.values()):
+            writer.flush(seal=True)
+
+    def stats(self):
+        """Return the counters."""
+        return {"rows": self.rows, "uploaded": self.uploaded,
+                "truncated": sum(sum(writer.truncated.values()) for writer in list(self.writers.values()))}
+
+    def _run(self):
+        while self.running:
+            time.sleep(1)
+            for writer in list(self.writers.values()):
+                writer.flush()
+            if self.upload:
+                self.upload_sealed()
+
+    def upload_sealed(self):
+        """Insert every sealed segment that isn't in BigQuery yet."""
+        if not os.path.isdir(self.directory):
+            return
+        for table in sorted(os.listdir(self.directory)):
+            if table not in SCHEMAS:
+                continue
+            dataset, table_name = table.split(".", 1)
+            schema = SCHEMAS[table]
+            for path in segments(table, self.directory):
+                dtype = segment_dtype(path, record_dtype(schema))
+                rows = segment_rows(path, dtype)
+                done = self._uploaded_rows(path)
+                if done >= rows:
+                    continue
+                try:
+                    records = read_segment(path, dtype=dtype)
+                    for start in range(done, rows, SINK_BATCH_ROWS):
+                        stop = min(start + SINK_BATCH_ROWS, rows)
+                        chunk = np.empty(stop - start, dtype)
+                        for name, column in records.items():
+                            chunk[name] = column[start:stop]
+                        errors = hp.append_rows(dataset, table_name, [decode(schema, record) for record in chunk])
+                        if errors:
+                            raise Exception(errors)
+                        # Progress is saved per chunk, so a retry doesn't insert rows twice
+                        with open(os.path.join(path, UPLOADED), "w") as uploaded:
+                            json.dump({"rows": stop}, uploaded)
+                        self.uploaded += stop - start
+                except Exception:
+                    if self.on_error is not None:
+                        self.on_error(f"Journal upload of {path} failed:\n{traceback.format_exc()}")
+                    return  # Try again on the next pass
+
+    @staticmethod
+    def _uploaded_rows(path):
+        try:
+            with open(os.path.join(path, UPLOADED)) as uploaded:
+                return json.load(uploaded)["rows"]
+        except FileNotFoundError:
+            return 0
@@ -0,0 +1,223 @@
+"""Latency of the hot path stages, from the exchange event to the order fill.
+
+All local marks are time.perf_counter_ns(). Exchange timestamps (event time "E", order "transactTime")
+are moved onto the same clock with the server clock offset estimated from get_server_time.
+"""
+
+
+import time
+import traceback
+from threading import Thread, Event
+
+from config import LATENCY_REPORT_INTERVAL, CLOCK_SYNC_INTERVAL, CLOCK_SYNC_SAMPLES
+
+
+# Stages in hot path order
+STAGES = ("exchangeToReceive",  # Exchange event time -> socket receive (diff depth events only)
+          "receiveToIngest",  # Socket receive -> book written
+          "ingestToEvaluation",  # Book written -> evaluation pass started
+          "evaluation",  # Evaluation pass
+          "receiveToDecision",  # Socket receive -> evaluation pass finished
+          "decisionToSend",  # Opportunity found -> order on the wire
+          "sendToExchange",  # Order on the wire -> exchange transactTime
+          "roundTrip")  # Order on the wire -> response
+
+SUB_BITS = 7  # 2 ** SUB_BITS linear buckets under the first power of two, relative error below 1 / 2 ** (SUB_BITS - 1)
+SUB = 1 << SUB_BITS
+HALF = SUB >> 1
+MAX_EXPONENT = 30  # Values up to SUB << MAX_EXPONENT us (about 38 h) have their own bucket
+
+
+class Histogram:
+    """Log-linear histogram of microsecond values, as HdrHistogram keeps them, in a fixed list of counts.
+
+    Values under SUB are exact; above, every power of two is split into HALF buckets. Recording is
+    an index computation and an increment, so it can be done on every book update.
+    """
+
+    __slots__ = ("counts", "count", "total", "min", "max")
+
+    def __init__(self):
+        self.counts = [0] * (SUB + MAX_EXPONENT * HALF)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+
+    @staticmethod
+    def index(value):
+        if value < SUB:
+            return value
+        exponent = min(value.bit_length() - SUB_BITS, MAX_EXPONENT)
+        return SUB + (exponent - 1) * HALF + min((value >> exponent) - HALF, HALF - 1)
+
+    @staticmethod
+    def lowest(index):
+        """Return the lowest value of the bucket."""
+        if index < SUB:
+            return index
+        exponent, sub = divmod(index - SUB, HALF)
+        return (HALF + sub) << (exponent + 1)
+
+    def record(self, ns):
+        """Add a duration in nanoseconds; negative durations (clock offset error) count as 0."""
+        value = int(ns) // 1000
+        if value < 0:
+            value = 0
+        self.counts[value if value < SUB else self.index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if self.min is None or value < self.min:
+            self.min = value
+
+    def percentile(self, q):
+        """Return the value (us) under which q percent of the recorded values are."""
+        if not self.count:
+            return None
+        rank = max(1, -(-self.count * q // 100))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(self.lowest(index), self.max)
+        return self.max
+
+    def merge(self, other):
+        """Add the other histogram's values."""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+
+    def summary(self):
+        """Return count, mean, percentiles and extremes in microseconds."""
+        return {"count": self.count,
+                "mean": self.total / self.count if self.count else None,
+                "min": self.min,
+                "p50": self.percentile(50),
+                "p90": self.percentile(90),
+                "p99": self.percentile(99),
+                "p999": self.percentile(99.9),
+                "max": self.max if self.count else None}
+
+
+class ClockOffset:
+    """Server clock offset from the get_server_time sample with the shortest round trip."""
+
+    def __init__(self, client, samples=CLOCK_SYNC_SAMPLES):
+        self.client = client
+        self.samples = samples
+        self.offset_ms = 0.  # Server time - local wall time
+        self.rtt_ms = None  # Round trip of the sample the offset comes from
+        self.synced = None  # Local time of the last sync
+        self.mono_base = time.time_ns() - time.perf_counter_ns()  # Wall clock - perf_counter
+
+    def sync(self):
+        """Measure the offset again (`samples` API requests)."""
+        best = None
+        for _ in range(self.samples):
+            sent = time.time_ns()
+            server_ms = self.client.get_server_time()["serverTime"]  # API request
+            received = time.time_ns()
+            rtt_ms = (received - sent) / 1e6
+            if best is None or rtt_ms < best[0]:
+                best = (rtt_ms, server_ms - (sent + received) / 2e6)
+        self.rtt_ms, self.offset_ms = best
+        self.mono_base = time.time_ns() - time.perf_counter_ns()
+        self.synced = time.time()
+
+    def to_local_ns(self, server_ms):
+        """Return the perf_counter_ns mark of a server timestamp (ms)."""
+        return int((server_ms - self.offset_ms) * 1e6) - self.mono_base
+
+
+class LatencyMonitor:
+    """Histograms of every stage, handed to `on_report` every `interval` seconds and started again.
+
+    `on_report` is called from the monitor thread with the rows of the interval, one per stage that
+    has values. The server clock offset is measured when the monitor starts and every `sync_interval`.
+    """
+
+    def __init__(self, client, interval=LATENCY_REPORT_INTERVAL, sync_interval=CLOCK_SYNC_INTERVAL,
+                 on_report=None, on_error=None):
+        self.clock = ClockOffset(client)
+        self.interval = interval
+        self.sync_interval = sync_interval
+        self.on_report = on_report
+        self.on_error = on_error  # Called with the traceback string of a failed clock sync or report
+        self.histograms = {stage: Histogram() for stage in STAGES}
+        self.started = time.time()  # Start of the current interval
+        self.stopped = Event()
+        self.thread = None
+
+    def record(self, stage, ns):
+        self.histograms[stage].record(ns)
+
+    def start(self):
+        """Start the reporting thread if it isn't running."""
+        if self.thread is not None and self.thread.is_alive():
+            return
+        self.stopped.clear()
+        self.thread = Thread(target=self._run, name="latency", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        """Report what was recorded since the last report and stop the thread."""
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def take(self):
+        """Return the histograms of the interval and start new ones."""
+        histograms, self.histograms = self.histograms, {stage: Histogram() for stage in STAGES}
+        return histograms
+
+    def report(self):
+        """Return rows of the interval's stages and start a new interval."""
+        started, self.started = self.started, time.time()
+        rows = []
+        for stage, histogram in self.take().items():
+            if not histogram.count:
+                continue
+            summary = histogram.summary()
+            rows.append({"timestamp": self.started,
+                         "intervalSeconds": self.started - started,
+                         "stage": stage,
+                         "count": summary["count"],
+                         "meanUs": summary["mean"],
+                         "p50Us": summary["p50"],
+                         "p90Us": summary["p90"],
+                         "p99Us": summary["p99"],
+                         "p999Us": summary["p999"],
+                         "maxUs": summary["max"],
+                         "clockOffsetMs": self.clock.offset_ms,
+                         "clockRttMs": self.clock.rtt_ms})
+        return rows
+
+    def _error(self):
+        if self.on_error is not None:
+            self.on_error(traceback.format_exc())
+
+    def _run(self):
+        next_sync = time.time()
+        while True:
+            if time.time() >= next_sync:
+                try:
+                    self.clock.sync()
+                except Exception:
+                    self._error()
+                next_sync = time.time() + self.sync_interval
+            stop = self.stopped.wait(self.interval - (time.time() - self.started))
+            if stop or time.time() - self.started >= self.interval:
+                try:
+                    rows = self.report()
+                    if rows and self.on_report is not None:
+                        self.on_report(rows)
+                except Exception:
+                    self._error()
+            if stop:
+                return
@@ -2,6 +2,8 @@
 
 
 import json
+import argparse
+import signal
 
 from binance_bot import BinanceBot, Plan
 import helpers as hp
@@ -9,8 +11,8 @@ from config import SLACK_KEY, SLACK_GROUP, DEPLOYMENT_SETTINGS_SOURCE
 import time
 
 
-def main(settings, execute=1, test_it=0, loop=1):
-    # deploymentSettings --> plans
+def get_plans(settings):
+    """Return plans of the deployment settings."""
     plans = []
     for plan in settings["plans"]:
         plans.append(Plan(market_conds=plan["markets"],
@@ -20,9 +22,21 @@ def main(settings, execute=1, test_it=0, loop=1):
                           strategy="ARBITRAGE",
                           profit_asset=plan["profit_asset"],
                           fee_asset=plan["fee_asset"]))
+
+    return plans
+
+
+def main(settings, execute=1, test_it=0, loop=1, shards=None, profile=None):
+    if shards is not None:
+        settings["global_settings"]["shards"] = shards
+    # deploymentSettings --> plans
+    plans = get_plans(settings)
     try:
         bb = BinanceBot(plans, execute=execute, test_it=test_it, loop=loop, settings=settings["global_settings"])
+        bb.profiler.install_signal(signal.SIGUSR1)  # kill -USR1 <pid> profiles the running bot
         bb.start_listening()
+        if profile:
+            bb.profiler.start(duration=profile)
         # Listen if the books are updating or the bot stopped
         limit = 60
         while 1:
@@ -42,8 +56,13 @@ def main(settings, execute=1, test_it=0, loop=1):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--shards', default=None, type=int, help="Number of evaluation processes")
+    parser.add_argument('--profile', default=None, type=float, help="Profile the first SEC seconds after start")
+    args = parser.parse_args()
+
     with open(DEPLOYMENT_SETTINGS_SOURCE) as ds_file:
         deployment_settings = json.load(ds_file)
 
-    main(deployment_settings)
+    main(deployment_settings, shards=args.shards, profile=args.profile)
 
@@ -0,0 +1,187 @@
+"""Metrics registry served over local HTTP in the Prometheus text format.
+
+    curl http://127.0.0.1:9108/metrics
+
+Counters and histograms are updated on the hot path with a dict update; values that other objects
+already count (queues, transports, the scheduler) are read by callbacks when the endpoint is scraped.
+"""
+
+
+import math
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+from config import METRICS_HOST, METRICS_PORT
+
+
+SECONDS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5)
+
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value):
+    if value is None:
+        return "NaN"
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Family of samples, one per tuple of label values.
+
+    With `fn`, the samples are taken when the metrics are scraped: fn returns the value, or a dict
+    of label values tuple -> value for metrics with labels.
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, help_, labels=(), fn=None):
+        self.name = name
+        self.help = help_
+        self.labels = tuple(labels)
+        self.fn = fn
+        self.values = {}  # Label values -> value
+
+    def samples(self):
+        """Return (suffix, label names, label values, value) of every sample."""
+        if self.fn is None:
+            values = self.values
+        else:
+            values = self.fn()
+            values = values if isinstance(values, dict) else {(): values}
+        return [("", self.labels, key, value) for key, value in list(values.items())]
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {escape(self.help)}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, names, values, value in self.samples():
+            labels = ",".join(f'{name}="{escape(label)}"' for name, label in zip(names, values))
+            lines.append(f"{self.name}{suffix}{{{labels}}} {format_value(value)}" if labels
+                         else f"{self.name}{suffix} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, labels=(), value=1):
+        self.values[labels] = self.values.get(labels, 0) + value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, labels=()):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    """Cumulative buckets of observed values (seconds)."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_, buckets):
+        super().__init__(name, help_)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            samples.append(("_bucket", ("le",), (format_value(bound),), cumulative))
+        samples.append(("_sum", (), (), self.sum))
+        samples.append(("_count", (), (), self.count))
+        return samples
+
+
+class Registry:
+    """Metrics of one process, in registration order."""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_, labels=(), fn=None):
+        return self.register(Counter(name, help_, labels, fn))
+
+    def gauge(self, name, help_, labels=(), fn=None):
+        return self.register(Gauge(name, help_, labels, fn))
+
+    def histogram(self, name, help_, buckets):
+        return self.register(Histogram(name, help_, buckets))
+
+    def expose(self):
+        """Return all metrics in the Prometheus text format."""
+        families = []
+        for metric in list(self.metrics.values()):
+            try:
+                families.append(metric.expose())
+            except Exception:
+                # A broken callback shouldn't hide the other metrics
+                families.append(f"# {metric.name} failed: {escape(traceback.format_exc().splitlines()[-1])}")
+        return "\n".join(families) + "\n"
+
+
+class MetricsServer:
+    """Serve the registry at /metrics from a background thread."""
+
+    def __init__(self, registry, host=METRICS_HOST, port=METRICS_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        """Start serving if it isn't serving yet."""
+        if self.server is not None:
+            return
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = registry.expose().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass  # No line per scrape
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]  # The one picked by the OS if the port was 0
+        self.thread = Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.server is None:
+            return
+        self.server.shutdown()
+        self.server.server_close()
+        self.server = None
@@ -0,0 +1,148 @@
+"""Slack messages sent from a background thread."""
+
+
+import time
+import traceback
+from collections import deque
+from threading import Thread, Condition
+
+import requests
+
+import helpers as hp
+from config import SLACK_KEY, SLACK_DIGEST, SLACK_DIGEST_INTERVAL, SLACK_DIGEST_ITEMS, SLACK_MIN_INTERVAL, SLACK_MAX_QUEUE
+
+
+class SlackNotifier:
+    """Queue Slack messages and post them over one session, at most one every `min_interval` seconds.
+
+    `send` never blocks. Rate limited posts (429) are retried after the time Slack asks for. In the
+    digest mode, the first message sent with a digest name is posted right away and the ones that
+    follow it within `digest_interval` seconds are merged into one summary per name and channel,
+    repeated texts are counted instead of repeated. A burst that goes on gets a summary every
+    interval; once an interval passes without messages, the next one is posted right away again.
+    """
+
+    def __init__(self, api_key=SLACK_KEY, digest=SLACK_DIGEST, digest_interval=SLACK_DIGEST_INTERVAL,
+                 digest_items=SLACK_DIGEST_ITEMS, min_interval=SLACK_MIN_INTERVAL, max_queue=SLACK_MAX_QUEUE):
+        self.api_key = api_key
+        self.digest = digest
+        self.digest_interval = digest_interval
+        self.digest_items = digest_items  # Distinct messages shown in a summary
+        self.min_interval = min_interval
+        self.max_queue = max_queue
+        self.session = requests.Session()
+        self.condition = Condition()
+        self.pending = deque()  # (channel, emoji, text) waiting to be posted
+        self.digests = {}  # (name, channel, emoji) -> [end of the merging interval, texts merged in it]
+        self.thread = None
+        self.running = False
+
+        # Counters
+        self.sent = 0
+        self.merged = 0  # Messages that went into summaries
+        self.dropped = 0  # Messages dropped because the queue was full
+        self.failed = 0
+        self.rate_limited = 0
+
+    def start(self):
+        """Start the sender thread if it isn't running."""
+        if self.running:
+            return
+        self.running = True
+        self.thread = Thread(target=self._run, name="slack", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=10):
+        """Post the summaries and the queued messages, then stop the sender thread."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def send(self, msg, channel, emoji=':blocky-money:', digest=None):
+        """Queue the message; with a digest name it goes into that summary in the digest mode."""
+        with self.condition:
+            window = self.digests.get((digest, channel, emoji)) if self.digest and digest is not None else None
+            if window is not None:
+                window[1].append(msg)
+            elif len(self.pending) >= self.max_queue:
+                self.dropped += 1
+                return
+            else:
+                self.pending.append((channel, emoji, msg))
+                if self.digest and digest is not None:
+                    # Messages that follow within the interval are merged
+                    self.digests[(digest, channel, emoji)] = [time.time() + self.digest_interval, []]
+            self.condition.notify()
+
+    def stats(self):
+        """Return the counters."""
+        return {"sent": self.sent,
+                "merged": self.merged,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "rate_limited": self.rate_limited,
+                "queued": len(self.pending)}
+
+    def summary(self, name, texts):
+        """Return one message for all texts of a digest."""
+        if len(texts) == 1:
+            return texts[0]
+        counts = {}
+        for text in texts:
+            counts[text] = counts.get(text, 0) + 1
+        lines = [f"*{len(texts)} {name} in the last {self.digest_interval:.0f} sec*"]
+        for text, count in list(counts.items())[:self.digest_items]:
+            lines.append(text if count == 1 else f"{text}\n_(x{count})_")
+        if len(counts) > self.digest_items:
+            lines.append(f"_... and {len(counts) - self.digest_items} more_")
+        return "\n".join(lines)
+
+    def _take_digests(self, flush=False):
+        """Queue the summaries of the intervals that ended (all with flush)."""
+        now = time.time()
+        for key, (due, texts) in list(self.digests.items()):
+            if due > now and not flush:
+                continue
+            name, channel, emoji = key
+            if texts:
+                self.merged += len(texts)
+                self.pending.append((channel, emoji, self.summary(name, texts)))
+                self.digests[key] = [now + self.digest_interval, []]  # The burst goes on
+            else:
+                del self.digests[key]
+
+    def _run(self):
+        last_post = 0
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    due = min((due for due, _ in self.digests.values()), default=None)
+                    if due is not None and due <= time.time():
+                        break
+                    self.condition.wait(None if due is None else due - time.time())
+                self._take_digests(flush=not self.running)
+                if not self.pending:
+                    if self.running:
+                        continue
+                    break
+                channel, emoji, text = self.pending.popleft()
+
+            time.sleep(max(0, last_post + self.min_interval - time.time()))
+            try:
+                response = hp.send_to_slack(text, self.api_key, channel, emoji, session=self.session)
+            except requests.RequestException:
+                self.failed += 1
+                traceback.print_exc()
+                continue
+            finally:
+                last_post = time.time()
+            if response.status_code == 429:
+                # Try again after the time Slack asks for
+                self.rate_limited += 1
+                with self.condition:
+                    self.pending.appendleft((channel, emoji, text))
+                time.sleep(float(response.headers.get("Retry-After", 1)))
+                continue
+            self.sent += 1
@@ -0,0 +1,289 @@
+"""Array-backed order books."""
+
+
+from bisect import bisect_left
+from threading import Lock
+import numpy as np
+
+from exceptions import BookOutOfSync
+
+
+DEFAULT_CAPACITY = 100  # Levels per side; REST snapshots come with 100 levels by default
+
+
+class Book:
+    """Latest bids and asks of one market, decoded to floats once per update.
+
+    Levels live in preallocated arrays that are overwritten in place. Writers bump `version` before
+    and after every write (odd while writing), so readers on other threads can take consistent copies.
+    """
+
+    __slots__ = ("symbol", "capacity", "bid_px", "bid_qty", "ask_px", "ask_qty", "bid_len", "ask_len",
+                 "last_update_id", "timestamp", "version")
+
+    def __init__(self, symbol, capacity=DEFAULT_CAPACITY):
+        self.symbol = symbol
+        self.capacity = capacity
+        self.bid_px = np.zeros(capacity)
+        self.bid_qty = np.zeros(capacity)
+        self.ask_px = np.zeros(capacity)
+        self.ask_qty = np.zeros(capacity)
+        self.bid_len = 0
+        self.ask_len = 0
+        self.last_update_id = None
+        self.timestamp = None
+        self.version = 0
+
+    def load(self, bid_px, bid_qty, ask_px, ask_qty, last_update_id, timestamp):
+        """Overwrite the book with float levels, best first."""
+        if max(len(bid_px), len(ask_px)) > self.capacity:
+            self._grow(max(len(bid_px), len(ask_px)))
+        self.version += 1
+        self.bid_px[:len(bid_px)] = bid_px
+        self.bid_qty[:len(bid_qty)] = bid_qty
+        self.ask_px[:len(ask_px)] = ask_px
+        self.ask_qty[:len(ask_qty)] = ask_qty
+        self.bid_len = len(bid_px)
+        self.ask_len = len(ask_px)
+        self.last_update_id = last_update_id
+        self.timestamp = timestamp
+        self.version += 1
+
+    def fill(self, data, timestamp):
+        """Overwrite the book with depth data from the API (price and quantity strings)."""
+        bids, asks = data["bids"], data["asks"]
+        if max(len(bids), len(asks)) > self.capacity:
+            self._grow(max(len(bids), len(asks)))
+        self.version += 1
+        for i, (price, qty) in enumerate(bids):
+            self.bid_px[i] = float(price)
+            self.bid_qty[i] = float(qty)
+        for i, (price, qty) in enumerate(asks):
+            self.ask_px[i] = float(price)
+            self.ask_qty[i] = float(qty)
+        self.bid_len = len(bids)
+        self.ask_len = len(asks)
+        self.last_update_id = data.get("lastUpdateId")
+        self.timestamp = timestamp
+        self.version += 1
+
+    def apply_top(self, bid_price, bid_qty, ask_price, ask_qty, update_id, timestamp):
+        """Move the book's best levels to a newer best bid/ask; deeper levels are kept as they are."""
+        if self.capacity < 1:
+            self._grow(1)
+        self.version += 1
+        self.bid_len = self._patch_top(self.bid_px, self.bid_qty, self.bid_len, bid_price, bid_qty, -1)
+        self.ask_len = self._patch_top(self.ask_px, self.ask_qty, self.ask_len, ask_price, ask_qty, 1)
+        self.last_update_id = update_id
+        self.timestamp = timestamp
+        self.version += 1
+
+    @staticmethod
+    def _patch_top(px, qty, length, price, size, direction):
+        """Put (price, size) on top of the side and drop levels that were better; return new length."""
+        gone = 0  # Levels better than the new best price were filled or cancelled
+        while gone < length and (px[gone] - price) * direction < 0:
+            gone += 1
+        if gone < length and px[gone] == price:
+            new_length = length - gone
+            px[:new_length] = px[gone:length]
+            qty[:new_length] = qty[gone:length]
+        else:
+            new_length = min(length - gone + 1, len(px))
+            px[1:new_length] = px[gone:gone + new_length - 1]
+            qty[1:new_length] = qty[gone:gone + new_length - 1]
+        px[0] = price
+        qty[0] = size
+        return new_length
+
+    def insert_level(self, side, index, price, qty):
+        """Insert a level at `index` of "bids" or "asks" (best first), moving the deeper ones down.
+
+        For writers that keep the side sorted themselves; they bump `version` around their changes.
+        """
+        if (self.bid_len if side == "bids" else self.ask_len) == self.capacity:
+            self._grow(max(2 * self.capacity, 1))
+        px, qtys, length = self.side(side)
+        px[index + 1:length + 1] = px[index:length]
+        qtys[index + 1:length + 1] = qtys[index:length]
+        px[index] = price
+        qtys[index] = qty
+        setattr(self, "bid_len" if side == "bids" else "ask_len", length + 1)
+
+    def remove_level(self, side, index):
+        """Remove the level at `index` of "bids" or "asks", moving the deeper ones up."""
+        px, qtys, length = self.side(side)
+        px[index:length - 1] = px[index + 1:length]
+        qtys[index:length - 1] = qtys[index + 1:length]
+        setattr(self, "bid_len" if side == "bids" else "ask_len", length - 1)
+
+    def _grow(self, capacity):
+        """Reallocate the arrays for deeper books; only writers call this."""
+        self.version += 1
+        for name in ("bid_px", "bid_qty", "ask_px", "ask_qty"):
+            grown = np.zeros(capacity)
+            grown[:self.capacity] = getattr(self, name)
+            setattr(self, name, grown)
+        self.capacity = capacity
+        self.version += 1
+
+    def copy_into(self, other):
+        """Copy a consistent state of the book into other book and return it."""
+        while True:
+            version = self.version
+            if version % 2:
+                continue  # Write in progress
+            if other.capacity < self.capacity:
+                other._grow(self.capacity)
+            bid_len, ask_len = self.bid_len, self.ask_len
+            bid_px, bid_qty, ask_px, ask_qty = self.bid_px, self.bid_qty, self.ask_px, self.ask_qty
+            other.bid_px[:bid_len] = bid_px[:bid_len]
+            other.bid_qty[:bid_len] = bid_qty[:bid_len]
+            other.ask_px[:ask_len] = ask_px[:ask_len]
+            other.ask_qty[:ask_len] = ask_qty[:ask_len]
+            other.bid_len, other.ask_len = bid_len, ask_len
+            other.last_update_id = self.last_update_id
+            other.timestamp = self.timestamp
+            if self.version == version:
+                other.version = version
+                return other
+
+    def side(self, side):
+        """Return prices, quantities and number of levels for "bids" or "asks"."""
+        if side == "bids":
+            return self.bid_px, self.bid_qty, self.bid_len
+        return self.ask_px, self.ask_qty, self.ask_len
+
+    def orders(self, side):
+        """Return (price, qty) levels of the side, best first."""
+        px, qty, length = self.side(side)
+        return list(zip(px[:length].tolist(), qty[:length].tolist()))
+
+
+class DiffBook:
+    """Full order book of one market maintained from the diff depth stream.
+
+    Events received before the REST snapshot are buffered and replayed in lastUpdateId order once
+    the snapshot is loaded. A missing event raises BookOutOfSync; the caller then resets the book and
+    loads a fresh snapshot. A snapshot is written into `book` whole, an event only patches the levels
+    it changes, unless the best levels of `book` were moved by a ticker since.
+    """
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.book = Book(symbol)  # Array view read by pricing
+        self.bids = {}  # Price -> qty
+        self.asks = {}
+        self.bid_prices = []  # Ascending
+        self.ask_prices = []  # Ascending
+        self.last_update_id = None  # None while waiting for a snapshot
+        self.buffer = []  # Events received while waiting for a snapshot
+        self.lock = Lock()  # Snapshots are loaded off the socket thread
+        self.overlaid = False  # `book` has a ticker's best levels that aren't in bids/asks
+
+    @property
+    def synced(self):
+        return self.last_update_id is not None
+
+    def reset(self):
+        """Drop the state and buffer events until the next snapshot."""
+        with self.lock:
+            self.last_update_id = None
+            self.buffer = []
+
+    def load_snapshot(self, snapshot, timestamp):
+        """Start from a REST snapshot and replay the buffered events on top of it.
+
+        Raise BookOutOfSync and wait for another snapshot if the buffered events don't follow this one.
+        """
+        with self.lock:
+            self.bids = {float(price): float(qty) for price, qty in snapshot["bids"]}
+            self.asks = {float(price): float(qty) for price, qty in snapshot["asks"]}
+            self.bid_prices = sorted(self.bids)
+            self.ask_prices = sorted(self.asks)
+            self.last_update_id = snapshot["lastUpdateId"]
+            self.overlaid = False
+            buffered, self.buffer = self.buffer, []
+            try:
+                for event in buffered:
+                    self._apply(event)
+            except BookOutOfSync:
+                # The snapshot is older than the buffered events, the half-replayed book must not be used
+                self.last_update_id = None
+                self.bids, self.asks, self.bid_prices, self.ask_prices = {}, {}, [], []
+                raise
+            self._write(timestamp)
+
+    def apply(self, event, timestamp):
+        """Apply a depth update event; return True if the book changed."""
+        with self.lock:
+            if self.last_update_id is None:
+                self.buffer.append(event)
+                return False
+            if self.overlaid:
+                if not self._apply(event):
+                    return False
+                self._write(timestamp)  # Drops the ticker's levels
+                self.overlaid = False
+                return True
+            return self._apply(event, timestamp)
+
+    def apply_top(self, bid_price, bid_qty, ask_price, ask_qty, update_id, timestamp):
+        """Move the best levels of `book` to a newer best bid/ask until the next event; False while out of sync."""
+        with self.lock:
+            if self.last_update_id is None:
+                return False
+            self.book.apply_top(bid_price, bid_qty, ask_price, ask_qty, update_id, timestamp)
+            self.overlaid = True
+            return True
+
+    def _apply(self, event, timestamp=None):
+        """Apply the event to the levels; with a timestamp, patch the changed levels of `book` as well."""
+        if event["u"] <= self.last_update_id:
+            return False  # Already in the snapshot
+        if event["U"] > self.last_update_id + 1:
+            raise BookOutOfSync(f"{self.symbol}: expected update {self.last_update_id + 1}, got {event['U']}.")
+        book = self.book if timestamp is not None else None
+        if book is None:
+            self._update_side(self.bids, self.bid_prices, event["b"])
+            self._update_side(self.asks, self.ask_prices, event["a"])
+            self.last_update_id = event["u"]
+            return True
+        book.version += 1
+        try:
+            self._update_side(self.bids, self.bid_prices, event["b"], book, "bids")
+            self._update_side(self.asks, self.ask_prices, event["a"], book, "asks")
+            self.last_update_id = book.last_update_id = event["u"]
+            book.timestamp = timestamp
+        finally:
+            book.version += 1
+        return True
+
+    @staticmethod
+    def _update_side(levels, prices, changes, book=None, side=None):
+        """Apply level changes to a side; with a book, patch its array of the side (best first) too."""
+        for price, qty in changes:
+            price, qty = float(price), float(qty)
+            if qty == 0:
+                if levels.pop(price, None) is not None:
+                    i = bisect_left(prices, price)
+                    del prices[i]
+                    if book is not None:
+                        book.remove_level(side, len(prices) - i if side == "bids" else i)
+            else:
+                if price not in levels:
+                    i = bisect_left(prices, price)
+                    prices.insert(i, price)
+                    if book is not None:
+                        book.insert_level(side, len(prices) - 1 - i if side == "bids" else i, price, qty)
+                elif book is not None:
+                    i = bisect_left(prices, price)
+                    book.side(side)[1][len(prices) - 1 - i if side == "bids" else i] = qty
+                levels[price] = qty
+
+    def _write(self, timestamp):
+        bid_px = self.bid_prices[::-1]
+        ask_px = self.ask_prices
+        self.book.load(bid_px, [self.bids[price] for price in bid_px],
+                       ask_px, [self.asks[price] for price in ask_px],
+                       self.last_update_id, timestamp)
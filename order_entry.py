@@ -0,0 +1,557 @@
+"""Order entry with pre-signed request templates.
+
+Two transports with the same interface: OrderEntry sends orders over REST with warm sender threads,
+WsOrderEntry over the websocket trading API and falls back to REST while its session is down.
+"""
+
+
+import asyncio
+import hmac
+import hashlib
+import itertools
+import json
+import queue
+import time
+import traceback
+import uuid
+from concurrent.futures import Future
+from threading import Thread, Event
+from urllib.parse import urlencode
+
+import requests
+import websockets
+from requests.adapters import HTTPAdapter
+from binance.client import BinanceAPIException
+
+from config import API_URL, WS_API_URL, ORDER_TRANSPORT, ORDER_SENDERS, ORDER_KEEPALIVE_INTERVAL, ORDER_TIMEOUT
+
+
+class OrderTemplate:
+    """Request of one symbol, side and time in force with everything but the quantity, price and timestamp.
+
+    The HMAC state already contains the fixed part of the body, so signing an order only hashes the rest.
+    """
+
+    __slots__ = ("symbol", "side", "time_in_force", "decimals", "prefix", "mac")
+
+    def __init__(self, symbol, side, time_in_force, decimals, key_mac):
+        self.symbol = symbol
+        self.side = side
+        self.time_in_force = time_in_force
+        self.decimals = decimals
+        self.prefix = f"symbol={symbol}&side={side}&type=LIMIT&timeInForce={time_in_force}&quantity="
+        self.mac = key_mac.copy()
+        self.mac.update(self.prefix.encode())
+
+    def body(self, amount, price):
+        """Return the signed request body."""
+        suffix = f"{amount:.{self.decimals}f}&price={price:.8f}&timestamp={int(time.time() * 1000)}"
+        mac = self.mac.copy()
+        mac.update(suffix.encode())
+        return f"{self.prefix}{suffix}&signature={mac.hexdigest()}"
+
+
+class OrderEntry:
+    """Send orders over keep-alive connections held by long-lived sender threads.
+
+    Every sender has its own session with one connection that is pinged when idle, so an order never
+    waits for a TCP/TLS handshake or a thread to start. `place` signs the orders in the calling thread
+    and returns futures that resolve to the order responses (or raise BinanceAPIException, like
+    `Client.create_order`). Every future has a `timing` dict with perf_counter_ns marks:
+    decided (place was called), signed, sent (sender started the request) and received.
+    """
+
+    def __init__(self, api_key, api_secret, actions=(), url=API_URL, senders=ORDER_SENDERS,
+                 keepalive_interval=ORDER_KEEPALIVE_INTERVAL, timeout=ORDER_TIMEOUT):
+        self.api_key = api_key
+        self.key_mac = hmac.new((api_secret or "").encode(), digestmod=hashlib.sha256)
+        self.url = url.rstrip("/")
+        self.senders = senders
+        self.keepalive_interval = keepalive_interval
+        self.timeout = timeout
+        self.templates = {}  # (symbol, side, time in force) -> OrderTemplate
+        for action in actions:
+            for time_in_force in ("IOC", "FOK"):
+                self.template(action.symbol, action.side, time_in_force, action.decimals)
+
+        self.jobs = queue.Queue()
+        self.threads = []
+        self.running = False
+
+        # Counters (ns)
+        self.orders = 0
+        self.sign_time = 0  # decided -> signed
+        self.queue_time = 0  # signed -> sent
+        self.wire_time = 0  # sent -> received
+        self.max_wire_time = 0
+        self.used_weight = None  # Request weight of the current minute, from the last response
+        self.order_count = None  # Orders of the last 10 seconds, from the last response
+
+    def template(self, symbol, side, time_in_force, decimals):
+        """Return the template for the order, create it if it doesn't exist yet."""
+        key = (symbol, side, time_in_force)
+        template = self.templates.get(key)
+        if template is None:
+            template = self.templates[key] = OrderTemplate(symbol, side, time_in_force, decimals, self.key_mac)
+        return template
+
+    def start(self):
+        """Start the sender threads and open their connections."""
+        if self.running:
+            return
+        self.running = True
+        self.threads = [Thread(target=self._run, name=f"sender-{i}", daemon=True) for i in range(self.senders)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the sender threads once the queued orders are sent."""
+        self.running = False
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join(timeout)
+
+    def place(self, instructions, time_in_force="IOC", decimals=None):
+        """Sign the instructions and queue them for sending; return futures in instruction order."""
+        decided = time.perf_counter_ns()
+        if not self.running:
+            self.start()
+        futures = []
+        for num, instruction in enumerate(instructions):
+            template = self.templates.get((instruction.symbol, instruction.side, time_in_force))
+            if template is None:
+                template = self.template(instruction.symbol, instruction.side, time_in_force, decimals[num])
+            future = Future()
+            future.timing = {"decided": decided}
+            body = template.body(instruction.amount, instruction.price)
+            future.timing["signed"] = time.perf_counter_ns()
+            self.jobs.put((future, "POST", body))
+            futures.append(future)
+
+        return futures
+
+    def order(self, params):
+        """Sign any order parameters (as passed to Client.create_order) and queue the order; return its future."""
+        return self._signed("POST", params)
+
+    def query(self, symbol, client_order_id):
+        """Queue a query of the order with the client order id; return the future of the order (as Client.get_order)."""
+        return self._signed("GET", {"symbol": symbol, "origClientOrderId": client_order_id})
+
+    def _signed(self, method, params):
+        if not self.running:
+            self.start()
+        future = Future()
+        future.timing = {"decided": time.perf_counter_ns()}
+        query = f"{urlencode(params)}&timestamp={int(time.time() * 1000)}"
+        mac = self.key_mac.copy()
+        mac.update(query.encode())
+        body = f"{query}&signature={mac.hexdigest()}"
+        future.timing["signed"] = time.perf_counter_ns()
+        self.jobs.put((future, method, body))
+
+        return future
+
+    def stats(self):
+        """Return the counters, times are averages in microseconds."""
+        orders = self.orders or 1
+        return {"orders": self.orders,
+                "sign": self.sign_time / orders / 1e3,
+                "queue": self.queue_time / orders / 1e3,
+                "wire": self.wire_time / orders / 1e3,
+                "max_wire": self.max_wire_time / 1e3,
+                "used_weight": self.used_weight,
+                "order_count": self.order_count}
+
+    def _session(self):
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        session.headers.update({"X-MBX-APIKEY": self.api_key,
+                                "Accept": "application/json",
+                                "Content-Type": "application/x-www-form-urlencoded"})
+        return session
+
+    def _ping(self, session, ping_request):
+        try:
+            session.send(ping_request, timeout=self.timeout)
+        except requests.RequestException:
+            pass  # Connection is reopened by the next request
+
+    def _run(self):
+        session = self._session()
+        # Prepared once, every order only swaps the body. Both are sent with the same arguments, so they
+        # share the connection pool
+        order_request = session.prepare_request(requests.Request("POST", f"{self.url}/api/v3/order", data="-"))
+        ping_request = session.prepare_request(requests.Request("GET", f"{self.url}/api/v3/ping"))
+        self._ping(session, ping_request)
+        while True:
+            try:
+                job = self.jobs.get(timeout=self.keepalive_interval)
+            except queue.Empty:
+                self._ping(session, ping_request)  # Keep the connection warm
+                continue
+            if job is None:
+                break
+            future, method, body = job
+            if method == "POST":
+                request = order_request.copy()
+                request.body = body
+                request.headers["Content-Length"] = str(len(body))
+            else:
+                request = session.prepare_request(requests.Request(method, f"{self.url}/api/v3/order?{body}"))
+            future.timing["sent"] = time.perf_counter_ns()
+            try:
+                response = session.send(request, timeout=self.timeout)
+                future.timing["received"] = time.perf_counter_ns()
+                self._count(future.timing)
+                self._limits(response.headers)
+                if not 200 <= response.status_code < 300:
+                    raise BinanceAPIException(response)
+                future.set_result(response.json())
+            except Exception as e:
+                future.set_exception(e)
+        session.close()
+
+    def _limits(self, headers):
+        """Keep the rate limit usage the exchange reports with every response."""
+        weight, order_count = headers.get("x-mbx-used-weight-1m"), headers.get("x-mbx-order-count-10s")
+        if weight is not None:
+            self.used_weight = int(weight)
+        if order_count is not None:
+            self.order_count = int(order_count)
+
+    def _count(self, timing):
+        self.orders += 1
+        self.sign_time += timing["signed"] - timing["decided"]
+        self.queue_time += timing["sent"] - timing["signed"]
+        wire_time = timing["received"] - timing["sent"]
+        self.wire_time += wire_time
+        self.max_wire_time = max(self.max_wire_time, wire_time)
+
+
+class WsOrderTemplate:
+    """Order.place request of one symbol, side and time in force.
+
+    The websocket API signs the parameters in alphabetical order: apiKey, newClientOrderId, price,
+    quantity, side, symbol, timeInForce, timestamp and type, so the HMAC state only holds the api key.
+    """
+
+    __slots__ = ("decimals", "mac", "middle", "message")
+
+    def __init__(self, symbol, side, time_in_force, decimals, key_mac, api_key):
+        self.decimals = decimals
+        self.mac = key_mac.copy()
+        self.mac.update(f"apiKey={api_key}&newClientOrderId=".encode())
+        self.middle = f"&side={side}&symbol={symbol}&timeInForce={time_in_force}&timestamp="
+        self.message = ('{"id":%d,"method":"order.place","params":{"apiKey":"' + api_key + '","newClientOrderId":"%s",'
+                        '"price":"%s","quantity":"%s","side":"' + side + '","symbol":"' + symbol + '","timeInForce":"'
+                        + time_in_force + '","timestamp":%d,"type":"LIMIT","signature":"%s"}}')
+
+    def request(self, request_id, client_order_id, amount, price):
+        """Return the signed request message."""
+        price, quantity, timestamp = f"{price:.8f}", f"{amount:.{self.decimals}f}", int(time.time() * 1000)
+        mac = self.mac.copy()
+        mac.update(f"{client_order_id}&price={price}&quantity={quantity}{self.middle}{timestamp}&type=LIMIT".encode())
+        return self.message % (request_id, client_order_id, price, quantity, timestamp, mac.hexdigest())
+
+
+def full_response(order):
+    """Return the order (as Client.get_order returns it) in the shape of a FULL order response.
+
+    The query has no fills; the filled quantity is one fill at the average price, with the commission unknown (0).
+    """
+    executed, quote_qty = float(order["executedQty"]), float(order["cummulativeQuoteQty"])
+    fills = [{"price": f"{quote_qty / executed:.8f}", "qty": order["executedQty"], "commission": "0",
+              "commissionAsset": None, "tradeId": None}] if executed else []
+    keys = ("symbol", "orderId", "orderListId", "clientOrderId", "price", "origQty", "executedQty",
+            "cummulativeQuoteQty", "status", "timeInForce", "type", "side")
+    return dict({key: order[key] for key in keys}, transactTime=order["updateTime"], fills=fills)
+
+
+def api_exception(status, error):
+    """Return BinanceAPIException for an error of the websocket API, as Client.create_order would raise it.
+
+    An error without a code or message gets code -1 and a message with the status.
+    """
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps({"code": error.get("code", -1),
+                                    "msg": error.get("msg", f"Websocket API error without a message (status {status}).")}).encode()
+    return BinanceAPIException(response)
+
+
+class WsOrderEntry:
+    """Send orders as order.place requests over one persistent websocket API session.
+
+    Responses are matched to the requests by id. While the session is down, orders go to the
+    `fallback` transport (OrderEntry), so an order is never held back by a reconnect. Orders that
+    were sent when the connection broke are looked up with the fallback by their client order id:
+    they resolve to the order if it was placed (full_response) and fail with ConnectionError if it
+    wasn't or it can't be found out. Orders without a response after `timeout` seconds are looked up
+    the same way, the session stays open. Same interface and timing marks as OrderEntry.
+    """
+
+    def __init__(self, api_key, api_secret, actions=(), url=WS_API_URL, fallback=None, on_error=None,
+                 reconnect_delay=1, max_reconnect_delay=30, timeout=ORDER_TIMEOUT):
+        self.api_key = api_key or ""
+        self.key_mac = hmac.new((api_secret or "").encode(), digestmod=hashlib.sha256)
+        self.url = url
+        self.fallback = fallback
+        self.on_error = on_error  # Called with the traceback string when the session breaks or a response can't be read
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.timeout = timeout  # Longest wait for a response before the order is looked up with the fallback (sec)
+        self.templates = {}  # (symbol, side, time in force) -> WsOrderTemplate
+        for action in actions:
+            for time_in_force in ("IOC", "FOK"):
+                self.template(action.symbol, action.side, time_in_force, action.decimals)
+
+        self.ids = itertools.count(1)
+        self.client_prefix = f"ws{uuid.uuid4().hex[:16]}-"  # Client order ids are the prefix and the request id
+        self.pending = {}  # Request id -> (future, order parameters)
+        self.socket = None  # Open connection
+        self.ready = Event()  # Set while the session is open
+        self.loop = None
+        self.thread = None
+        self.running = False
+
+        # Counters (ns)
+        self.orders = 0
+        self.fallbacks = 0  # Orders sent with the fallback transport
+        self.reconnects = 0
+        self.sign_time = 0
+        self.queue_time = 0
+        self.wire_time = 0
+        self.max_wire_time = 0
+        self.used_weight = None  # Request weight of the current minute, from the last response
+        self.order_count = None  # Orders of the last 10 seconds, from the last response
+
+    @property
+    def connected(self):
+        return self.socket is not None
+
+    def template(self, symbol, side, time_in_force, decimals):
+        """Return the template for the order, create it if it doesn't exist yet."""
+        key = (symbol, side, time_in_force)
+        template = self.templates.get(key)
+        if template is None:
+            template = self.templates[key] = WsOrderTemplate(symbol, side, time_in_force, decimals, self.key_mac, self.api_key)
+        return template
+
+    def start(self):
+        """Open the session on a new event loop thread, start the fallback transport."""
+        if self.running:
+            return
+        self.running = True
+        if self.fallback is not None:
+            self.fallback.start()
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self._run, name="order-session", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=5):
+        """Close the session and stop the fallback transport."""
+        self.running = False
+        if self.loop is not None and self.loop.is_running():
+            self.loop.call_soon_threadsafe(self._cancel_all)
+        if self.thread is not None:
+            self.thread.join(timeout)
+        if self.fallback is not None:
+            self.fallback.stop()
+
+    def place(self, instructions, time_in_force="IOC", decimals=None):
+        """Sign the instructions and send them; return futures in instruction order."""
+        decided = time.perf_counter_ns()
+        if not self.running:
+            self.start()
+        if self.socket is None and self.fallback is not None:
+            self.fallbacks += len(instructions)
+            return self.fallback.place(instructions, time_in_force, decimals)
+        batch = []
+        for num, instruction in enumerate(instructions):
+            template = self.templates.get((instruction.symbol, instruction.side, time_in_force))
+            if template is None:
+                template = self.template(instruction.symbol, instruction.side, time_in_force, decimals[num])
+            future = Future()
+            future.timing = {"decided": decided}
+            request_id = next(self.ids)
+            client_order_id = f"{self.client_prefix}{request_id}"
+            message = template.request(request_id, client_order_id, instruction.amount, instruction.price)
+            future.timing["signed"] = time.perf_counter_ns()
+            # Parameters for the fallback, if the session breaks before the order is sent
+            params = {"symbol": instruction.symbol, "side": instruction.side, "type": "LIMIT", "timeInForce": time_in_force,
+                      "quantity": f"{instruction.amount:.{template.decimals}f}", "price": f"{instruction.price:.8f}",
+                      "newClientOrderId": client_order_id}
+            batch.append((future, request_id, message, params))
+        self.loop.call_soon_threadsafe(self._send, batch)
+
+        return [future for future, _, _, _ in batch]
+
+    def order(self, params):
+        """Sign any order parameters (as passed to Client.create_order) and send the order; return its future."""
+        if not self.running:
+            self.start()
+        if self.socket is None and self.fallback is not None:
+            self.fallbacks += 1
+            return self.fallback.order(params)
+        future = Future()
+        future.timing = {"decided": time.perf_counter_ns()}
+        request_id = next(self.ids)
+        params = dict(params)
+        params.setdefault("newClientOrderId", f"{self.client_prefix}{request_id}")
+        signed = dict(sorted(dict(params, apiKey=self.api_key, timestamp=int(time.time() * 1000)).items()))
+        mac = self.key_mac.copy()
+        mac.update(urlencode(signed).encode())
+        signed["signature"] = mac.hexdigest()
+        message = json.dumps({"id": request_id, "method": "order.place", "params": signed})
+        future.timing["signed"] = time.perf_counter_ns()
+        self.loop.call_soon_threadsafe(self._send, [(future, request_id, message, params)])
+
+        return future
+
+    def stats(self):
+        """Return the counters, times are averages in microseconds."""
+        orders = self.orders or 1
+        return {"orders": self.orders,
+                "fallbacks": self.fallbacks,
+                "reconnects": self.reconnects,
+                "connected": self.connected,
+                "sign": self.sign_time / orders / 1e3,
+                "queue": self.queue_time / orders / 1e3,
+                "wire": self.wire_time / orders / 1e3,
+                "max_wire": self.max_wire_time / 1e3,
+                "used_weight": self.used_weight,
+                "order_count": self.order_count}
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._session())
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+
+    def _cancel_all(self):
+        for task in asyncio.all_tasks(self.loop):
+            task.cancel()
+
+    def _send(self, batch):
+        for future, request_id, message, params in batch:
+            if self.socket is None:
+                self._send_fallback(future, params)
+                continue
+            future.timing["sent"] = time.perf_counter_ns()
+            self.pending[request_id] = (future, params)
+            self.loop.create_task(self.socket.send(message))
+            self.loop.call_later(self.timeout, self._expire, request_id)
+
+    def _send_fallback(self, future, params):
+        if self.fallback is None:
+            future.set_exception(ConnectionError("Order session is down."))
+            return
+        self.fallbacks += 1
+        fallback_future = self.fallback.order(params)
+
+        def done(fallback_future):
+            # The order was decided before the session broke, only the later stages are the fallback's
+            future.timing.update((stage, fallback_future.timing[stage]) for stage in ("signed", "sent", "received")
+                                 if stage in fallback_future.timing)
+            if fallback_future.exception() is not None:
+                future.set_exception(fallback_future.exception())
+            else:
+                future.set_result(fallback_future.result())
+        fallback_future.add_done_callback(done)
+
+    def _expire(self, request_id):
+        """Look up the order if its response hasn't come yet."""
+        future, params = self.pending.pop(request_id, (None, None))
+        if future is not None:
+            self._reconcile(future, params, "No order response in time")
+
+    def _reconcile(self, future, params, reason="Order session closed before the response"):
+        """Resolve an order whose response was lost with the order the fallback finds by its client order id."""
+        if self.fallback is None:
+            future.set_exception(ConnectionError(f"{reason}."))
+            return
+        query = self.fallback.query(params["symbol"], params["newClientOrderId"])
+
+        def done(query):
+            error = query.exception()
+            if error is None:
+                future.set_result(full_response(query.result()))
+            elif isinstance(error, BinanceAPIException) and error.code == -2013:
+                future.set_exception(ConnectionError(f"{reason}, the order wasn't placed."))
+            else:
+                future.set_exception(ConnectionError(f"{reason}, the order's state is unknown: {error}"))
+        query.add_done_callback(done)
+
+    def _receive(self, msg):
+        future, _ = self.pending.pop(msg.get("id"), (None, None))
+        if future is None:
+            return
+        try:
+            self._resolve(future, msg)
+        except Exception as e:
+            # The order was popped from pending, so nothing else would resolve it
+            if not future.done():
+                future.set_exception(e)
+            if self.on_error is not None:
+                self.on_error(traceback.format_exc())
+
+    def _resolve(self, future, msg):
+        timing = future.timing
+        timing["received"] = time.perf_counter_ns()
+        self.orders += 1
+        self.sign_time += timing["signed"] - timing["decided"]
+        self.queue_time += timing["sent"] - timing["signed"]
+        wire_time = timing["received"] - timing["sent"]
+        self.wire_time += wire_time
+        self.max_wire_time = max(self.max_wire_time, wire_time)
+        for limit in msg.get("rateLimits", ()):
+            if limit["rateLimitType"] == "REQUEST_WEIGHT" and limit["interval"] == "MINUTE":
+                self.used_weight = limit["count"]
+            elif limit["rateLimitType"] == "ORDERS" and limit["interval"] == "SECOND":
+                self.order_count = limit["count"]
+        if msg.get("status") == 200:
+            future.set_result(msg["result"])
+        else:
+            future.set_exception(api_exception(msg.get("status"), msg.get("error") or {}))
+
+    async def _session(self):
+        """Keep the session open until the transport stops."""
+        delay = self.reconnect_delay
+        while self.running:
+            try:
+                async with websockets.connect(self.url, max_queue=None) as socket_:
+                    self.socket = socket_
+                    self.ready.set()
+                    delay = self.reconnect_delay
+                    async for raw in socket_:
+                        self._receive(json.loads(raw))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if self.on_error is not None:
+                    self.on_error(traceback.format_exc())
+            finally:
+                self.socket = None
+                self.ready.clear()
+                pending, self.pending = self.pending, {}
+                for future, params in pending.values():
+                    self._reconcile(future, params)
+            if self.running:
+                self.reconnects += 1
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_reconnect_delay)
+
+
+def order_transport(api_key, api_secret, actions=(), transport=ORDER_TRANSPORT, on_error=None, url=API_URL,
+                    ws_url=WS_API_URL):
+    """Return the order transport: "rest" (OrderEntry) or "websocket" (WsOrderEntry with the REST fallback)."""
+    rest = OrderEntry(api_key, api_secret, actions, url=url)
+    if transport == "websocket":
+        return WsOrderEntry(api_key, api_secret, actions, url=ws_url, fallback=rest, on_error=on_error)
+    return rest
@@ -0,0 +1,88 @@
+"""Compile plans once into kernels that are reused on every book update."""
+
+
+from collections import namedtuple
+
+
+Instruction = namedtuple("Instruction", "price amount side symbol")
+# Compiled action: Action fields plus everything that is the same on every walk of the plan
+Leg = namedtuple("Leg", "symbol side quote base decimals exchange book_side inverse scale asset_out asset_in")
+# How to convert a wallet asset to the home asset: market, book side and depth-walk direction
+Conversion = namedtuple("Conversion", "symbol book_side inverse")
+
+BOOK_SIDE = {"BUY": "asks", "SELL": "bids"}
+
+
+class PlanKernel:
+    """Plan with precomputed legs and wallet layout."""
+
+    __slots__ = ("plan_id", "plan", "home_asset", "start_amount", "legs", "assets", "fee_slots", "conversions", "markets")
+
+    def __init__(self, plan_id, plan, plan_markets):
+        self.plan_id = plan_id
+        self.plan = plan
+        self.home_asset = plan.home_asset
+        self.start_amount = plan.start_amount
+
+        # Wallet slots follow the order in which assets first enter the wallet, home asset first
+        self.assets = [plan.home_asset]
+        self.fee_slots = []  # Fee wallet slots, in order in which fees are first charged
+        self.legs = []
+        for action in plan.actions:
+            buy = action.side == "BUY"
+            asset_out, asset_in = (action.quote, action.base) if buy else (action.base, action.quote)
+            for asset in (asset_out, asset_in):
+                if asset not in self.assets:
+                    self.assets.append(asset)
+            if self.assets.index(asset_in) not in self.fee_slots:
+                self.fee_slots.append(self.assets.index(asset_in))
+            self.legs.append(Leg(symbol=action.symbol,
+                                 side=action.side,
+                                 quote=action.quote,
+                                 base=action.base,
+                                 decimals=action.decimals,
+                                 exchange=action.exchange,
+                                 book_side=BOOK_SIDE[action.side],
+                                 inverse=buy,  # Buying walks the asks with the quote amount
+                                 scale=10 ** action.decimals,
+                                 asset_out=self.assets.index(asset_out),
+                                 asset_in=self.assets.index(asset_in)))
+
+        # Same market choice as Opportunity.normalize_wallet; None if there is no direct market
+        self.conversions = [None]
+        for asset in self.assets[1:]:
+            if asset + plan.home_asset in plan_markets:
+                self.conversions.append(Conversion(asset + plan.home_asset, "bids", False))
+            elif plan.home_asset + asset in plan_markets:
+                self.conversions.append(Conversion(plan.home_asset + asset, "asks", True))
+            else:
+                self.conversions.append(None)
+        # Every book the plan reads
+        self.markets = tuple(dict.fromkeys(plan.path + [conv.symbol for conv in self.conversions if conv is not None]))
+
+
+class CompiledPlans:
+    """Kernels of all plans and an index from market to the plans that trade on it."""
+
+    def __init__(self, plans, plan_markets):
+        self.kernels = [PlanKernel(plan_id, plan, plan_markets) for plan_id, plan in enumerate(plans)]
+        index = {}
+        for kernel in self.kernels:
+            for market in dict.fromkeys(kernel.plan.path):
+                index.setdefault(market, []).append(kernel.plan_id)
+        self.index = {market: tuple(plan_ids) for market, plan_ids in index.items()}
+
+    def __len__(self):
+        return len(self.kernels)
+
+    def __getitem__(self, plan_id):
+        return self.kernels[plan_id]
+
+    def affected(self, markets):
+        """Return ids of plans that trade on any of the markets, in deployment order."""
+        if isinstance(markets, str):
+            return self.index.get(markets, ())
+        plan_ids = set()
+        for market in markets:
+            plan_ids.update(self.index.get(market, ()))
+        return tuple(sorted(plan_ids))
@@ -0,0 +1,183 @@
+"""Bounded profiling windows of the running bot, started by a signal or on demand.
+
+    kill -USR1 <bot pid>       # or: python main.py --profile 30
+
+Nothing is hooked while no window runs. A window either samples the stacks of all threads
+("sample", collapsed stacks for flamegraph.pl or speedscope) or runs cProfile in the socket and
+evaluator threads ("cprofile", pstats files). Optionally, the tracemalloc difference over the window
+is written too. Files are named after the window's start time.
+"""
+
+
+import cProfile
+import io
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+import traceback
+from threading import Thread
+
+from config import PROFILE_DIR, PROFILE_DURATION, PROFILE_MODE, PROFILE_SAMPLE_INTERVAL, PROFILE_MEMORY
+
+
+def profiled(fn, profile):
+    """Return fn that runs under the profile."""
+    def call(*args):
+        try:
+            profile.enable()
+        except ValueError:
+            return fn(*args)  # Another profiler is active in this thread
+        try:
+            return fn(*args)
+        finally:
+            profile.disable()
+    return call
+
+
+class Profiler:
+    """Run one profiling window at a time over the bot's threads; `on_done` gets the written paths."""
+
+    def __init__(self, bot, directory=PROFILE_DIR, duration=PROFILE_DURATION, mode=PROFILE_MODE,
+                 interval=PROFILE_SAMPLE_INTERVAL, memory=PROFILE_MEMORY, on_done=None, on_error=None):
+        self.bot = bot
+        self.directory = directory
+        self.duration = duration
+        self.mode = mode
+        self.interval = interval  # Time between stack samples (sec)
+        self.memory = memory
+        self.on_done = on_done
+        self.on_error = on_error  # Called with the traceback string of a failed window
+        self.thread = None
+
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def install_signal(self, signum=signal.SIGUSR1):
+        """Start a window on the signal (call from the main thread)."""
+        signal.signal(signum, lambda *_: self.start())
+
+    def start(self, duration=None, mode=None, memory=None):
+        """Start a window in the background; return False if one is running already."""
+        if self.running:
+            return False
+        self.thread = Thread(target=self._window, name="profiler", daemon=True,
+                             args=(duration or self.duration, mode or self.mode, self.memory if memory is None else memory))
+        self.thread.start()
+        return True
+
+    def thread_names(self):
+        """Return thread id -> name, the bot's hot threads named after their role."""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        worker = getattr(self.bot.scheduler, "worker", None)
+        if worker is not None:
+            names[worker.ident] = "evaluator"
+        socket_thread = getattr(self.bot.feed, "thread", None) if self.bot.feed is not None else self.bot
+        if socket_thread is not None and socket_thread.ident is not None:
+            names[socket_thread.ident] = "socket"
+        return names
+
+    def socket_callbacks(self):
+        """Return (object, attribute) of every callback the market data thread calls per message."""
+        feed = self.bot.feed
+        if feed is not None:
+            return [(feed, "on_message" if hasattr(feed, "on_message") else "on_update")]
+        # python-binance: the Twisted protocol calls factory.callback for every message
+        return [(connector.factory, "callback") for connector in getattr(self.bot, "_conns", {}).values()
+                if hasattr(connector, "factory")]
+
+    def _window(self, duration, mode, memory):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        base = os.path.join(self.directory, f"profile-{stamp}")
+        paths = []
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if memory:
+                tracemalloc.start()
+                before = tracemalloc.take_snapshot()
+            if mode == "cprofile":
+                paths += self._cprofile(duration, base)
+            else:
+                paths.append(self._sample(duration, base))
+            if memory:
+                after = tracemalloc.take_snapshot()
+                tracemalloc.stop()
+                paths.append(self._memory_diff(before, after, base))
+        except Exception:
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+            if self.on_error is not None:
+                self.on_error(traceback.format_exc())
+            return
+        if self.on_done is not None:
+            self.on_done(paths)
+
+    def _sample(self, duration, base):
+        """Sample the stacks of all threads; write their counts as collapsed stacks."""
+        own = threading.get_ident()
+        names = self.thread_names()
+        counts = {}
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                key = ";".join(reversed(stack))
+                counts[key] = counts.get(key, 0) + 1
+            time.sleep(self.interval)
+
+        path = f"{base}.collapsed.txt"
+        with open(path, "w") as profile_file:
+            for stack, count in sorted(counts.items(), key=lambda item: -item[1]):
+                profile_file.write(f"{stack} {count}\n")
+        return path
+
+    def _cprofile(self, duration, base):
+        """Profile the socket callbacks and the evaluation passes; write pstats and a text summary per thread."""
+        targets = {"socket": self.socket_callbacks()}
+        if hasattr(self.bot.scheduler, "evaluate"):
+            targets["evaluator"] = [(self.bot.scheduler, "evaluate")]
+        profiles = {role: cProfile.Profile() for role in targets}
+        originals = []
+        for role, callbacks in targets.items():
+            for owner, attribute in callbacks:
+                original = getattr(owner, attribute)
+                originals.append((owner, attribute, original))
+                setattr(owner, attribute, profiled(original, profiles[role]))
+        try:
+            time.sleep(duration)
+        finally:
+            for owner, attribute, original in originals:
+                setattr(owner, attribute, original)
+            time.sleep(0.1)  # Let calls that started under the profile finish
+
+        paths = []
+        for role, profile in profiles.items():
+            profile.dump_stats(f"{base}.{role}.prof")
+            summary = io.StringIO()
+            try:
+                pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(40)
+            except TypeError:
+                summary.write("No calls.\n")  # Nothing ran under the profile
+            with open(f"{base}.{role}.txt", "w") as summary_file:
+                summary_file.write(summary.getvalue())
+            paths += [f"{base}.{role}.prof", f"{base}.{role}.txt"]
+        return paths
+
+    def _memory_diff(self, before, after, base, top=50):
+        """Write the lines that allocated the most during the window."""
+        path = f"{base}.memory.txt"
+        with open(path, "w") as memory_file:
+            for stat in after.compare_to(before, "lineno")[:top]:
+                memory_file.write(f"{stat}\n")
+        return path
@@ -5,6 +5,8 @@ import time
 
 from config import *
 from helpers import append_rows
+import book_bus
+from order_entry import order_transport
 
 
 BOTTOM_LIMIT = 36
@@ -54,8 +56,21 @@ def find_assets_price(prices_dict_, buy_asset, sell_asset):
 
 
 
-def get_latest_prices(client_):
+def asset_pairs(balances_):
+    "Return asset pairs that need a price: every asset with the normalizing asset and with its connections."
+    pairs = {(asset, NORMALIZING_ASSET) for asset in balances_ if asset != NORMALIZING_ASSET}
+    pairs.update((asset, connection) for asset, connections in CONNECTIONS.items() for connection in connections)
+
+    return pairs
+
+
+def get_latest_prices(client_, pairs=None):
     "Return latest binance price for all the available assets."
+    # Mid prices from the book bus if its feed process is running and it carries a market of every pair,
+    # the bus only has the deployment's markets
+    prices = book_bus.latest_prices()
+    if prices and pairs is not None and all(a + b in prices or b + a in prices for a, b in pairs):
+        return prices
     prices_raw = client_.get_all_tickers()  # Fetch last traded price for a market
     prices = dict([(market["symbol"], market["price"]) for market in prices_raw])
 
@@ -121,16 +136,18 @@ def round_sig(x, sig=4):
     return rounded
 
 
-def execute_instructions(client_, instructions_):
+def execute_instructions(client_, instructions_, transport=None):
+    """Execute instructions with the order transport (order_entry) if given, otherwise with the client."""
     start_timestamp = time.time()
     responses = []
     for instruction in instructions_:
         if (start_timestamp - time.time() < 1) and len(responses) == 10:
             time.sleep(1)
-        r = client_.create_order(symbol=instruction["market"],
-                                side=instruction["side"],
-                                type="MARKET",
-                                quantity=round_sig(instruction["sell_amount"], sig=4)) 
+        params = dict(symbol=instruction["market"],
+                      side=instruction["side"],
+                      type="MARKET",
+                      quantity=round_sig(instruction["sell_amount"], sig=4))
+        r = transport.order(params).result() if transport is not None else client_.create_order(**params)
         responses.append(r)
 
     return r
@@ -139,13 +156,20 @@ def execute_instructions(client_, instructions_):
 def main(execute=False):
     client = Client(api_key=BINANCE_PUBLIC, api_secret=BINANCE_SECRET)
     balances = get_account_balances(client)
-    prices = get_latest_prices(client)
+    prices = get_latest_prices(client, asset_pairs(balances))
     normalized_balances = normalize_balances(balances, prices)
     instructions = get_rebalance_instructions(normalized_balances, CONNECTIONS)
     denormalized_instructions = denormalize_instructions(instructions, prices)
     formatted_instructions = format_instructions(denormalized_instructions)
     if execute:
-        execute_instructions(client, denormalized_instructions)
+        # Websocket API session if it's the configured transport, REST client otherwise
+        transport = order_transport(BINANCE_PUBLIC, BINANCE_SECRET) if ORDER_TRANSPORT == "websocket" else None
+        if transport is not None:
+            transport.start()
+            transport.ready.wait(5)  # Orders go over REST if the session doesn't open in time
+        execute_instructions(client, denormalized_instructions, transport)
+        if transport is not None:
+            transport.stop()
 
     return formatted_instructions
     
@@ -153,7 +177,7 @@ def main(execute=False):
 if __name__ == "__main__":
     client = Client(api_key=BINANCE_PUBLIC, api_secret=BINANCE_SECRET)
     balances = get_account_balances(client)
-    prices = get_latest_prices(client)
+    prices = get_latest_prices(client, asset_pairs(balances))
     normalized_balances = normalize_balances(balances, prices)
     pprint(sum(normalized_balances.values()))
     # instructions = get_rebalance_instructions(normalized_balances, CONNECTIONS)
@@ -0,0 +1,348 @@
+"""Replay recorded market data through the bot with a simulated clock and exchange.
+
+Record with the deployment's global setting "record": "<path>.jsonl.gz", replay with:
+    python replay.py <recording> [deployment settings file] [--latency SEC]
+
+Every recorded message goes through BinanceBot.handle_message and every pass through
+process_updates, on one thread and in recording order, so a replay of the same data is deterministic.
+Orders are matched against the recorded depth by SimExchange instead of being sent.
+"""
+
+
+import argparse
+import gzip
+import json
+import time
+from collections import deque
+from concurrent.futures import Future
+from threading import Condition, Lock
+
+import binance_bot  # Module import, binance_bot imports Recorder from here
+from config import FEE, DEPLOYMENT_SETTINGS_SOURCE
+from order_book import Book, DiffBook
+from order_entry import api_exception
+
+
+SNAPSHOT = "@snapshot"  # Stream suffix of recorded REST snapshots (diff mode)
+
+
+class Recorder:
+    """Append raw market data messages with their receive time to a gzipped JSON lines file."""
+
+    def __init__(self, path):
+        self.file = gzip.open(path, "at")
+        self.lock = Lock()
+
+    def write(self, msg, timestamp):
+        with self.lock:
+            self.file.write(json.dumps([timestamp, msg]) + "\n")
+
+    def snapshot(self, pair, snapshot, timestamp):
+        """Record a REST snapshot the diff book started from."""
+        self.write({"stream": pair.lower() + SNAPSHOT, "data": snapshot}, timestamp)
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def read_recording(path):
+    """Yield (timestamp, message) of a recording."""
+    with gzip.open(path, "rt") as recording:
+        for line in recording:
+            timestamp, msg = json.loads(line)
+            yield timestamp, msg
+
+
+class SimClock:
+    """Stands in for the time module in binance_bot; time moves only with the recorded messages."""
+
+    def __init__(self, now=0.):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def perf_counter_ns(self):
+        return int(self.now * 1e9)
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class SimClient:
+    """Stands in for binance.client.Client, nothing is requested.
+
+    A book that goes out of sync (diff mode) waits for the snapshot its recorded resync loaded, which
+    comes later in the recording.
+    """
+
+    def __init__(self):
+        self.snapshots = {}  # Symbol -> (count, last) of the recorded snapshots replayed so far
+        self.condition = Condition()
+
+    def recorded(self, symbol, snapshot):
+        """Take a recorded snapshot that the replay loaded."""
+        with self.condition:
+            count, _ = self.snapshots.get(symbol, (0, None))
+            self.snapshots[symbol] = (count + 1, snapshot)
+            self.condition.notify_all()
+
+    def get_order_book(self, symbol, limit=None):
+        """Return the next recorded snapshot of the symbol."""
+        with self.condition:
+            count, _ = self.snapshots.get(symbol, (0, None))
+            self.condition.wait_for(lambda: self.snapshots.get(symbol, (0, None))[0] > count)
+            return self.snapshots[symbol][1]
+
+
+class ImmediateScheduler:
+    """Evaluate on the replay thread right after every book update."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.passes = 0
+        self.evaluations = 0  # Plans evaluated
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def mark(self, market):
+        self.passes += 1
+        self.evaluations += len(self.bot.compiled.affected(market))
+        self.bot.process_updates((market,))
+
+    def stats(self):
+        return {"passes": self.passes, "evaluations": self.evaluations}
+
+
+class NullSink:
+    """Counts rows and messages instead of sending them; also the order entry of a bot that doesn't execute."""
+
+    def __init__(self):
+        self.rows = 0
+        self.messages = []
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def append(self, dataset, table, rows):
+        self.rows += len(rows)
+
+    def send(self, msg, channel, emoji=None, digest=None):
+        self.messages.append((digest, msg))
+
+
+class SimExchange:
+    """Fill LIMIT IOC/FOK orders against the recorded books, `latency` seconds after they are placed.
+
+    With latency, orders see the last recorded depth snapshot before the arrival time (partial depth
+    mode); otherwise, and in the diff mode, they see the books the bot decided on. Balances are
+    unlimited unless given, then orders that don't have enough fail like on the exchange (-2010).
+    """
+
+    def __init__(self, replay, latency=0., fee=FEE, balances=None):
+        self.replay = replay
+        self.latency = latency
+        self.fee = fee
+        self.balances = dict(balances) if balances is not None else None
+        self.order_id = 0
+        self.orders = 0
+        self.filled = 0  # Orders filled completely
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def place(self, instructions, time_in_force="IOC", decimals=None):
+        """Match the orders and return resolved futures, as order_entry.OrderEntry.place does."""
+        arrival = self.replay.clock.now + self.latency
+        futures = []
+        for instruction in instructions:
+            future = Future()
+            future.timing = {}
+            try:
+                future.set_result(self.match(instruction, time_in_force, arrival))
+            except Exception as e:
+                future.set_exception(e)
+            futures.append(future)
+        return futures
+
+    def match(self, instruction, time_in_force, arrival):
+        """Return the order response of the instruction."""
+        self.order_id += 1
+        self.orders += 1
+        book = self.replay.book_at(instruction.symbol, arrival)
+        buy = instruction.side == "BUY"
+        px, qty, length = (book.ask_px, book.ask_qty, book.ask_len) if buy else (book.bid_px, book.bid_qty, book.bid_len)
+        fills = []
+        left = instruction.amount
+        for i in range(length):
+            if left <= 0 or (px[i] > instruction.price if buy else px[i] < instruction.price):
+                break
+            size = min(left, qty[i])
+            fills.append((px[i], size))
+            left -= size
+        executed = instruction.amount - left if left > 1e-12 else instruction.amount
+        if time_in_force == "FOK" and left > 1e-12:
+            fills, executed = [], 0.
+        quote = sum(price * size for price, size in fills)
+
+        if self.balances is not None:
+            base, quote_asset = self.replay.assets[instruction.symbol]
+            asset_out, amount_out = (quote_asset, quote) if buy else (base, executed)
+            if self.balances.get(asset_out, 0.) < amount_out:
+                raise api_exception(400, {"code": -2010, "msg": "Account has insufficient balance for requested action."})
+            asset_in, amount_in = (base, executed) if buy else (quote_asset, quote)
+            self.balances[asset_out] -= amount_out
+            self.balances[asset_in] = self.balances.get(asset_in, 0.) + amount_in * (1 - self.fee)
+
+        status = "FILLED" if executed and executed == instruction.amount else "EXPIRED"
+        self.filled += status == "FILLED"
+        commission_asset = self.replay.assets[instruction.symbol][0 if buy else 1]
+        return {"symbol": instruction.symbol,
+                "orderId": self.order_id,
+                "orderListId": -1,
+                "clientOrderId": f"replay{self.order_id}",
+                "transactTime": int(arrival * 1000),
+                "price": format(instruction.price, ".8f"),
+                "origQty": format(instruction.amount, ".8f"),
+                "executedQty": format(executed, ".8f"),
+                "cummulativeQuoteQty": format(quote, ".8f"),
+                "status": status,
+                "timeInForce": time_in_force,
+                "type": "LIMIT",
+                "side": instruction.side,
+                "fills": [{"price": format(price, ".8f"),
+                           "qty": format(size, ".8f"),
+                           "commission": format(size * (1 if buy else price) * self.fee, ".8f"),
+                           "commissionAsset": commission_asset,
+                           "tradeId": self.order_id} for price, size in fills]}
+
+
+class Replay:
+    """Run plans over a recording and report what the bot would have done."""
+
+    def __init__(self, plans, recording, settings=None, latency=0., fee=FEE, balances=None):
+        self.clock = SimClock()
+        self.recording = recording
+        self.messages = None  # Iterator over the recording
+        self.ahead = deque()  # Messages read ahead to find books after the order latency
+        self.assets = {action.symbol: (action.base, action.quote) for plan in plans for action in plan.actions}
+        self.opportunities = []  # Opportunities the bot acted on
+
+        self.client = SimClient()
+        settings = dict(settings or {}, latency=False)  # Marks would mix the simulated and the real clock
+        bot = binance_bot.BinanceBot(plans, execute=True, test_it=False, loop=True, settings=settings,
+                                     client=self.client, sink=NullSink(), notifier=NullSink(),
+                                     order_entry=SimExchange(self, latency, fee, balances))
+        bot.scheduler = ImmediateScheduler(bot)
+        bot.balances = dict(balances) if balances is not None else None  # Trade sizes follow the simulated balances
+        bot.on_opportunity = self.opportunities.append
+        if bot.depth_mode == "diff":
+            bot.local_books = {pair: DiffBook(pair) for pair in bot.plan_markets}
+        self.bot = bot
+
+    def book_at(self, symbol, timestamp):
+        """Return the symbol's book at the time; the current book if there is no later snapshot."""
+        book = self.bot.books[symbol]
+        if timestamp <= self.clock.now or self.bot.depth_mode == "diff":
+            return book
+        stream = next(stream for stream, pair in self.bot.stream_symbols.items() if pair == symbol)
+        while not self.ahead or self.ahead[-1][0] <= timestamp:
+            try:
+                self.ahead.append(next(self.messages))
+            except StopIteration:
+                break
+        for msg_timestamp, msg in self.ahead:
+            if msg_timestamp > timestamp:
+                break
+            if msg.get("stream") == stream:
+                book = Book(symbol)
+                book.fill(msg["data"], msg_timestamp)
+        return book
+
+    def run(self):
+        """Replay the whole recording and return the report."""
+        real_time = binance_bot.time
+        binance_bot.time = self.clock
+        start = time.perf_counter()
+        first = None
+        count = 0
+        self.messages = read_recording(self.recording)
+        try:
+            while True:
+                if self.ahead:
+                    timestamp, msg = self.ahead.popleft()
+                else:
+                    try:
+                        timestamp, msg = next(self.messages)
+                    except StopIteration:
+                        break
+                first = timestamp if first is None else first
+                self.clock.now = timestamp
+                count += 1
+                if msg.get("stream", "").endswith(SNAPSHOT):
+                    pair = msg["stream"][:-len(SNAPSHOT)].upper()
+                    self.bot.local_books[pair].load_snapshot(msg["data"], timestamp)
+                    self.bot.books[pair] = self.bot.local_books[pair].book
+                    self.client.recorded(pair, msg["data"])
+                    continue
+                self.bot.handle_message(msg)
+        finally:
+            binance_bot.time = real_time
+        wall = time.perf_counter() - start
+
+        return self.report(count, self.clock.now - first if first is not None else 0., wall)
+
+    def report(self, messages, sim_seconds, wall_seconds):
+        """Return PnL, fills and speed of the replay."""
+        executed = [opportunity for opportunity in self.opportunities if opportunity.actual_balance is not None]
+        pnl, estimated = {}, {}
+        for opportunity in self.opportunities:
+            asset = opportunity.plan.home_asset
+            estimated[asset] = estimated.get(asset, 0.) + opportunity.profit
+            if opportunity.actual_balance is not None:
+                pnl[asset] = pnl.get(asset, 0.) + opportunity.actual_balance
+        exchange = self.bot.order_entry
+        scheduler = self.bot.scheduler
+        return {"messages": messages,
+                "sim_seconds": sim_seconds,
+                "wall_seconds": wall_seconds,
+                "speedup": sim_seconds / wall_seconds if wall_seconds else 0.,
+                "passes": scheduler.passes,
+                "evaluations": scheduler.evaluations,
+                "evaluations_per_sec": scheduler.evaluations / wall_seconds if wall_seconds else 0.,
+                "opportunities": len(self.opportunities),
+                "executed": len(executed),
+                "passed": sum(opportunity.execution_status == "PASS" for opportunity in executed),
+                "orders": exchange.orders,
+                "orders_filled": exchange.filled,
+                "fill_ratio": sum(opportunity.success_ratio for opportunity in executed) / len(executed) if executed else 0.,
+                "estimated_profit": estimated,
+                "pnl": pnl,
+                "errors": sum(digest != "opportunities" for digest, _ in self.bot.notifier.messages)}
+
+
+if __name__ == "__main__":
+    from main import get_plans
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("recording")
+    parser.add_argument("deployment", nargs="?", default=DEPLOYMENT_SETTINGS_SOURCE)
+    parser.add_argument("--latency", default=0., type=float, help="Order arrival delay (sec)")
+    args = parser.parse_args()
+
+    with open(args.deployment) as ds_file:
+        deployment_settings = json.load(ds_file)
+    replay = Replay(get_plans(deployment_settings), args.recording, deployment_settings["global_settings"], args.latency)
+    for key, value in replay.run().items():
+        print(f"{key}: {value}")
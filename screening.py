@@ -0,0 +1,54 @@
+"""Top-of-book screening of plans."""
+
+
+import numpy as np
+
+from config import FEE, SCREEN_MARGIN
+
+
+class TopOfBookScreen:
+    """Reject plans from the best bid and ask alone.
+
+    Walking the depth can only give a worse price than the top of the book, so a plan whose
+    top-of-book return (fees included) is below 1 - margin can't be profitable. The margin covers
+    the leftovers that rounding puts back into the wallet.
+    """
+
+    def __init__(self, compiled, markets, fee=FEE, margin=SCREEN_MARGIN):
+        kernels = compiled.kernels
+        self.market_index = {market: i for i, market in enumerate(sorted(markets))}
+        self.log_bid = np.full(len(self.market_index), np.nan)
+        self.log_ask = np.full(len(self.market_index), np.nan)
+        self.threshold = np.log(1 - margin)
+
+        legs = max([len(kernel.legs) for kernel in kernels], default=0)
+        self.leg_mask = np.zeros((len(kernels), legs), dtype=bool)
+        self.leg_market = np.zeros((len(kernels), legs), dtype=np.int64)
+        self.leg_buy = np.zeros((len(kernels), legs), dtype=bool)
+        for row, kernel in enumerate(kernels):
+            for col, leg in enumerate(kernel.legs):
+                self.leg_mask[row, col] = True
+                self.leg_market[row, col] = self.market_index[leg.symbol]
+                self.leg_buy[row, col] = leg.inverse
+        self.log_fee = self.leg_mask.sum(axis=1) * np.log(1 - fee)
+        self.affected = {market: np.array(plan_ids, dtype=np.int64) for market, plan_ids in compiled.index.items()}
+
+    def update(self, market, bid, ask):
+        """Save the best prices of the market and return True if any of its plans passes the screen."""
+        i = self.market_index[market]
+        with np.errstate(divide="ignore"):
+            self.log_bid[i] = np.log(bid)
+            self.log_ask[i] = np.log(ask)
+        return self.passes(market)
+
+    def passes(self, market):
+        """Return True if any plan trading on the market could be profitable."""
+        scores = self.scores(self.affected.get(market, ()))
+        return bool(np.any(~(scores <= self.threshold)))  # Unknown prices (NaN) can't reject a plan
+
+    def scores(self, plan_ids):
+        """Return log of the top-of-book return of the plans, fees included."""
+        rows = np.asarray(plan_ids, dtype=np.int64)
+        market = self.leg_market[rows]
+        rates = np.where(self.leg_buy[rows], -self.log_ask[market], self.log_bid[market])
+        return np.where(self.leg_mask[rows], rates, 0.).sum(axis=1) + self.log_fee[rows]
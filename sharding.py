@@ -0,0 +1,208 @@
+"""Plan evaluation spread over worker processes."""
+
+
+import multiprocessing as mp
+import queue
+import time
+import traceback
+from threading import Thread
+
+from plan_compiler import CompiledPlans
+from vector_engine import BatchEngine
+from order_book import Book
+
+
+def partition_plans(kernels, shards):
+    """Split plan ids into shards so that plans reading the same markets end up together."""
+    shards = max(1, min(shards, len(kernels)))
+    capacity = -(-len(kernels) // shards)  # Keep shards balanced
+    groups = [[] for _ in range(shards)]
+    group_markets = [set() for _ in range(shards)]
+    # Place plans with the most markets first, then follow the overlap
+    for plan_id in sorted(range(len(kernels)), key=lambda i: (-len(kernels[i].markets), kernels[i].markets)):
+        markets = set(kernels[plan_id].markets)
+        candidates = [shard for shard in range(shards) if len(groups[shard]) < capacity]
+        shard = max(candidates, key=lambda s: (len(markets & group_markets[s]),
+                                               -len(markets - group_markets[s]),
+                                               -len(groups[s])))
+        groups[shard].append(plan_id)
+        group_markets[shard].update(markets)
+
+    return [sorted(group) for group in groups if group]
+
+
+def run_shard(shard_id, plans, plan_ids, plan_markets, inbox, results, test_it=False, sizing=False, merged=None):
+    """Worker process: keep books of the shard's markets and evaluate its plans on every update.
+
+    With sizing, plans with a positive top-of-book return are candidates too (BinanceBot.process_plans).
+    Updates merged into a market already waiting for the pass are added to `merged` (shared Value).
+    Every pass reports the number of plans it evaluated, with or without candidates.
+    """
+    compiled = CompiledPlans(plans, plan_markets)  # Conversions are chosen from all markets, as in the bot
+    engine = BatchEngine(compiled.kernels, plan_markets)
+    needed = {market for kernel in compiled.kernels for market in kernel.markets}
+    books = {}
+
+    while True:
+        # Take everything that is waiting, so a pass covers all markets that changed meanwhile
+        item = inbox.get()
+        dirty = set()
+        oldest = None  # Receive time of the oldest update in the pass
+        taken = 0
+        while item is not None:
+            pair, bid_px, bid_qty, ask_px, ask_qty, last_update_id, timestamp = item
+            book = books.get(pair)
+            if book is None:
+                book = books[pair] = Book(pair, max(len(bid_px), len(ask_px), 1))
+            book.load(bid_px, bid_qty, ask_px, ask_qty, last_update_id, timestamp)
+            dirty.add(pair)
+            taken += 1
+            oldest = timestamp if oldest is None else min(oldest, timestamp)
+            try:
+                item = inbox.get_nowait()
+            except queue.Empty:
+                break
+        if merged is not None and taken > len(dirty):
+            with merged.get_lock():
+                merged.value += taken - len(dirty)
+        if item is None:
+            return
+        if len(books) < len(needed):
+            continue
+
+        try:
+            local_ids = compiled.affected(dirty)
+            estimates = engine.evaluate(books, local_ids)
+            sizable = engine.top_returns(local_ids) > 0 if sizing else [False] * len(local_ids)
+            candidates = [(i, estimate, bool(size)) for i, estimate, size in zip(local_ids, estimates, sizable)
+                          if not estimate <= 0 or size]  # NaN included
+            if test_it and local_ids and (not candidates or candidates[-1][0] != local_ids[-1]):
+                candidates.append((local_ids[-1], estimates[-1], False))
+            if local_ids:
+                results.put((shard_id, [plan_ids[i] for i, _, _ in candidates], [float(e) for _, e, _ in candidates],
+                             [size for _, _, size in candidates], oldest, len(local_ids)))
+        except Exception:
+            results.put((shard_id, None, traceback.format_exc(), None, oldest, 0))
+
+
+class ShardRouter:
+    """Route book updates to evaluation shards and act on the candidates they find.
+
+    Has the same interface as binance_bot.UpdateScheduler, so the bot's ingest stays unchanged: the
+    feed process decodes every message once and sends the book's levels to the shards that read the
+    market. Candidates are priced and executed by the bot in this process, one at a time.
+    """
+
+    def __init__(self, bot, shards):
+        self.bot = bot
+        self.groups = partition_plans(bot.compiled.kernels, shards)
+        self.context = mp.get_context("spawn")  # Workers must not inherit the socket threads
+        self.results = self.context.Queue()
+        self.inboxes = []
+        self.processes = []
+        self.market_shards = {}  # Market -> shards that read its book
+        for shard_id, plan_ids in enumerate(self.groups):
+            for market in {market for i in plan_ids for market in bot.compiled[i].markets}:
+                self.market_shards.setdefault(market, []).append(shard_id)
+        self.running = False
+        self.collector = None
+
+        # Counters
+        self.updates = 0
+        self.sent = 0  # Book updates sent to shards
+        self.merged = self.context.Value("q", 0)  # Updates the shards merged into a pending one
+        self.passes = 0  # Candidate batches handled (shard passes without candidates aren't)
+        self.failed = 0  # Shard passes and candidate batches that raised
+        self.lag = 0.  # Time from the oldest book update in a batch to acting on it (sec)
+        self.max_lag = 0.
+        self.busy = False
+
+    def start(self):
+        """Start the worker processes and the collector thread if they aren't running."""
+        if self.running:
+            return
+        self.running = True
+        self.inboxes, self.processes = [], []
+        for shard_id, plan_ids in enumerate(self.groups):
+            inbox = self.context.Queue()
+            process = self.context.Process(target=run_shard, name=f"shard-{shard_id}", daemon=True,
+                                           args=(shard_id, [self.bot.plans[i] for i in plan_ids], plan_ids,
+                                                 self.bot.plan_markets, inbox, self.results, self.bot.test_it,
+                                                 self.bot.sizing, self.merged))
+            process.start()
+            self.inboxes.append(inbox)
+            self.processes.append(process)
+        self.collector = Thread(target=self._collect, name="collector", daemon=True)
+        self.collector.start()
+
+    def stop(self):
+        """Stop the workers and the collector."""
+        self.running = False
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for process in self.processes:
+            process.join(5)
+
+    def mark(self, market):
+        """Send the market's latest book to the shards that read it."""
+        self.updates += 1
+        book = self.bot.books[market]
+        levels = (market, book.bid_px[:book.bid_len].copy(), book.bid_qty[:book.bid_len].copy(),
+                  book.ask_px[:book.ask_len].copy(), book.ask_qty[:book.ask_len].copy(),
+                  book.last_update_id, book.timestamp)
+        for shard_id in self.market_shards.get(market, ()):
+            self.inboxes[shard_id].put(levels)
+            self.sent += 1
+
+    def pending(self):
+        """Return the book updates waiting in the shards' inboxes (None where the platform can't tell)."""
+        try:
+            return sum(inbox.qsize() for inbox in self.inboxes)
+        except NotImplementedError:  # macOS
+            return None
+
+    def stats(self):
+        """Return the counters, with the keys of UpdateScheduler.stats."""
+        return {"updates": self.updates,
+                "sent": self.sent,
+                "fanout": self.sent / self.updates if self.updates else 0.,
+                "merged": self.merged.value,
+                "pending": self.pending(),
+                "passes": self.passes,
+                "failed": self.failed,
+                "shards": [len(group) for group in self.groups],
+                "alive": sum(process.is_alive() for process in self.processes),
+                "lag": self.lag,
+                "max_lag": self.max_lag}
+
+    def _collect(self):
+        while self.running:
+            try:
+                shard_id, plan_ids, estimates, sizable, oldest, evaluated = self.results.get(timeout=1)
+            except queue.Empty:
+                continue
+            self.bot.plans_evaluated.inc(value=evaluated)
+            if plan_ids is None:
+                self.failed += 1
+                self.bot.exceptions.append(f"Shard {shard_id}:\n{estimates}")
+                continue
+            if not plan_ids:
+                continue
+            self.busy = True
+            self.bot.pass_started = time.perf_counter_ns()  # Decisions are made here, the shards only estimate
+            try:
+                self.bot.snapshot_books()
+                self.lag = time.time() - oldest
+                self.max_lag = max(self.max_lag, self.lag)
+                if len(self.bot.process_books) < len(self.bot.plan_markets):
+                    # Skip plans that read books which are being resynced, the shards still have their old copies
+                    kept = [(plan_id, estimate, size) for plan_id, estimate, size in zip(plan_ids, estimates, sizable)
+                            if all(market in self.bot.process_books for market in self.bot.compiled[plan_id].markets)]
+                    plan_ids, estimates, sizable = [list(column) for column in zip(*kept)] if kept else ([], [], [])
+                self.bot.act_on_estimates(plan_ids, estimates, sizable if self.bot.sizing else None)
+            except Exception:
+                self.failed += 1
+                self.bot.exceptions.append(traceback.format_exc())
+            finally:
+                self.busy = False
+                self.passes += 1
@@ -0,0 +1,114 @@
+"""Profit-maximizing trade size of a plan on the current depth, within the exchange's order filters."""
+
+
+import math
+
+from config import FEE
+
+
+def optimal_size(kernel, books, fee=FEE, low=0., high=math.inf, balances=None):
+    """Return the start amount (home asset) with the highest profit on the books; None if no size fits.
+
+    Every leg's depth is a piecewise-linear curve of output against input, so the plan's output is
+    piecewise linear in the start amount and its profit is concave. The walk moves the start amount
+    from one level boundary to the next (of whichever leg crosses first) while the marginal return
+    of the plan, fees included, is above 1. A leg takes at most the free balance of the asset it
+    sells (balances: asset -> amount, None - no limit). The size is kept within [low, high].
+    """
+    legs = kernel.legs
+    depth = []  # (prices, quantities) of every leg, best first
+    for leg in legs:
+        px, qty, length = books[leg.symbol].side(leg.book_side)
+        depth.append((px[:length].tolist(), qty[:length].tolist()))
+    limits = [math.inf if balances is None else balances.get(kernel.assets[leg.asset_out], 0.) for leg in legs]
+    fee_gain = (1 - fee) ** len(legs)
+
+    level = [0] * len(legs)
+    filled = [0.] * len(legs)  # Input of every leg taken from its current level
+    taken = [0.] * len(legs)  # Input of every leg so far
+    size = 0.
+    while size < high:
+        step = high - size
+        gain = 1.  # Leg input per unit of the start amount, then the plan's marginal return
+        scales = []
+        for i, leg in enumerate(legs):
+            prices, quantities = depth[i]
+            if level[i] >= len(prices):
+                step = 0.  # Out of depth
+                break
+            price, qty = prices[level[i]], quantities[level[i]]
+            # Buying walks the asks with the quote amount
+            rate, capacity = (1 / price, qty * price) if leg.inverse else (price, qty)
+            step = min(step, (capacity - filled[i]) / gain, (limits[i] - taken[i]) / gain)
+            scales.append((gain, capacity))
+            gain *= rate
+        if step <= 0 or gain * fee_gain <= 1:
+            break
+        size += step
+        for i, (scale, capacity) in enumerate(scales):
+            filled[i] += step * scale
+            taken[i] += step * scale
+            if filled[i] >= capacity * (1 - 1e-12):
+                level[i] += 1
+                filled[i] = 0.
+
+    if size <= 0:
+        return None  # Not even the first unit earns, at no size
+    size *= 1 - 1e-9  # Stay inside the last level the walk reached
+    if size < low:
+        # A smaller trade isn't allowed; the smallest one still fits if the balances allow it
+        scale = 1.
+        for i, leg in enumerate(legs):
+            if low * scale > limits[i]:
+                return None
+            prices = depth[i][0]
+            if not prices:
+                return None
+            scale *= 1 / prices[0] if leg.inverse else prices[0]
+        return low if low <= high else None
+    return size
+
+
+def market_filters(exchange_info, symbols=None):
+    """Return symbol -> (min quantity, min notional) from the LOT_SIZE and (MIN_)NOTIONAL filters of get_exchange_info."""
+    filters = {}
+    for symbol_data in exchange_info["symbols"]:
+        if symbols is not None and symbol_data["symbol"] not in symbols:
+            continue
+        by_type = {f["filterType"]: f for f in symbol_data["filters"]}
+        lot_size = by_type.get("LOT_SIZE", {})
+        notional = by_type.get("NOTIONAL") or by_type.get("MIN_NOTIONAL") or {}
+        filters[symbol_data["symbol"]] = (float(lot_size.get("minQty", 0)), float(notional.get("minNotional", 0)))
+    return filters
+
+
+def min_size(kernel, books, filters):
+    """Return the smallest start amount whose orders pass the market filters at the best prices; None without depth.
+
+    Every leg's quantity is rounded down to its decimals, which the following legs inherit, so one
+    step of every leg is added on top of the largest minimum.
+    """
+    size = 0.
+    steps = 0.  # Rounding of all legs, in the start amount
+    gain = 1.  # Leg input per unit of the start amount
+    for leg in kernel.legs:
+        px, _, length = books[leg.symbol].side(leg.book_side)
+        if not length:
+            return None
+        price = float(px[0])
+        min_qty, min_notional = filters.get(leg.symbol, (0., 0.))
+        quantity = max(min_qty, min_notional / price)
+        # Buying spends the quote amount of the quantity
+        size = max(size, (quantity * price if leg.inverse else quantity) / gain)
+        steps += (price if leg.inverse else 1.) / leg.scale / gain
+        gain *= 1 / price if leg.inverse else price
+    return size + steps
+
+
+def passes_filters(instructions, filters):
+    """Return True if every order's rounded quantity meets the min quantity and min notional of its market."""
+    for instruction in instructions:
+        min_qty, min_notional = filters.get(instruction.symbol, (0., 0.))
+        if instruction.amount < min_qty or instruction.amount * instruction.price < min_notional:
+            return False
+    return True
@@ -0,0 +1,37 @@
+"""Prices read from the book bus, and regions that aren't one."""
+
+
+import uuid
+from multiprocessing import shared_memory
+
+import pytest
+
+from book_bus import BookBusReader, BookBusWriter, latest_prices
+from exceptions import NotABookBus
+from order_book import Book
+
+
+def test_latest_prices_are_the_mids_of_the_published_books():
+    name = f"test_bus_{uuid.uuid4().hex[:8]}"
+    writer = BookBusWriter(["BTCUSDT", "ETHUSDT"], name=name, depth=5)
+    try:
+        book = Book("BTCUSDT")
+        book.fill({"lastUpdateId": 1, "bids": [["9990", "1"]], "asks": [["10010", "1"]]}, 1.)
+        writer.publish(book)
+        assert latest_prices(name) == {"BTCUSDT": "10000.00000000"}  # ETHUSDT wasn't published yet
+    finally:
+        writer.close()
+    assert latest_prices(name) is None  # The feed is gone
+
+
+@pytest.mark.parametrize("size", [8, 4096])
+def test_region_that_isnt_a_bus_falls_back(size):
+    name = f"test_bus_{uuid.uuid4().hex[:8]}"
+    region = shared_memory.SharedMemory(name=name, create=True, size=size)
+    try:
+        with pytest.raises(NotABookBus):
+            BookBusReader(name)
+        assert latest_prices(name) is None  # Callers take the REST prices
+    finally:
+        region.close()
+        region.unlink()
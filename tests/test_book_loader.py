@@ -0,0 +1,42 @@
+"""Weight budget of the snapshot loader."""
+
+
+import book_loader
+from book_loader import WeightBudget
+
+
+class Clock:
+    """time.time and time.sleep of the loader, without waiting."""
+
+    def __init__(self, monkeypatch, now=1000.):
+        self.now = now
+        self.sleeps = []
+        monkeypatch.setattr(book_loader.time, "time", lambda: self.now)
+        monkeypatch.setattr(book_loader.time, "sleep", self.sleep)
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_reported_weight_over_the_budget_waits_for_its_minute(monkeypatch):
+    clock = Clock(monkeypatch)
+    budget = WeightBudget(100)
+    budget.report(150)  # Orders of the same IP used more than the loader's budget
+    clock.now += 10
+    budget.acquire(1)  # The loader hasn't sent anything itself yet
+    assert clock.now >= 1060 and sum(clock.sleeps) == budget.waited
+    assert list(budget.requests) == [(clock.now, 1)]
+
+
+def test_own_requests_wait_for_the_oldest_to_leave_the_minute(monkeypatch):
+    clock = Clock(monkeypatch)
+    budget = WeightBudget(20)
+    budget.acquire(10)
+    clock.now += 5
+    budget.acquire(10)
+    budget.acquire(10)
+    assert clock.now >= 1060 and len(budget.requests) == 2
+    budget.report(5)
+    budget.acquire(50)  # Heavier than the budget: goes once neither the header nor own requests count
+    assert clock.now >= 1120 and list(budget.requests)[-1] == (clock.now, 50)
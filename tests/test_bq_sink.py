@@ -0,0 +1,71 @@
+"""Inserts, row errors and spilled rows of the BigQuerySink."""
+
+
+import os
+
+import helpers as hp
+from bq_sink import BigQuerySink
+
+
+class Table:
+    """insert_rows of the BigQuery client: fails `failures` times, then returns the errors of `reject`."""
+
+    def __init__(self, failures=0, reject=()):
+        self.failures = failures
+        self.reject = reject  # Indexes of the rows the table rejects
+        self.inserted = []
+
+    def insert_rows(self, table, rows):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("Service unavailable")
+        self.inserted += [row for i, row in enumerate(rows) if i not in self.reject]
+        return [{"index": i, "errors": [{"reason": "invalid"}]} for i in self.reject]
+
+
+def patch(monkeypatch, table):
+    monkeypatch.setattr(hp, "client", table)
+    monkeypatch.setattr(hp, "get_table", lambda dataset, table_: f"{dataset}.{table_}")
+
+
+def rows(count):
+    return [{"id": i, "symbol": "BTCUSDT"} for i in range(count)]
+
+
+def test_accepted_and_rejected_rows_are_counted(monkeypatch, tmp_path):
+    table = Table(reject=(1,))
+    patch(monkeypatch, table)
+    errors = []
+    sink = BigQuerySink(spill_dir=str(tmp_path), on_error=errors.append)
+    sink.start()
+    sink.append("bullseye", "trades", rows(3))
+    sink.stop()
+
+    assert [row["id"] for row in table.inserted] == [0, 2]
+    stats = sink.stats()
+    assert stats["rows"] == 2 and stats["rejected"] == 1 and stats["batches"] == 1
+    assert len(errors) == 1 and "rejected rows" in errors[0]
+    assert not os.listdir(tmp_path)  # Rejected rows aren't spilled
+
+
+def test_spilled_rows_are_inserted_by_the_next_sink(monkeypatch, tmp_path):
+    table = Table(failures=2)
+    patch(monkeypatch, table)
+    errors = []
+    sink = BigQuerySink(retries=1, spill_dir=str(tmp_path), on_error=errors.append)
+    monkeypatch.setattr("bq_sink.time.sleep", lambda delay: None)
+    sink.start()
+    sink.append("bullseye", "trades", rows(3))
+    sink.stop()
+
+    assert not table.inserted
+    assert sink.stats()["spilled"] == 3 and sink.stats()["retried"] == 1
+    assert os.listdir(tmp_path) == ["bullseye.trades.jsonl"]
+    assert len(errors) == 1 and "3 rows spilled" in errors[0]
+
+    sink = BigQuerySink(spill_dir=str(tmp_path))
+    sink.start()
+    sink.stop()
+    assert table.inserted == rows(3)
+    assert sink.stats()["rows"] == 3
+    assert not os.listdir(tmp_path)
@@ -0,0 +1,122 @@
+"""CycleDetector against a brute force search of a small seeded market graph."""
+
+
+import itertools
+import math
+import random
+
+import numpy as np
+import pytest
+
+from cycle_detector import CycleDetector
+
+
+ASSETS = ("ADA", "BNB", "BTC", "ETH", "EUR", "USDT", "XRP")
+FEE = 0.001
+
+
+def market_graph(seed, density=0.6, noise=0.01):
+    """Return symbol -> (base, quote) and symbol -> (bid, ask) of random markets around consistent values."""
+    rnd = random.Random(seed)
+    values = {asset: math.exp(rnd.gauss(0, 1)) for asset in ASSETS}
+    markets, tops = {}, {}
+    for base, quote in itertools.combinations(ASSETS, 2):
+        if rnd.random() > density:
+            continue
+        if rnd.random() < 0.5:
+            base, quote = quote, base
+        mid = values[base] / values[quote] * math.exp(rnd.gauss(0, noise))
+        markets[base + quote] = (base, quote)
+        tops[base + quote] = (mid * (1 - 0.0005), mid * (1 + 0.0005))
+    return markets, tops
+
+
+def brute_force(detector, u, v):
+    """Return the weight of the cheapest simple negative cycle u -> v -> ... -> u of 3 to max_legs legs."""
+    weights = detector.weights
+    others = [node for node in range(len(detector.assets)) if node not in (u, v)]
+    best = None
+    for legs in range(3, detector.max_legs + 1):
+        for middle in itertools.permutations(others, legs - 2):
+            nodes = (u, v) + middle
+            weight = sum(weights[a, b] for a, b in zip(nodes, nodes[1:] + nodes[:1]))
+            if weight < detector.threshold and (best is None or weight < best):
+                best = weight
+    return best
+
+
+def cycle_weight(detector, cycle):
+    index = [detector.index[asset] for asset in cycle]
+    return sum(detector.weights[a, b] for a, b in zip(index, index[1:] + index[:1]))
+
+
+def rotation(cycle):
+    start = cycle.index(min(cycle))
+    return cycle[start:] + cycle[:start]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_search_finds_the_cheapest_cycle_through_every_edge(seed):
+    markets, tops = market_graph(seed)
+    detector = CycleDetector(markets, fee=FEE, max_legs=4, min_return=1.)
+    for symbol, (bid, ask) in tops.items():
+        detector.update(symbol, bid, ask)
+
+    lengths = set()
+    for u, v in detector.symbols:
+        expected = brute_force(detector, u, v)
+        result = detector.search(u, v)
+        if expected is None:
+            assert result is None
+            continue
+        weight, cycle = result
+        assert weight == pytest.approx(expected)
+        assert cycle[:2] == (detector.assets[u], detector.assets[v]) and len(set(cycle)) == len(cycle)
+        assert cycle_weight(detector, cycle) == pytest.approx(weight)
+        lengths.add(len(cycle))
+    assert lengths == {3, 4}
+
+
+def test_cycles_are_found_once_from_the_edges_that_got_cheaper():
+    markets, tops = market_graph(1)
+    detector = CycleDetector(markets, fee=FEE, max_legs=4, min_return=1.)
+    found = detector.cycles(tops)  # Every edge is new, so every one got cheaper
+
+    keys = [rotation(cycle) for _, cycle in found]
+    assert len(keys) == len(set(keys))  # Rotations of one cycle are reported once
+    assert [weight for weight, _ in found] == sorted(weight for weight, _ in found)
+    expected = set()
+    for u, v in detector.symbols:
+        result = detector.search(u, v)
+        if result is not None:
+            expected.add(rotation(result[1]))
+    assert set(keys) == expected and expected
+    assert detector.cycles(tops) == []  # Nothing got cheaper
+
+
+def test_update_reports_only_edges_that_got_cheaper():
+    detector = CycleDetector({"BTCUSDT": ("BTC", "USDT")}, fee=FEE)
+    btc, usdt = detector.index["BTC"], detector.index["USDT"]
+    assert sorted(detector.update("BTCUSDT", 10000., 10010.)) == sorted([(btc, usdt), (usdt, btc)])  # New edges
+    assert detector.update("BTCUSDT", 10000., 10010.) == []
+    assert detector.update("BTCUSDT", 9990., 10020.) == []  # Both sides got worse
+    assert detector.update("BTCUSDT", 10005., 10020.) == [(btc, usdt)]  # Selling BTC pays more
+    assert detector.update("BTCUSDT", 10005., 10000.) == [(usdt, btc)]  # Buying BTC costs less
+    assert detector.weights[btc, usdt] == pytest.approx(-math.log(10005.) - math.log(1 - FEE))
+    assert detector.weights[usdt, btc] == pytest.approx(math.log(10000.) - math.log(1 - FEE))
+
+
+def test_one_sided_book_has_no_edge_on_the_empty_side():
+    markets = {"BTCUSDT": ("BTC", "USDT"), "ETHBTC": ("ETH", "BTC"), "ETHUSDT": ("ETH", "USDT")}
+    detector = CycleDetector(markets, fee=FEE, max_legs=3)
+    # USDT -> BTC -> ETH -> USDT returns 1.05 before fees
+    assert detector.cycles({"BTCUSDT": (9990., None), "ETHBTC": (0.0199, 0.02), "ETHUSDT": (210., 211.)}) == []
+    assert detector.weights[detector.index["USDT"], detector.index["BTC"]] == np.inf
+    assert detector.search(detector.index["USDT"], detector.index["BTC"]) is None
+
+    (weight, cycle), = detector.cycles({"BTCUSDT": (9990., 10000.)})  # The asks came back
+    assert rotation(cycle) == rotation(("USDT", "BTC", "ETH"))
+    assert math.exp(-weight) == pytest.approx(1.05 * (1 - FEE) ** 3)
+
+    assert detector.cycles({"BTCUSDT": (None, None)}) == []  # Both sides empty
+    assert (detector.weights[detector.index["BTC"]] == np.inf).sum() == len(detector.assets) - 1  # Only to ETH
@@ -0,0 +1,161 @@
+"""AsyncFeed against a local combined-stream server."""
+
+
+import asyncio
+import json
+import socket
+import time
+from threading import Thread, Event
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+import websockets
+
+from feed import AsyncFeed
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+class StreamServer:
+    """Combined-stream stand-in: sends one message per stream of a connection.
+
+    The first `reject` handshakes are refused with 503, and with `drop` every connection is closed
+    after its messages.
+    """
+
+    def __init__(self, reject=0, drop=False):
+        self.reject = reject
+        self.drop = drop
+        self.port = free_port()
+        self.url = f"ws://127.0.0.1:{self.port}"
+        self.attempts = []  # perf_counter of every handshake
+        self.connections = []  # Streams of every accepted connection
+        self.loop = asyncio.new_event_loop()
+        self.started = Event()
+        self.stopped = None
+        self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self.started.wait(5)
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self._serve())
+
+    async def _serve(self):
+        self.stopped = self.loop.create_future()
+        async with websockets.serve(self.handler, "127.0.0.1", self.port, process_request=self.process_request):
+            self.started.set()
+            await self.stopped
+
+    def process_request(self, *args):
+        # websockets < 14 passes (path, headers) and takes (status, headers, body), newer versions pass
+        # (connection, request) and take the connection's response
+        self.attempts.append(time.perf_counter())
+        if len(self.attempts) > self.reject:
+            return None
+        if hasattr(args[0], "respond"):
+            return args[0].respond(503, "Try again later\n")
+        return 503, [], b"Try again later\n"
+
+    async def handler(self, socket_, path=None):
+        path = path or socket_.request.path
+        streams = parse_qs(urlsplit(path).query)["streams"][0].split("/")
+        self.connections.append(streams)
+        for stream in streams:
+            await socket_.send(json.dumps({"stream": stream, "data": {"connection": len(self.connections)}}))
+        if self.drop:
+            await socket_.close()
+        else:
+            await socket_.wait_closed()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.stopped.set_result, None)
+        self.thread.join(5)
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def start(**kwargs):
+        server = StreamServer(**kwargs)
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        server.stop()
+
+
+def run_feed(streams, server, **kwargs):
+    messages, errors = [], []
+    feed = AsyncFeed(streams, messages.append, url=server.url, on_error=errors.append, **kwargs)
+    feed.start()
+    return feed, messages, errors
+
+
+def test_split_streams():
+    streams = [f"s{i}" for i in range(7)]
+    groups = AsyncFeed.split_streams(streams, connections=2, max_streams=3)
+    assert len(groups) == 3  # More connections than asked, none over the limit
+    assert all(len(group) <= 3 for group in groups)
+    assert sorted(sum(groups, [])) == sorted(streams)
+    assert AsyncFeed.split_streams(["a"], connections=2, max_streams=3) == [["a"]]  # No empty connections
+
+
+def test_streams_are_split_across_connections(servers):
+    server = servers()
+    streams = [f"s{i}@depth10@100ms" for i in range(5)]
+    feed, messages, errors = run_feed(streams, server, connections=2, max_streams=2)
+    try:
+        wait_for(lambda: len(messages) == len(streams))
+        assert len(server.connections) == 3
+        assert all(len(group) <= 2 for group in server.connections)
+        assert sorted(sum(server.connections, [])) == sorted(streams)
+        assert sorted(msg["stream"] for msg in messages) == sorted(streams)
+        wait_for(lambda: len(feed.connected) == 3)
+        assert not errors
+    finally:
+        feed.stop()
+
+
+def test_reconnect_backs_off_while_refused(servers):
+    server = servers(reject=4)
+    feed, messages, errors = run_feed(["a@depth10@100ms"], server, connections=1,
+                                      reconnect_delay=0.05, max_reconnect_delay=0.2)
+    try:
+        wait_for(lambda: messages)
+        assert feed.reconnects == 4
+        assert len(errors) == 4  # Every refused handshake is reported
+        gaps = [later - earlier for earlier, later in zip(server.attempts, server.attempts[1:])]
+        # Delays 0.05, 0.1, 0.2 and 0.2 (capped)
+        for gap, delay in zip(gaps, (0.05, 0.1, 0.2, 0.2)):
+            assert delay <= gap < delay + 0.15
+    finally:
+        feed.stop()
+
+
+def test_reconnects_after_the_connection_drops(servers):
+    server = servers(drop=True)
+    feed, messages, errors = run_feed(["a@depth10@100ms"], server, connections=1, reconnect_delay=0.05)
+    try:
+        wait_for(lambda: len(server.connections) >= 3)
+        assert feed.reconnects >= 2
+        assert {msg["data"]["connection"] for msg in messages} >= {1, 2}
+        # A connection that opened resets the delay
+        gaps = [later - earlier for earlier, later in zip(server.attempts, server.attempts[1:])]
+        assert max(gaps[:2]) < 0.05 + 0.15
+    finally:
+        feed.stop()
+    assert not feed.thread.is_alive()
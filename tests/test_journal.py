@@ -0,0 +1,118 @@
+"""Journal rows of the trades the bot logs."""
+
+
+import numpy as np
+
+from binance_bot import BinanceBot, Plan
+from journal import SCHEMAS, Entries, Journal, decode, encode, record_dtype, scan, segments
+from order_entry import full_response
+from replay import NullSink
+from tools.review_execution import journal_orders
+
+
+def reconciled_order():
+    """Order as the REST query returns it after the websocket session broke."""
+    return {"symbol": "BTCUSDT", "orderId": 7, "orderListId": -1, "clientOrderId": "ws0123456789abcdef-1",
+            "price": "10000.00000000", "origQty": "0.00100000", "executedQty": "0.00100000",
+            "cummulativeQuoteQty": "9.99000000", "status": "FILLED", "timeInForce": "IOC", "type": "LIMIT",
+            "side": "BUY", "time": 1600000000000, "updateTime": 1600000000123}
+
+
+def test_reconciled_response_is_journaled(tmp_path):
+    response = full_response(reconciled_order())
+    assert response["fills"][0]["commissionAsset"] is None  # Unknown after the reconciliation
+    # As Opportunity.log_responses shapes it
+    row = dict(response, id=1, exchangeTimestamp=response["transactTime"] / 10 ** 3, exchange="BINANCE",
+               opportunityId="opportunity")
+    for key in ("clientOrderId", "transactTime", "orderListId", "cummulativeQuoteQty"):
+        del row[key]
+    journal = Journal(directory=str(tmp_path), upload=False)
+    journal.append("bullseye", "trades", [row])
+    journal.stop()
+
+    segment, = scan("bullseye.trades", ["fills_len", "fills_qty", "fills_commissionAsset"], directory=str(tmp_path))
+    assert segment["fills_len"][0] == 1
+    assert segment["fills_qty"][0][0] == 0.001
+    assert segment["fills_commissionAsset"][0] == b""
+    assert journal.stats()["rows"] == 1
+
+
+def test_instances_keep_separate_journals(tmp_path):
+    markets = [{"symbol": "BTCUSDT", "base": "BTC", "quote": "USDT", "decimals": 6, "exchange": "BINANCE"}]
+    settings = {"journal": True, "journal_dir": str(tmp_path / "{instance_id}"), "latency": False}
+    first, second = (BinanceBot([Plan(markets, "USDT", 12, instance_id, "ARBITRAGE", "USDT", "USDT")], execute=False,
+                                settings=settings, client=object(), notifier=NullSink(), order_entry=NullSink()).sink
+                     for instance_id in ("first", "second"))
+    row = {"id": 1, "symbol": "BTCUSDT", "price": "1", "origQty": "1", "executedQty": "1"}
+    first.append("bullseye", "trades", [row])
+    first.writer("bullseye.trades").flush()  # Written, the segment stays open
+    second.append("bullseye", "trades", [row])  # Doesn't seal the first instance's open segment
+    second.stop()
+
+    assert [len(segment["id"]) for segment in scan("bullseye.trades", ["id"], sealed_only=False,
+                                                    directory=str(tmp_path / "first"))] == [1]
+    assert not segments("bullseye.trades", str(tmp_path / "first"))  # Still open
+    assert len(segments("bullseye.trades", str(tmp_path / "second"))) == 1
+    first.stop()
+    assert len(segments("bullseye.trades", str(tmp_path / "first"))) == 1
+
+
+def record(schema, row):
+    """Record of the row, as the uploader reads it from a segment."""
+    return np.array([encode(schema, row)], record_dtype(schema))[0]
+
+
+def test_rows_decode_with_the_columns_they_were_logged_with():
+    schema = SCHEMAS["bullseye.opportunities"]
+    row = {"id": "opportunity", "startAmount": 12., "botId": "test"}
+    assert not [name for name in decode(schema, record(schema, row)) if name.endswith("Us")]  # Latency was off
+    timed = decode(schema, record(schema, dict(row, evaluationUs=12.5)))
+    assert timed["evaluationUs"] == 12.5 and "exchangeToReceiveUs" not in timed
+
+    schema = SCHEMAS["bullseye.trades"]
+    fills = [{"price": "10000", "qty": "0.001", "commission": "0", "commissionAsset": "BNB", "tradeId": 123456789},
+             {"price": "10001", "qty": "0.001", "commission": "0", "commissionAsset": "BNB", "tradeId": None}]
+    decoded = decode(schema, record(schema, {"fills": fills}))["fills"]
+    assert [fill["tradeId"] for fill in decoded] == [123456789, None]
+    assert decoded[0]["price"] == "10000.00000000" and decoded[0]["commissionAsset"] == "BNB"
+
+
+def test_truncated_entries_are_counted_and_reported_once(tmp_path):
+    errors = []
+    journal = Journal(directory=str(tmp_path), upload=False, on_error=errors.append)
+    depth = dict(SCHEMAS["bullseye.books"])["bids"].depth
+    book = {"id": 1, "symbol": "BTCUSDT", "bids": [{"price": "1", "qty": "1"}] * (depth + 1), "asks": []}
+    journal.append("bullseye", "books", [book, dict(book, id=2), dict(book, id=3, bids=book["bids"][:depth])])
+    journal.stop()
+
+    assert journal.stats()["truncated"] == 2
+    assert len(errors) == 1 and "bids" in errors[0]
+    segment, = scan("bullseye.books", ["bids_len"], directory=str(tmp_path))
+    assert list(segment["bids_len"]) == [depth] * 3
+
+
+def test_segments_are_read_with_the_depth_they_were_written_with(tmp_path, monkeypatch):
+    fills = [{"price": "1", "qty": "1", "commission": "0", "commissionAsset": "BNB", "tradeId": i} for i in range(3)]
+    journal = Journal(directory=str(tmp_path), upload=False)
+    journal.append("bullseye", "trades", [{"id": 1, "opportunityId": "first", "fills": fills}])
+    journal.stop()
+    schema = [(name, Entries(kind.keys, 2, kind.tags, kind.ids) if isinstance(kind, Entries) else kind)
+              for name, kind in SCHEMAS["bullseye.trades"]]
+    monkeypatch.setitem(SCHEMAS, "bullseye.trades", schema)  # The configured depth changed since
+
+    segment, = scan("bullseye.trades", ["fills_tradeId"], directory=str(tmp_path))
+    assert list(segment["fills_tradeId"][0][:3]) == [0, 1, 2]
+
+
+def test_review_reads_the_orders_of_an_opportunity_from_the_journal(tmp_path):
+    journal = Journal(directory=str(tmp_path), upload=False)
+    fill = {"price": "10000", "qty": "0.001", "commission": "0.00001", "commissionAsset": "BNB", "tradeId": 1}
+    journal.append("bullseye", "trades", [{"id": 1, "opportunityId": "first", "symbol": "BTCUSDT", "side": "BUY",
+                                           "executedQty": "0.001", "fills": [fill]},
+                                          {"id": 2, "opportunityId": "second", "symbol": "BTCUSDT", "side": "SELL"}])
+    journal.writer("bullseye.trades").flush()  # Open segments are read too
+
+    order, = journal_orders("first", str(tmp_path))
+    assert order["id"] == 1 and order["side"] == "BUY" and order["executedQty"] == "0.00100000"
+    assert order["fills"][0]["commissionAsset"] == "BNB"
+    journal.stop()
@@ -0,0 +1,42 @@
+"""Bot started against the mock exchange's REST API without network access."""
+
+
+import socket
+import threading
+
+import pytest
+
+from binance_bot import BinanceBot, Plan
+from replay import NullSink
+from tools.mock_exchange import Limits, MockExchange, rest_server
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    """Refuse connections to anything but the local host."""
+    connect = socket.socket.connect
+
+    def local_only(sock, address):
+        if isinstance(address, tuple) and address[0] not in ("127.0.0.1", "::1", "localhost"):
+            raise OSError(f"Network is unreachable: {address[0]}")
+        return connect(sock, address)
+
+    monkeypatch.setattr(socket.socket, "connect", local_only)
+
+
+def test_bot_builds_its_client_against_the_configured_api(offline):
+    exchange = MockExchange({"BTCUSDT": 6}, {"BTCUSDT": {"base": "BTC", "quote": "USDT"}})
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = rest_server(exchange, Limits(1200, 100), "127.0.0.1", port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        markets = [{"symbol": "BTCUSDT", "base": "BTC", "quote": "USDT", "decimals": 6, "exchange": "BINANCE"}]
+        bot = BinanceBot([Plan(markets, "USDT", 12, "test", "ARBITRAGE", "USDT", "USDT")], execute=False,
+                         settings={"api_url": f"http://127.0.0.1:{port}", "latency": False}, sink=NullSink(),
+                         notifier=NullSink(), order_entry=NullSink())  # The client pings its API when created
+        assert bot.client.API_URL == f"http://127.0.0.1:{port}/api"
+        assert bot.client.get_order_book(symbol="BTCUSDT", limit=5)["bids"]
+    finally:
+        server.shutdown()
@@ -0,0 +1,61 @@
+"""Digests and rate limits of the SlackNotifier."""
+
+
+import time
+from types import SimpleNamespace
+
+import helpers as hp
+from notifier import SlackNotifier
+
+
+class Slack:
+    """send_to_slack that answers with the given status codes, then 200."""
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.posts = []
+
+    def __call__(self, msg, api_key, channel, emoji=None, session=None):
+        self.posts.append(msg)
+        status = self.statuses.pop(0) if self.statuses else 200
+        return SimpleNamespace(status_code=status, headers={"Retry-After": "0"} if status == 429 else {})
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_first_message_of_a_digest_is_posted_right_away(monkeypatch):
+    slack = Slack()
+    monkeypatch.setattr(hp, "send_to_slack", slack)
+    notifier = SlackNotifier(api_key="key", digest=True, digest_interval=60, min_interval=0)
+    notifier.start()
+    notifier.send("Balance is too low", "alerts", digest="order errors")
+    assert wait_for(lambda: slack.posts)  # Not held for the interval
+    assert slack.posts == ["Balance is too low"]
+
+    for msg in ("Balance is too low", "Balance is too low", "Order rejected"):
+        notifier.send(msg, "alerts", digest="order errors")
+    notifier.stop()  # Posts the summary of the interval
+
+    assert len(slack.posts) == 2
+    assert slack.posts[1].startswith("*3 order errors in the last 60 sec*")
+    assert "Balance is too low\n_(x2)_" in slack.posts[1] and "Order rejected" in slack.posts[1]
+    assert notifier.stats()["sent"] == 2 and notifier.stats()["merged"] == 3
+
+
+def test_rate_limited_post_is_retried(monkeypatch):
+    slack = Slack(429)
+    monkeypatch.setattr(hp, "send_to_slack", slack)
+    notifier = SlackNotifier(api_key="key", digest=False, min_interval=0)
+    notifier.start()
+    notifier.send("Opportunity found", "opportunities")
+    assert wait_for(lambda: notifier.stats()["sent"] == 1)
+    notifier.stop()
+
+    assert slack.posts == ["Opportunity found", "Opportunity found"]
+    stats = notifier.stats()
+    assert stats["rate_limited"] == 1 and stats["sent"] == 1 and stats["queued"] == 0
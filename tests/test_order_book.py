@@ -0,0 +1,189 @@
+"""DiffBook sequencing and the resync of a book out of sync."""
+
+
+import random
+from types import SimpleNamespace
+
+import pytest
+
+import binance_bot
+from binance_bot import BinanceBot, Plan
+from exceptions import BookOutOfSync
+from order_book import DiffBook
+from replay import NullSink
+
+
+def event(first, last, bids=(), asks=()):
+    """Diff depth event with update ids first..last."""
+    return {"U": first, "u": last, "b": [[str(price), str(qty)] for price, qty in bids],
+            "a": [[str(price), str(qty)] for price, qty in asks]}
+
+
+def snapshot(last_update_id, bids=((100, 1),), asks=((101, 1),)):
+    return {"lastUpdateId": last_update_id, "bids": [[str(price), str(qty)] for price, qty in bids],
+            "asks": [[str(price), str(qty)] for price, qty in asks]}
+
+
+def levels(book, side):
+    px, qty, length = book.side(side)
+    return list(zip(px[:length].tolist(), qty[:length].tolist()))
+
+
+def test_buffered_events_are_replayed_after_the_snapshot():
+    local = DiffBook("BTCUSDT")
+    assert not local.apply(event(8, 9, bids=[(99, 5)]), 1.)  # Already in the snapshot, dropped on replay
+    assert not local.apply(event(10, 12, bids=[(100, 2)]), 1.)  # Straddles the snapshot
+    assert not local.apply(event(13, 13, asks=[(101, 0), (102, 3)]), 1.)
+    assert not local.synced
+    local.load_snapshot(snapshot(10), 2.)
+    assert local.synced and local.last_update_id == 13
+    assert levels(local.book, "bids") == [(100., 2.)]
+    assert levels(local.book, "asks") == [(102., 3.)]
+    assert local.book.last_update_id == 13
+
+
+def test_events_apply_in_order_and_stale_ones_are_dropped():
+    local = DiffBook("BTCUSDT")
+    local.load_snapshot(snapshot(10), 1.)
+    assert local.apply(event(11, 11, bids=[(100.5, 1)]), 2.)
+    assert not local.apply(event(9, 11, bids=[(100.5, 9)]), 3.)  # u <= lastUpdateId
+    assert local.apply(event(12, 14, bids=[(100, 0)]), 4.)
+    assert levels(local.book, "bids") == [(100.5, 1.)]
+    assert local.last_update_id == 14 and local.book.timestamp == 4.
+
+
+def test_gap_raises_out_of_sync():
+    local = DiffBook("BTCUSDT")
+    local.load_snapshot(snapshot(10), 1.)
+    with pytest.raises(BookOutOfSync):
+        local.apply(event(12, 13), 2.)  # Update 11 is missing
+    assert local.last_update_id == 10  # Nothing of the event was applied
+
+
+def test_snapshot_older_than_the_buffer_leaves_the_book_out_of_sync():
+    local = DiffBook("BTCUSDT")
+    assert not local.apply(event(11, 11, bids=[(100, 2)]), 1.)
+    assert not local.apply(event(15, 16, bids=[(98, 1)]), 1.)  # Updates 12-14 are missing
+    with pytest.raises(BookOutOfSync):
+        local.load_snapshot(snapshot(10), 2.)
+    assert not local.synced and not local.buffer
+    assert not local.bids and not local.bid_prices
+    assert not local.apply(event(17, 17), 3.)  # Buffered for the next snapshot
+
+
+def test_events_patch_the_book_like_a_full_rewrite():
+    rnd = random.Random(5)
+    local = DiffBook("BTCUSDT")
+    local.book.__init__("BTCUSDT", capacity=4)  # Grows while levels are inserted
+    local.load_snapshot(snapshot(10, bids=[(100 - i, 1) for i in range(3)], asks=[(101 + i, 1) for i in range(3)]), 1.)
+    for update_id in range(11, 511):
+        changes = [(rnd.randint(80, 120) + rnd.choice((0, 0.5)), rnd.choice((0, 0, 1, 2.5))) for _ in range(4)]
+        local.apply(event(update_id, update_id, bids=[(price, qty) for price, qty in changes if price <= 100],
+                          asks=[(price, qty) for price, qty in changes if price > 100]), float(update_id))
+        assert local.book.version % 2 == 0
+        assert levels(local.book, "bids") == sorted(local.bids.items(), reverse=True)
+        assert levels(local.book, "asks") == sorted(local.asks.items())
+    assert local.book.last_update_id == 510 and local.book.timestamp == 510.
+    assert local.book.capacity > 4
+
+
+def test_ticker_levels_last_until_the_next_event():
+    local = DiffBook("BTCUSDT")
+    assert not local.apply_top(100.5, 1., 101., 1., 5, 1.)  # No snapshot yet
+    local.load_snapshot(snapshot(10, bids=[(100, 1), (99, 2)], asks=[(101, 1), (102, 2)]), 1.)
+    assert local.apply_top(99., 3., 101.5, 1., 12, 2.)  # The best bid and ask were taken
+    assert levels(local.book, "bids") == [(99., 3.)] and levels(local.book, "asks") == [(101.5, 1.), (102., 2.)]
+    assert local.apply(event(11, 11, bids=[(98, 1)]), 3.)  # The diff stream is the reference again
+    assert levels(local.book, "bids") == [(100., 1.), (99., 2.), (98., 1.)]
+    assert levels(local.book, "asks") == [(101., 1.), (102., 2.)]
+
+
+class ImmediateThread:
+    """Runs the resync on the calling thread."""
+
+    def __init__(self, target, args, daemon=None):
+        self.target = target
+        self.args = args
+
+    def start(self):
+        self.target(*self.args)
+
+
+class Client:
+    """Depth snapshots that fail `failures` times before they load."""
+
+    def __init__(self, failures, last_update_id, stale=()):
+        self.failures = failures
+        self.last_update_id = last_update_id
+        self.stale = list(stale)  # Update ids of the snapshots returned before the last one
+        self.requests = 0
+
+    def get_order_book(self, symbol, limit):
+        self.requests += 1
+        if self.requests <= self.failures:
+            raise ConnectionError("No route to host")
+        return snapshot(self.stale.pop(0) if self.stale else self.last_update_id, bids=[(99, 4)])
+
+
+def diff_bot(client):
+    markets = [{"symbol": "BTCUSDT", "base": "BTC", "quote": "USDT", "decimals": 6, "exchange": "BINANCE"}]
+    bot = BinanceBot([Plan(markets, "USDT", 12, "test", "ARBITRAGE", "USDT", "USDT")], execute=False,
+                     settings={"depth_mode": "diff", "latency": False}, client=client, sink=NullSink(),
+                     notifier=NullSink(), order_entry=NullSink())
+    bot.local_books = {"BTCUSDT": DiffBook("BTCUSDT")}
+    return bot
+
+
+def test_out_of_sync_book_reloads_with_backoff(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(binance_bot.time, "sleep", sleeps.append)
+    client = Client(failures=3, last_update_id=20)
+    bot = diff_bot(client)
+    local = bot.local_books["BTCUSDT"]
+    local.load_snapshot(snapshot(10), 1.)
+    bot.books["BTCUSDT"] = local.book
+
+    monkeypatch.setattr(binance_bot, "Thread", ImmediateThread)
+    assert not bot.apply_diff("BTCUSDT", event(12, 13))  # Gap: reset, then resync
+
+    assert client.requests == 4
+    assert sleeps == [0.5, 1., 2.]
+    assert len(bot.exceptions) == 4  # The gap and every failed request
+    assert local.synced and local.last_update_id == 20
+    assert bot.books["BTCUSDT"] is local.book
+    assert levels(local.book, "bids") == [(99., 4.)]
+
+
+def test_resync_retries_a_snapshot_older_than_the_buffer(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(binance_bot.time, "sleep", sleeps.append)
+    client = Client(failures=0, last_update_id=16, stale=[10])
+    bot = diff_bot(client)
+    local = bot.local_books["BTCUSDT"]
+    local.apply(event(15, 16, asks=[(102, 1)]), 1.)  # Buffered, newer than the first snapshot
+
+    bot.resync("BTCUSDT")
+    assert client.requests == 2 and sleeps == [0.5]
+    assert len(bot.exceptions) == 1
+    assert local.synced and local.last_update_id == 16
+    assert bot.books["BTCUSDT"] is local.book
+    assert levels(local.book, "bids") == [(99., 4.)]  # Only the second snapshot
+
+
+def test_ticker_skips_a_diff_book_out_of_sync():
+    bot = diff_bot(Client(failures=0, last_update_id=10))
+    local = bot.local_books["BTCUSDT"]
+    local.load_snapshot(snapshot(10), 1.)
+    bot.books["BTCUSDT"] = local.book
+    marked = []
+    bot.scheduler.mark = marked.append
+    bot.screen = SimpleNamespace(update=lambda pair, bid, ask: True)  # Every ticker passes
+    ticker = {"u": 12, "b": "100.5", "B": "1", "a": "100.9", "A": "1"}
+
+    local.reset()  # Went out of sync, the resync hasn't loaded yet
+    bot.handle_ticker("BTCUSDT", ticker)
+    assert not marked and levels(local.book, "bids") == [(100., 1.)]
+
+    local.load_snapshot(snapshot(11), 2.)
+    bot.handle_ticker("BTCUSDT", ticker)
+    assert marked == ["BTCUSDT"] and levels(local.book, "bids") == [(100.5, 1.), (100., 1.)]
@@ -0,0 +1,246 @@
+"""WsOrderEntry against the mock exchange's websocket API, with the REST fallback."""
+
+
+import asyncio
+import socket
+import threading
+from concurrent.futures import Future
+from types import SimpleNamespace
+
+import pytest
+import websockets
+from binance.client import BinanceAPIException
+
+import binance_bot
+from binance_bot import Opportunity, Plan
+from order_entry import OrderEntry, WsOrderEntry, api_exception
+from plan_compiler import Instruction
+from tools.mock_exchange import Limits, MockExchange, StreamServer, rest_server
+
+
+MARKETS = {"BTCUSDT": 6}
+SYMBOLS_INFO = {"BTCUSDT": {"base": "BTC", "quote": "USDT"}}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Exchange:
+    """Mock exchange with its REST API and websocket API on free local ports."""
+
+    def __init__(self, drop_rate=0., lose_rate=0.):
+        self.exchange = MockExchange(MARKETS, SYMBOLS_INFO)
+        limits = Limits(1200, 100)
+        rest_port, ws_port = free_port(), free_port()
+        self.rest = rest_server(self.exchange, limits, "127.0.0.1", rest_port)
+        threading.Thread(target=self.rest.serve_forever, daemon=True).start()
+        self.streams = StreamServer(self.exchange, limits=limits, drop_rate=drop_rate, lose_rate=lose_rate)
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        async def serve():
+            self.stopped = self.loop.create_future()
+            async with websockets.serve(self.streams.handler, "127.0.0.1", ws_port):
+                started.set()
+                await self.stopped
+
+        self.thread = threading.Thread(target=self.loop.run_until_complete, args=(serve(),), daemon=True)
+        self.thread.start()
+        started.wait(5)
+        self.api_url = f"http://127.0.0.1:{rest_port}"
+        self.ws_api_url = f"ws://127.0.0.1:{ws_port}/ws-api/v3"
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.stopped.set_result, None)
+        self.thread.join(5)
+        self.rest.shutdown()
+
+
+@pytest.fixture
+def exchanges():
+    started = []
+
+    def start(**kwargs):
+        exchange = Exchange(**kwargs)
+        started.append(exchange)
+        return exchange
+
+    yield start
+    for exchange in started:
+        exchange.stop()
+
+
+def transport(exchange, ws_url=None, timeout=5):
+    entry = WsOrderEntry("key", "secret", url=ws_url or exchange.ws_api_url,
+                         fallback=OrderEntry("key", "secret", url=exchange.api_url, senders=1), reconnect_delay=0.05,
+                         timeout=timeout)
+    entry.start()
+    return entry
+
+
+def buy(exchange, share=0.5):
+    """Instruction that buys a share of the best ask level of BTCUSDT."""
+    price, qty = exchange.exchange.books["BTCUSDT"]["asks"][0]
+    return Instruction(price=price * 1.001, amount=round(qty * share, 6), side="BUY", symbol="BTCUSDT")
+
+
+def test_order_place_fills_over_the_session(exchanges):
+    exchange = exchanges()
+    entry = transport(exchange)
+    try:
+        assert entry.ready.wait(5)
+        instruction = buy(exchange)
+        response = entry.place([instruction], "IOC", [6])[0].result(5)
+        assert response["status"] == "FILLED"
+        assert float(response["executedQty"]) == pytest.approx(instruction.amount)
+        assert response["clientOrderId"].startswith(entry.client_prefix)
+        assert response["fills"]
+        stats = entry.stats()
+        assert stats["orders"] == 1 and stats["fallbacks"] == 0
+        assert stats["used_weight"] is not None and stats["order_count"] == 1
+    finally:
+        entry.stop()
+
+
+def test_order_place_error_raises_api_exception(exchanges):
+    exchange = exchanges()
+    entry = transport(exchange)
+    try:
+        assert entry.ready.wait(5)
+        instruction = buy(exchange)._replace(amount=10 ** 6)  # More than the balance
+        with pytest.raises(BinanceAPIException) as error:
+            entry.place([instruction], "IOC", [6])[0].result(5)
+        assert error.value.code == -2010
+        assert error.value.status_code == 400
+        with pytest.raises(BinanceAPIException) as error:
+            entry.order({"symbol": "NOPE", "side": "BUY", "type": "LIMIT", "timeInForce": "IOC",
+                         "quantity": "1", "price": "1"}).result(5)
+        assert error.value.code == -1121
+        assert entry.connected  # Errors don't close the session
+    finally:
+        entry.stop()
+
+
+def test_orders_fall_back_to_rest_while_the_session_is_down(exchanges):
+    exchange = exchanges()
+    entry = transport(exchange, ws_url=f"ws://127.0.0.1:{free_port()}/ws-api/v3")  # Nothing listens there
+    try:
+        assert not entry.ready.wait(0.2)
+        response = entry.place([buy(exchange)], "IOC", [6])[0].result(5)
+        assert response["status"] == "FILLED"
+        assert entry.stats()["fallbacks"] == 1
+        assert entry.stats()["orders"] == 0
+    finally:
+        entry.stop()
+
+
+def test_lost_response_is_reconciled_over_rest(exchanges):
+    exchange = exchanges(drop_rate=1.)  # Every order is placed, then the session closes
+    entry = transport(exchange)
+    try:
+        assert entry.ready.wait(5)
+        instruction = buy(exchange)
+        future = entry.place([instruction], "IOC", [6])[0]
+        response = future.result(5)
+        assert response["status"] == "FILLED"
+        assert response["clientOrderId"].startswith(entry.client_prefix)
+        assert float(response["executedQty"]) == pytest.approx(instruction.amount)
+        fill, = response["fills"]  # Average price of the fills
+        assert float(fill["qty"]) == pytest.approx(instruction.amount)
+        assert float(fill["price"]) <= instruction.price
+        assert "transactTime" in response
+    finally:
+        entry.stop()
+
+
+def test_order_that_was_never_placed_fails_with_connection_error(exchanges):
+    exchange = exchanges()
+    entry = transport(exchange)
+    try:
+        future = Future()
+        entry._reconcile(future, {"symbol": "BTCUSDT", "newClientOrderId": f"{entry.client_prefix}404"})
+        with pytest.raises(ConnectionError, match="the order wasn't placed"):
+            future.result(5)
+    finally:
+        entry.stop()
+
+
+def test_order_without_a_response_is_looked_up_after_the_timeout(exchanges):
+    exchange = exchanges(lose_rate=1.)  # Every order is placed, its response never comes
+    entry = transport(exchange, timeout=0.2)
+    try:
+        assert entry.ready.wait(5)
+        instruction = buy(exchange)
+        response = entry.place([instruction], "IOC", [6])[0].result(5)
+        assert response["status"] == "FILLED"
+        assert float(response["executedQty"]) == pytest.approx(instruction.amount)
+        assert not entry.pending
+        assert entry.connected and entry.reconnects == 0  # The session stayed open
+    finally:
+        entry.stop()
+
+
+def pending_order(entry, request_id=1):
+    future = Future()
+    future.timing = {"decided": 0, "signed": 0, "sent": 0}
+    entry.pending[request_id] = (future, {"symbol": "BTCUSDT", "newClientOrderId": f"{entry.client_prefix}{request_id}"})
+    return future
+
+
+def test_error_without_a_body_raises_api_exception():
+    error = api_exception(503, {})
+    assert error.code == -1 and error.status_code == 503
+    entry = WsOrderEntry("key", "secret")
+    future = pending_order(entry)
+    entry._receive({"id": 1, "status": 503})
+    with pytest.raises(BinanceAPIException) as error:
+        future.result(0)
+    assert error.value.code == -1
+
+
+def test_fallback_keeps_the_decision_time_of_the_order():
+    fallback_future = Future()
+    fallback_future.timing = {"decided": 50, "signed": 60, "sent": 70}
+    entry = WsOrderEntry("key", "secret", fallback=SimpleNamespace(order=lambda params: fallback_future))
+    future = Future()
+    future.timing = {"decided": 10, "signed": 20}
+    entry._send_fallback(future, {"symbol": "BTCUSDT"})  # The session broke before the order was sent
+    fallback_future.timing["received"] = 80
+    fallback_future.set_result({"status": "FILLED"})
+    assert future.result(0) == {"status": "FILLED"}
+    assert future.timing == {"decided": 10, "signed": 60, "sent": 70, "received": 80}
+
+
+def test_response_that_cant_be_read_still_resolves_the_order():
+    errors = []
+    entry = WsOrderEntry("key", "secret", on_error=errors.append)
+    future = pending_order(entry)
+    entry._receive({"id": 1, "status": 200, "result": {}, "rateLimits": [{"count": 1}]})  # No rateLimitType
+    assert isinstance(future.exception(0), KeyError)
+    assert len(errors) == 1
+
+
+def test_order_without_a_result_in_time_is_missed(monkeypatch):
+    monkeypatch.setattr(binance_bot, "ORDER_RESULT_TIMEOUT", 0.05)
+    market = {"symbol": "BTCUSDT", "base": "BTC", "quote": "USDT", "decimals": 6, "exchange": "BINANCE"}
+    plan = Plan([market, market], "USDT", 12, "test", "ARBITRAGE", "USDT", "USDT")  # Buy, then sell
+    filled = Future()
+    filled.timing = {}
+    filled.set_result({"symbol": "BTCUSDT", "side": "BUY", "status": "FILLED", "executedQty": "0.001", "origQty": "0.001"})
+    lost = Future()  # Never resolves
+    lost.timing = {}
+    messages = []
+    bot = SimpleNamespace(order_entry=SimpleNamespace(place=lambda *args: [filled, lost]), slack_group="test",
+                          notifier=SimpleNamespace(send=lambda msg, *args, **kwargs: messages.append(msg)),
+                          plan_markets={"BTCUSDT"})
+    opportunity = Opportunity(bot, plan)
+    opportunity.instructions = [Instruction(price=10000., amount=0.001, side="BUY", symbol="BTCUSDT"),
+                                Instruction(price=10010., amount=0.001, side="SELL", symbol="BTCUSDT")]
+    responses = opportunity.execute(async_=True)
+    assert [response["side"] for response in responses] == ["BUY"]
+    assert opportunity.order_timings == [filled.timing]
+    assert opportunity.execution_status == "MISSED"
+    assert messages == ["> *BTCUSDT* order: No response in 0.05 sec."]
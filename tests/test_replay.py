@@ -0,0 +1,97 @@
+"""Replay of a short recording of the partial depth streams."""
+
+
+import pytest
+
+from binance_bot import Plan
+from replay import Recorder, Replay
+
+
+MARKETS = [{"symbol": "BTCUSDT", "base": "BTC", "quote": "USDT", "decimals": 6, "exchange": "BINANCE"},
+           {"symbol": "ETHBTC", "base": "ETH", "quote": "BTC", "decimals": 3, "exchange": "BINANCE"},
+           {"symbol": "ETHUSDT", "base": "ETH", "quote": "USDT", "decimals": 5, "exchange": "BINANCE"}]
+
+
+def depth(symbol, update_id, bid, ask, qty=100.):
+    return {"stream": symbol.lower() + "@depth10@100ms",
+            "data": {"lastUpdateId": update_id, "bids": [[str(bid), str(qty)]], "asks": [[str(ask), str(qty)]]}}
+
+
+def record(path):
+    """USDT -> BTC -> ETH -> USDT earns while the ETHUSDT bid is 210, the other updates don't."""
+    recorder = Recorder(path)
+    messages = [depth("BTCUSDT", 1, 9990, 10000), depth("ETHBTC", 1, 0.0199, 0.02), depth("ETHUSDT", 1, 190, 191),
+                depth("ETHUSDT", 2, 210, 211), depth("BTCUSDT", 2, 9995, 10000), depth("ETHUSDT", 3, 190, 191),
+                depth("ETHUSDT", 4, 212, 213)]
+    for num, msg in enumerate(messages):
+        recorder.write(msg, 1600000000. + num * 0.1)
+    recorder.close()
+
+
+def replay(path):
+    plans = [Plan(MARKETS, "USDT", 12, "test", "ARBITRAGE", "USDT", "USDT")]
+    replay_ = Replay(plans, path)
+    report = replay_.run()
+    trades = [(opportunity.timestamp, opportunity.profit, opportunity.actual_balance, opportunity.execution_status)
+              for opportunity in replay_.opportunities]
+    return report, trades
+
+
+def test_replay_of_a_recording_is_deterministic(tmp_path):
+    path = str(tmp_path / "recording.jsonl.gz")
+    record(path)
+    report, trades = replay(path)
+    again, trades_again = replay(path)
+
+    assert report["messages"] == 7 and report["sim_seconds"] == pytest.approx(0.6)
+    assert report["passes"] == 5  # From the first message with all three books
+    assert report["opportunities"] == 3  # ETHUSDT at 210, the BTCUSDT update after it, ETHUSDT at 212
+    assert report["executed"] == 3 and report["passed"] == 3 and report["errors"] == 0
+    assert report["orders"] == report["orders_filled"] == 9
+    assert report["estimated_profit"]["USDT"] > 0 and report["pnl"]["USDT"] > 0
+    assert trades == trades_again
+    for key in ("wall_seconds", "speedup", "evaluations_per_sec"):
+        del report[key], again[key]
+    assert report == again
+
+
+# Plan markets of a graph deployment: the USDT triangle and a BNB triangle without a BNBUSDT market
+BNB_MARKETS = [{"symbol": "BNBBTC", "base": "BNB", "quote": "BTC", "decimals": 2, "exchange": "BINANCE"},
+               {"symbol": "ETHBTC", "base": "ETH", "quote": "BTC", "decimals": 3, "exchange": "BINANCE"},
+               {"symbol": "ETHBNB", "base": "ETH", "quote": "BNB", "decimals": 3, "exchange": "BINANCE"}]
+
+
+def graph_replay(path):
+    plans = [Plan(MARKETS, "USDT", 12, "test", "ARBITRAGE", "USDT", "USDT"),
+             Plan(BNB_MARKETS, "BNB", 1, "test", "ARBITRAGE", "BNB", "BNB")]
+    return Replay(plans, path, settings={"evaluation": "graph"})
+
+
+def test_cycle_plans_start_from_a_home_asset_that_values_the_leftovers(tmp_path):
+    bot = graph_replay(str(tmp_path / "recording.jsonl.gz")).bot
+    plan, kernel = bot.cycle_plan(("BTC", "ETH", "USDT"))
+    assert plan.home_asset == "USDT" and plan.start_amount == 12
+    assert plan.path == ["BTCUSDT", "ETHBTC", "ETHUSDT"]  # USDT -> BTC -> ETH -> USDT
+    assert list(kernel.markets) == plan.path
+    # BNB has no USDT market, USDT none with BNB
+    assert bot.cycle_plan(("USDT", "BTC", "BNB", "ETH")) == (None, None)
+    assert bot.cycle_plan(("BNB", "ETH", "BTC"))[0].home_asset == "BNB"
+
+
+def test_graph_evaluation_acts_on_the_cycles_it_finds(tmp_path):
+    path = str(tmp_path / "recording.jsonl.gz")
+    recorder = Recorder(path)
+    messages = [depth("BNBBTC", 1, 0.00199, 0.002), depth("ETHBNB", 1, 9.95, 10), depth("BTCUSDT", 1, 9990, 10000),
+                depth("ETHBTC", 1, 0.0199, 0.02), depth("ETHUSDT", 1, 199, 200),  # No cycle yet
+                depth("ETHUSDT", 2, 210, 211)]  # USDT -> BTC -> ETH -> USDT returns 1.05
+    for num, msg in enumerate(messages):
+        recorder.write(msg, 1600000000. + num * 0.1)
+    recorder.close()
+
+    replay_ = graph_replay(path)
+    report = replay_.run()
+    assert report["opportunities"] == 1 and report["executed"] == 1 and report["passed"] == 1
+    assert report["errors"] == 0
+    opportunity, = replay_.opportunities
+    assert opportunity.plan.path == ["BTCUSDT", "ETHBTC", "ETHUSDT"] and opportunity.plan.home_asset == "USDT"
+    assert opportunity.profit > 0 and opportunity.actual_balance == pytest.approx(opportunity.profit)
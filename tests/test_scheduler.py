@@ -0,0 +1,49 @@
+"""Evaluation passes of the coalescing UpdateScheduler."""
+
+
+import time
+from threading import Event
+
+from binance_bot import UpdateScheduler
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_updates_merge_while_busy_and_a_failed_pass_doesnt_stop_the_worker():
+    passes, errors = [], []
+    busy, release = Event(), Event()
+
+    def evaluate(markets):
+        passes.append(markets)
+        if len(passes) == 1:
+            busy.set()
+            release.wait(5)
+            raise ValueError("Pass failed")
+
+    scheduler = UpdateScheduler(evaluate, on_error=errors.append)
+    scheduler.start()
+    try:
+        scheduler.mark("BTCUSDT")
+        assert busy.wait(5)
+        for market in ("ETHUSDT", "ETHBTC", "ETHUSDT"):  # Wait for the running pass
+            scheduler.mark(market)
+        assert scheduler.stats()["pending"] == 2
+        release.set()
+
+        assert wait_for(lambda: scheduler.stats()["passes"] == 2)
+        assert passes == [{"BTCUSDT"}, {"ETHUSDT", "ETHBTC"}]
+        stats = scheduler.stats()
+        assert stats["updates"] == 4 and stats["merged"] == 1
+        assert stats["failed"] == 1 and stats["pending"] == 0
+        assert len(errors) == 1 and "ValueError: Pass failed" in errors[0]
+
+        scheduler.mark("BTCUSDT")  # Still running after the failure
+        assert wait_for(lambda: scheduler.stats()["passes"] == 3)
+        assert passes[-1] == {"BTCUSDT"}
+    finally:
+        scheduler.stop()
@@ -0,0 +1,105 @@
+"""Candidates of the shards acted on by the router."""
+
+
+import math
+import queue
+import random
+import time
+from threading import Thread
+from types import SimpleNamespace
+
+import numpy as np
+
+from binance_bot import BinanceBot, Plan
+from order_book import Book
+from replay import NullSink
+from sharding import partition_plans, run_shard
+
+
+def market(symbol, base):
+    return {"symbol": symbol, "base": base, "quote": "USDT", "decimals": 6, "exchange": "BINANCE"}
+
+
+def book(symbol):
+    book_ = Book(symbol)
+    book_.fill({"lastUpdateId": 1, "bids": [["100", "1"]], "asks": [["101", "1"]]}, 1.)
+    return book_
+
+
+def collect(router):
+    """Run the router's collector until it has handled a batch."""
+    router.running = True
+    collector = Thread(target=router._collect)
+    collector.start()
+    deadline = time.time() + 5
+    while not router.passes and time.time() < deadline:
+        time.sleep(0.01)
+    router.running = False
+    collector.join(5)
+
+
+def test_candidates_on_resynced_books_are_skipped():
+    plans = [Plan([market(symbol, base)] * 2, "USDT", 12, "test", "ARBITRAGE", "USDT", "USDT")  # Buy, then sell
+             for symbol, base in (("BTCUSDT", "BTC"), ("ETHUSDT", "ETH"))]
+    bot = BinanceBot(plans, execute=False, settings={"shards": 2, "latency": False}, client=object(), sink=NullSink(),
+                     notifier=NullSink(), order_entry=NullSink())
+    router = bot.scheduler
+    acted = []
+    bot.act_on_estimates = lambda *args: acted.append(args)
+    bot.books = {"BTCUSDT": book("BTCUSDT")}  # ETHUSDT is being resynced, its shard still has the old book
+
+    router.results.put((0, [], [], [], time.time(), 3))  # A pass without candidates
+    router.results.put((0, [0, 1], [0.1, 0.2], [False, True], time.time(), 2))
+    collect(router)
+
+    assert acted == [([0], [0.1], None)]
+    assert router.failed == 0 and not bot.exceptions
+    assert router.passes == 1 and bot.plans_evaluated.values[()] == 5  # Every plan the shards evaluated
+
+
+def test_partition_puts_every_plan_in_one_shard():
+    rnd = random.Random(3)
+    symbols = [f"A{i}USDT" for i in range(12)]
+    kernels = [SimpleNamespace(markets=tuple(rnd.sample(symbols, rnd.randint(2, 4)))) for _ in range(50)]
+    for shards in (1, 2, 3, 7, 50, 80):
+        groups = partition_plans(kernels, shards)
+        assert sorted(plan_id for group in groups for plan_id in group) == list(range(len(kernels)))
+        assert len(groups) == min(shards, len(kernels))
+        assert max(map(len, groups)) - min(map(len, groups)) <= -(-len(kernels) // len(groups))
+
+
+TRIANGLE = [{"symbol": "BTCUSDT", "base": "BTC", "quote": "USDT", "decimals": 6, "exchange": "BINANCE"},
+            {"symbol": "ETHBTC", "base": "ETH", "quote": "BTC", "decimals": 3, "exchange": "BINANCE"},
+            {"symbol": "ETHUSDT", "base": "ETH", "quote": "USDT", "decimals": 5, "exchange": "BINANCE"}]
+
+
+def test_shard_finds_the_candidates_of_the_batch_engine():
+    plans = [Plan(TRIANGLE, "USDT", amount, "test", "ARBITRAGE", "USDT", "USDT") for amount in (12, 100, 10000)]
+    plans.append(Plan([market("BTCUSDT", "BTC")] * 2, "USDT", 12, "test", "ARBITRAGE", "USDT", "USDT"))
+    bot = BinanceBot(plans, execute=False, settings={"latency": False}, client=object(), sink=NullSink(),
+                     notifier=NullSink(), order_entry=NullSink())
+    books = {}
+    # USDT -> BTC -> ETH -> USDT returns 1.05 on the top levels, less deeper down
+    for symbol, bids, asks in (("BTCUSDT", [["9990", "0.01"], ["9980", "1"]], [["10000", "0.002"], ["10100", "1"]]),
+                               ("ETHBTC", [["0.0199", "1"]], [["0.02", "0.05"], ["0.021", "10"]]),
+                               ("ETHUSDT", [["210", "0.1"], ["150", "10"]], [["211", "1"]])):
+        books[symbol] = Book(symbol)
+        books[symbol].fill({"lastUpdateId": 1, "bids": bids, "asks": asks}, 1.)
+    plan_ids = list(range(len(plans)))
+    estimates = bot.engine.evaluate(books, plan_ids)
+    expected = [(i, float(estimate)) for i, estimate in zip(plan_ids, estimates) if not estimate <= 0]
+    assert 0 < len(expected) < len(plans) and math.isnan(expected[-1][1])  # Too big for the books
+
+    inbox, results = queue.Queue(), queue.Queue()
+    for symbol, book_ in books.items():  # All waiting before the worker starts, so they make one pass
+        inbox.put((symbol, book_.bid_px[:book_.bid_len].copy(), book_.bid_qty[:book_.bid_len].copy(),
+                   book_.ask_px[:book_.ask_len].copy(), book_.ask_qty[:book_.ask_len].copy(), 1, 1.))
+    worker = Thread(target=run_shard, args=(0, plans, plan_ids, bot.plan_markets, inbox, results))
+    worker.start()
+    shard_id, candidate_ids, candidate_estimates, sizable, oldest, evaluated = results.get(timeout=10)
+    inbox.put(None)
+    worker.join(5)
+
+    assert candidate_ids == [i for i, _ in expected]
+    np.testing.assert_array_equal(candidate_estimates, [estimate for _, estimate in expected])
+    assert evaluated == len(plans) and oldest == 1. and not any(sizable)
@@ -0,0 +1,97 @@
+"""Trade sizes of a plan on synthetic books."""
+
+
+from types import SimpleNamespace
+
+import pytest
+
+from binance_bot import Opportunity, Plan
+from order_book import Book
+from plan_compiler import Instruction, PlanKernel
+from sizing import market_filters, min_size, optimal_size, passes_filters
+
+
+MARKETS = [{"symbol": "BTCUSDT", "base": "BTC", "quote": "USDT", "decimals": 6, "exchange": "BINANCE"},
+           {"symbol": "ETHBTC", "base": "ETH", "quote": "BTC", "decimals": 3, "exchange": "BINANCE"},
+           {"symbol": "ETHUSDT", "base": "ETH", "quote": "USDT", "decimals": 5, "exchange": "BINANCE"}]
+
+
+def triangle():
+    """Kernel of USDT -> BTC -> ETH -> USDT."""
+    plan = Plan(MARKETS, "USDT", 12, "test", "ARBITRAGE", "USDT", "USDT")
+    return PlanKernel(0, plan, {market["symbol"] for market in MARKETS})
+
+
+def book(symbol, bids, asks):
+    book_ = Book(symbol)
+    book_.fill({"lastUpdateId": 1, "bids": [[str(price), str(qty)] for price, qty in bids],
+                "asks": [[str(price), str(qty)] for price, qty in asks]}, 1.)
+    return book_
+
+
+def books(eth_bid=210.):
+    """Books where the triangle returns eth_bid / 200 up to 100 USDT and loses beyond it."""
+    return {"BTCUSDT": book("BTCUSDT", [(9990, 1)], [(10000, 0.01), (11000, 1)]),
+            "ETHBTC": book("ETHBTC", [(0.0199, 100)], [(0.02, 100)]),
+            "ETHUSDT": book("ETHUSDT", [(eth_bid, 100)], [(eth_bid + 1, 100)])}
+
+
+def test_size_stops_where_the_plan_stops_earning():
+    assert optimal_size(triangle(), books()) == pytest.approx(100)  # The first BTCUSDT level
+
+
+def test_size_is_limited_by_high_and_the_balances():
+    kernel = triangle()
+    assert optimal_size(kernel, books(), high=50) == pytest.approx(50)
+    assert optimal_size(kernel, books(), balances={"USDT": 30, "BTC": 1, "ETH": 1}) == pytest.approx(30)
+
+
+def test_smallest_size_is_taken_if_the_balances_allow_it():
+    kernel = triangle()
+    assert optimal_size(kernel, books(), low=150) == 150
+    assert optimal_size(kernel, books(), low=150, balances={"USDT": 100, "BTC": 1, "ETH": 1}) is None
+
+
+def test_unprofitable_plan_has_no_size():
+    assert optimal_size(triangle(), books(eth_bid=190.)) is None  # Not 0, which can't be priced
+
+
+def test_unprofitable_plan_has_no_size_above_the_smallest_trade():
+    assert optimal_size(triangle(), books(eth_bid=190.), low=10.) is None  # Not the smallest trade the filters allow
+
+
+FILTERS = {"BTCUSDT": (0.00001, 10.), "ETHBTC": (0.001, 0.0001), "ETHUSDT": (0.0001, 10.)}
+
+
+def instructions(kernel, books_, amount):
+    """Rounded orders of the plan at the start amount, as they would be sent."""
+    bot = SimpleNamespace(process_books=books_, plan_markets=set(books_), latency=None)
+    opportunity = Opportunity(bot, kernel.plan, kernel, amount)
+    opportunity.find_opportunity()
+    return opportunity.instructions
+
+
+def test_orders_of_the_smallest_size_pass_the_filters():
+    kernel, books_ = triangle(), books()
+    low = min_size(kernel, books_, FILTERS)
+    assert 10 < low < 11  # Min notional of 10 USDT and the rounding
+    assert passes_filters(instructions(kernel, books_, low), FILTERS)
+    assert not passes_filters(instructions(kernel, books_, 9.9), FILTERS)
+
+
+def test_filters_check_the_quantity_and_the_notional():
+    assert passes_filters([Instruction(price=100., amount=0.1, side="BUY", symbol="ETHUSDT")], FILTERS)
+    assert not passes_filters([Instruction(price=100., amount=0.09, side="BUY", symbol="ETHUSDT")], FILTERS)
+    assert not passes_filters([Instruction(price=0.02, amount=0.0009, side="SELL", symbol="ETHBTC")], FILTERS)
+    assert passes_filters([Instruction(price=1., amount=0.1, side="BUY", symbol="XRPUSDT")], FILTERS)  # No filters
+
+
+def test_filters_come_from_the_exchange_info():
+    exchange_info = {"symbols": [
+        {"symbol": "BTCUSDT", "filters": [{"filterType": "LOT_SIZE", "minQty": "0.00001000", "stepSize": "0.00001000"},
+                                          {"filterType": "NOTIONAL", "minNotional": "5.00000000"}]},
+        {"symbol": "ETHBTC", "filters": [{"filterType": "LOT_SIZE", "minQty": "0.00010000", "stepSize": "0.00010000"},
+                                         {"filterType": "MIN_NOTIONAL", "minNotional": "0.00010000"}]},
+        {"symbol": "XRPBTC", "filters": []}]}
+    assert market_filters(exchange_info, {"BTCUSDT", "ETHBTC"}) == {"BTCUSDT": (0.00001, 5.), "ETHBTC": (0.0001, 0.0001)}
+    assert market_filters(exchange_info)["XRPBTC"] == (0., 0.)
@@ -0,0 +1,215 @@
+"""Microbenchmarks of the pricing kernels on synthetic books.
+
+Run from the repository root:
+    python -m tools.bench_kernels [--depths 5 10 20 50 100] [--save FILE] [--compare FILE]
+
+Books are generated from a fixed seed, so runs on the same machine are comparable. Every benchmark
+reports ops/sec from a tight loop, latency percentiles from individually timed calls and the peak
+memory one call allocates (tracemalloc). --compare exits with 1 if any benchmark got slower than
+the baseline by more than --tolerance.
+"""
+
+
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import numpy as np
+
+import helpers as hp
+from binance_bot import BinanceBot, Opportunity, PlanKernel
+from config import FEE, DEPLOYMENT_SETTINGS_SOURCE
+from main import get_plans
+from order_book import Book
+from replay import NullSink, SimClient
+
+
+DEPTHS = (5, 10, 20, 50, 100)
+SEED = 7
+BASELINE = "./data/bench_kernels.json"
+
+
+def synthetic_depth(rnd, price, depth, qty=1.):
+    """Return depth data (price and quantity strings) around the price, as the API sends it."""
+    bids = [[f"{price * (1 - 0.0002 * (i + 1)):.8f}", f"{qty * rnd.uniform(0.5, 1.5):.8f}"] for i in range(depth)]
+    asks = [[f"{price * (1 + 0.0002 * (i + 1)):.8f}", f"{qty * rnd.uniform(0.5, 1.5):.8f}"] for i in range(depth)]
+    return {"lastUpdateId": rnd.randint(1, 10 ** 9), "bids": bids, "asks": asks}
+
+
+def synthetic_books(markets, depth, amount, seed=SEED):
+    """Return books of the markets in which trading the amount walks about half of the depth."""
+    rnd = random.Random(seed)
+    books = {}
+    for market in sorted(markets):
+        # Prices close to 1 keep the amount about the same through all legs of a plan
+        book = Book(market)
+        book.fill(synthetic_depth(rnd, rnd.uniform(0.9, 1.1), depth, qty=2 * amount / depth), time.time())
+        books[market] = book
+    return books
+
+
+def measure(fn, min_time=0.3, samples=2000):
+    """Return ops/sec, latency percentiles (us) and allocated peak (bytes) of fn()."""
+    fn()  # Warm up
+    # Throughput: grow the loop until it runs long enough
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 2 if elapsed < min_time / 10 else 1 + int(min_time / max(elapsed, 1e-9))
+    ops = loops / elapsed
+
+    latencies = np.empty(samples)
+    for i in range(samples):
+        start = time.perf_counter_ns()
+        fn()
+        latencies[i] = time.perf_counter_ns() - start
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) / 1e3
+
+    tracemalloc.start()
+    peaks = []
+    for _ in range(20):
+        tracemalloc.reset_peak()
+        base = tracemalloc.get_traced_memory()[0]
+        fn()
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    return {"ops_per_sec": ops, "p50_us": p50, "p90_us": p90, "p99_us": p99, "alloc_bytes": int(np.median(peaks))}
+
+
+def kernel_benchmarks(plans, depths):
+    """Yield (name, function) of every benchmark."""
+    plan = plans[0]
+    markets = {market for plan_ in plans for market in plan_.path}
+    for depth in depths:
+        books = synthetic_books(markets, depth, plan.start_amount)
+        bot = SimpleNamespace(plan_markets=markets, process_books=books)  # What Opportunity reads of the bot
+        opportunity = Opportunity(bot, plan, PlanKernel(0, plan, markets))
+        orders = books[plan.path[0]].orders("asks")
+        half = sum(qty for _, qty in orders[:max(1, depth // 2)])  # Amounts that walk half of the depth
+        half_quote = sum(price * qty for price, qty in orders[:max(1, depth // 2)])
+        wallet = {asset: plan.start_amount / 2 for asset in opportunity.kernel.assets}
+
+        # Defaults bind this depth's objects, the functions run after the loop
+        yield (f"get_best_orders/depth={depth}",
+               lambda orders=orders, half=half: Opportunity.get_best_orders(orders, half))
+        yield (f"get_best_orders_inverse/depth={depth}",
+               lambda orders=orders, half=half_quote: Opportunity.get_best_orders(orders, half, inverse=True))
+        yield (f"simulate_trade/depth={depth}",
+               lambda opportunity=opportunity: opportunity.simulate_trade(opportunity.kernel, FEE))
+        yield (f"normalize_wallet/depth={depth}",
+               lambda opportunity=opportunity, wallet=wallet: opportunity.normalize_wallet(dict(wallet), plan.home_asset))
+        yield f"get_avg/depth={depth}", lambda orders=orders: hp.get_avg(orders)
+
+    action = plan.actions[0]
+    filtering = Opportunity(SimpleNamespace(plan_markets=markets, process_books={}), plan, PlanKernel(0, plan, markets))
+    yield "apply_qnt_filter", lambda: filtering.apply_qnt_filter(1.23456789, action)
+
+
+class NullScheduler:
+    """Takes the updates in place of the evaluation, so only the ingest is measured."""
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def mark(self, market):
+        pass
+
+
+def ingest_benchmarks(plans, depths):
+    """Yield (name, function) of handle_message with depth messages of every depth."""
+    bot = BinanceBot(plans, execute=False, settings={}, client=SimClient(), sink=NullSink(), notifier=NullSink(),
+                     order_entry=NullSink())
+    bot.scheduler = NullScheduler()
+    rnd = random.Random(SEED)
+    streams = list(bot.stream_symbols)
+    for depth in depths:
+        messages = [{"stream": stream, "data": synthetic_depth(rnd, rnd.uniform(0.5, 2.), depth)} for stream in streams]
+        for msg in messages:
+            bot.handle_message(msg)  # Every book is present, as in the running bot
+        cycle = {"i": 0}
+
+        def ingest(messages=messages, cycle=cycle):
+            cycle["i"] = (cycle["i"] + 1) % len(messages)
+            bot.handle_message(messages[cycle["i"]])
+
+        yield f"handle_message/depth={depth}", ingest
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"python": sys.version.split()[0], "numpy": np.__version__, "platform": platform.platform(),
+            "processor": platform.processor(), "commit": commit, "time": time.time()}
+
+
+def compare(results, baseline, tolerance):
+    """Print changes against the baseline; return names of benchmarks that are slower than the tolerance."""
+    slower = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = result["ops_per_sec"] / baseline[name]["ops_per_sec"]
+        flag = ""
+        if ratio < 1 - tolerance:
+            slower.append(name)
+            flag = "  SLOWER"
+        print(f"{name:40} {ratio:7.2f}x{flag}")
+    return slower
+
+
+def main(depths=DEPTHS, save=None, compare_to=None, tolerance=0.1, pattern=None):
+    with open(DEPLOYMENT_SETTINGS_SOURCE) as ds_file:
+        plans = get_plans(json.load(ds_file))
+
+    results = {}
+    print(f"{'benchmark':40} {'ops/sec':>12} {'p50 us':>9} {'p90 us':>9} {'p99 us':>9} {'alloc B':>9}")
+    benchmarks = list(kernel_benchmarks(plans, depths)) + list(ingest_benchmarks(plans, depths))
+    for name, fn in benchmarks:
+        if pattern and pattern not in name:
+            continue
+        result = results[name] = measure(fn)
+        print(f"{name:40} {result['ops_per_sec']:12,.0f} {result['p50_us']:9.2f} {result['p90_us']:9.2f} "
+              f"{result['p99_us']:9.2f} {result['alloc_bytes']:9d}")
+
+    if save:
+        with open(save, "w") as baseline_file:
+            json.dump({"environment": environment(), "results": results}, baseline_file, indent=4)
+        print(f"Saved to {save}")
+    if compare_to:
+        with open(compare_to) as baseline_file:
+            baseline = json.load(baseline_file)
+        print(f"\nCompared to {compare_to} ({baseline['environment'].get('commit')}):")
+        slower = compare(results, baseline["results"], tolerance)
+        if slower:
+            print(f"{len(slower)} benchmarks are slower than the baseline.")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--depths", nargs="+", type=int, default=DEPTHS)
+    parser.add_argument("--save", nargs="?", const=BASELINE, default=None, help="Save results as the baseline")
+    parser.add_argument("--compare", nargs="?", const=BASELINE, default=None, help="Compare with the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Allowed slowdown before --compare fails")
+    parser.add_argument("-k", dest="pattern", default=None, help="Only benchmarks whose name contains this")
+    args = parser.parse_args()
+
+    sys.exit(main(args.depths, args.save, args.compare, args.tolerance, args.pattern))
@@ -0,0 +1,263 @@
+"""End-to-end scale benchmark of BinanceBot with a synthetic market universe.
+
+Run from the repository root:
+    python -m tools.bench_scale [--plans 10 100 1000 10000] [--rates 100 1000 0] [--duration 5]
+
+Deployments are built from the markets in data/symbols_info.json: triangles of assets first (6 plans
+each, as deployment_factory.py makes them), then 4-leg cycles of assets that all trade against each
+other, starting from the most traded assets. A synthetic feed sends depth messages of all plan markets
+through BinanceBot.handle_message at the given rate (0 - as fast as it can) while the bot's own
+UpdateScheduler evaluates them. Prices are consistent across markets, so the bot evaluates the plans
+but finds no opportunities; nothing is sent to Slack, BigQuery or the exchange.
+
+Reports sustained updates/sec, evaluations/sec, evaluation lag (from the oldest pending update of a
+pass to the end of the pass), how long the backlog took to drain after the feed stopped and memory
+per plan (tracemalloc, bot with all books loaded and evaluated once).
+"""
+
+
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+
+import numpy as np
+
+from binance_bot import BinanceBot
+from config import SYMBOLS_INFO_SOURCE
+from main import get_plans
+from replay import NullSink, SimClient
+
+
+PLANS = (10, 100, 1000, 10000)
+RATES = (100, 1000, 0)  # Depth messages per second, 0 - as fast as possible
+SEED = 7
+DEPTH = 10  # Levels per side, as in the partial depth stream
+VARIANTS = 8  # Pregenerated messages per market
+SPREAD = 0.001  # Relative bid/ask spread; price noise stays well inside it, so there is no arbitrage
+TRADE_VALUE = 12  # Start amount of every plan in the normalizing unit (deployment_factory.NORMALIZED_START_AMOUNT)
+
+
+def asset_graph(symbols_info):
+    """Return asset -> {asset: symbol} of all markets."""
+    graph = {}
+    for symbol, info in symbols_info.items():
+        graph.setdefault(info["base"], {})[info["quote"]] = symbol
+        graph.setdefault(info["quote"], {})[info["base"]] = symbol
+    return graph
+
+
+def cycles(graph):
+    """Yield asset cycles, triangles first, then 4-leg cycles in which all assets trade against each other.
+
+    Assets are added from the most traded one on and every cycle comes with the first asset that
+    completes it, so smaller deployments use the busiest markets.
+    """
+    ranked = sorted(graph, key=lambda asset: (-len(graph[asset]), asset))
+    rank = {asset: i for i, asset in enumerate(ranked)}
+    for k, top in enumerate(ranked):
+        lower = sorted((asset for asset in graph[top] if rank[asset] < k), key=rank.get)
+        for i, a in enumerate(lower):
+            for b in lower[i + 1:]:
+                if b in graph[a]:
+                    yield (top, a, b)
+    for k, top in enumerate(ranked):
+        lower = sorted((asset for asset in graph[top] if rank[asset] < k), key=rank.get)
+        for i, a in enumerate(lower):
+            for j, b in enumerate(lower[i + 1:], i + 1):
+                for c in lower[j + 1:]:
+                    if b in graph[a] and c in graph[a] and c in graph[b]:
+                        # Three distinct cycles through a 4-clique
+                        yield (top, a, b, c)
+                        yield (top, a, c, b)
+                        yield (top, b, a, c)
+
+
+def cycle_plans(graph, symbols_info, cycle, values, decimals=2):
+    """Return plan settings of every start asset and direction of the cycle."""
+    plans = []
+    for assets in (cycle, cycle[::-1]):
+        for start in range(len(assets)):
+            order = assets[start:] + assets[:start]
+            markets = []
+            for asset, next_asset in zip(order, order[1:] + order[:1]):
+                symbol = graph[asset][next_asset]
+                markets.append({"symbol": symbol,
+                                "quote": symbols_info[symbol]["quote"],
+                                "base": symbols_info[symbol]["base"],
+                                "decimals": decimals,
+                                "exchange": "BINANCE"})
+            home = order[0]
+            plans.append({"markets": markets,
+                          "start_currency": home,
+                          "start_amount": str(round(TRADE_VALUE / values[home], 8)),
+                          "fee_asset": home,
+                          "profit_asset": home,
+                          "strategy": "ARBITRAGE"})
+    return plans
+
+
+def asset_values(graph, seed=SEED):
+    """Return a synthetic value of every asset, prices of markets are their ratios."""
+    rnd = random.Random(seed)
+    return {asset: 10 ** rnd.uniform(-1, 2) for asset in sorted(graph)}
+
+
+def deployment(count, symbols_info, values):
+    """Return deployment settings with `count` plans (fewer if the universe doesn't have as many)."""
+    graph = asset_graph(symbols_info)
+    plans = []
+    for cycle in cycles(graph):
+        plans.extend(cycle_plans(graph, symbols_info, cycle, values))
+        if len(plans) >= count:
+            break
+    return {"instance_id": "Scale benchmark",
+            "global_settings": {"fees": {"BINANCE": "0.00075"}},
+            "plans": plans[:count]}
+
+
+def depth_message(stream, price, qty, rnd):
+    """Return a partial depth message of the market around the price."""
+    price *= 1 + rnd.uniform(-SPREAD / 8, SPREAD / 8)
+    bids = [[f"{price * (1 - SPREAD / 2) * (1 - 0.0002 * i):.8f}", f"{qty * rnd.uniform(0.5, 1.5):.8f}"] for i in range(DEPTH)]
+    asks = [[f"{price * (1 + SPREAD / 2) * (1 + 0.0002 * i):.8f}", f"{qty * rnd.uniform(0.5, 1.5):.8f}"] for i in range(DEPTH)]
+    return {"stream": stream, "data": {"lastUpdateId": rnd.randint(1, 10 ** 9), "bids": bids, "asks": asks}}
+
+
+def feed_messages(bot, symbols_info, values, seed=SEED):
+    """Return VARIANTS messages of every plan market, so the feed doesn't spend time on making them."""
+    rnd = random.Random(seed)
+    messages = []
+    for stream, pair in sorted(bot.stream_symbols.items()):
+        base, quote = symbols_info[pair]["base"], symbols_info[pair]["quote"]
+        price = values[base] / values[quote]
+        qty = TRADE_VALUE / 2 / values[base]  # A plan's trade takes a couple of levels
+        messages.append([depth_message(stream, price, qty, rnd) for _ in range(VARIANTS)])
+    return messages
+
+
+def build_bot(plans):
+    """Return the bot that evaluates but never executes or logs."""
+    return BinanceBot(plans, execute=False, settings={"shards": 1, "depth_mode": "partial", "book_ticker": False},
+                      client=SimClient(), sink=NullSink(), notifier=NullSink(), order_entry=NullSink())
+
+
+def measure_memory(plans, symbols_info, values):
+    """Return bytes allocated by the bot with all books loaded and evaluated once."""
+    gc.collect()
+    tracemalloc.start()
+    bot = build_bot(plans)
+    for variants in feed_messages(bot, symbols_info, values):
+        bot.handle_message(variants[0])
+    bot.process_updates(set(bot.plan_markets))
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return memory
+
+
+def drive(bot, messages, rate, duration, seed=SEED):
+    """Send the messages to the bot at the rate for `duration` seconds; return the count and time taken."""
+    rnd = random.Random(seed)
+    picks = [(rnd.randrange(len(messages)), rnd.randrange(VARIANTS)) for _ in range(4096)]
+    sent = 0
+    start = time.perf_counter()
+    while True:
+        elapsed = time.perf_counter() - start
+        if elapsed >= duration:
+            break
+        due = int(elapsed * rate) - sent if rate else 256
+        if due <= 0:
+            time.sleep(0.0005)
+            continue
+        for _ in range(due):
+            market, variant = picks[sent % len(picks)]
+            bot.handle_message(messages[market][variant])
+            sent += 1
+    return sent, time.perf_counter() - start
+
+
+def run(plans, symbols_info, values, rate, duration):
+    """Return the results of one deployment at one feed rate."""
+    bot = build_bot(plans)
+    messages = feed_messages(bot, symbols_info, values)
+    for variants in messages:
+        bot.handle_message(variants[0])  # Every book is present, as after get_intial_books
+
+    scheduler = bot.scheduler
+    passes = []  # (lag, plans evaluated) of every pass
+
+    def evaluate(pairs):
+        waited = scheduler.lag  # Set by the scheduler right before the pass
+        start = time.perf_counter()
+        bot.process_updates(pairs)
+        passes.append((waited + time.perf_counter() - start, len(bot.compiled.affected(pairs))))
+
+    scheduler.evaluate = evaluate
+    scheduler.start()
+    sent, elapsed = drive(bot, messages, rate, duration)
+    # Let the evaluator finish what the feed left behind
+    drain_start = time.perf_counter()
+    while (scheduler.dirty or scheduler.busy) and time.perf_counter() - drain_start < 30:
+        time.sleep(0.001)
+    drain = time.perf_counter() - drain_start
+    scheduler.stop()
+    total = elapsed + drain
+
+    lags = np.array([lag for lag, _ in passes]) * 1e3 if passes else np.zeros(1)
+    stats = scheduler.stats()
+    return {"plans": len(plans),
+            "markets": len(bot.plan_markets),
+            "rate": rate,
+            "updates_per_sec": sent / elapsed,
+            "evaluations_per_sec": sum(count for _, count in passes) / total,
+            "passes": stats["passes"],
+            "merged": stats["merged"] / stats["updates"] if stats["updates"] else 0.,
+            "lag_p50_ms": float(np.percentile(lags, 50)),
+            "lag_p99_ms": float(np.percentile(lags, 99)),
+            "lag_max_ms": float(lags.max()),
+            "drain_ms": drain * 1e3,
+            "errors": len(bot.exceptions) + len(bot.notifier.messages)}
+
+
+def main(counts=PLANS, rates=RATES, duration=5., save=None):
+    with open(SYMBOLS_INFO_SOURCE) as symbols_file:
+        symbols_info = json.load(symbols_file)
+    values = asset_values(asset_graph(symbols_info))
+
+    results = []
+    print(f"{'plans':>6} {'markets':>7} {'rate':>7} {'upd/sec':>9} {'eval/sec':>10} {'passes':>7} {'merged':>7} "
+          f"{'lag p50':>8} {'lag p99':>8} {'lag max':>8} {'drain':>7} {'B/plan':>8} {'errors':>6}")
+    for count in counts:
+        plans = get_plans(deployment(count, symbols_info, values))
+        if len(plans) < count:
+            print(f"The universe has only {len(plans)} plans.")
+        memory = measure_memory(plans, symbols_info, values)
+        for rate in rates:
+            result = run(plans, symbols_info, values, rate, duration)
+            result["memory_bytes"] = memory
+            result["bytes_per_plan"] = memory / len(plans)
+            results.append(result)
+            print(f"{result['plans']:6d} {result['markets']:7d} {rate or 'max':>7} {result['updates_per_sec']:9,.0f} "
+                  f"{result['evaluations_per_sec']:10,.0f} {result['passes']:7d} {result['merged']:7.1%} "
+                  f"{result['lag_p50_ms']:8.2f} {result['lag_p99_ms']:8.2f} {result['lag_max_ms']:8.2f} "
+                  f"{result['drain_ms']:7.1f} {result['bytes_per_plan']:8,.0f} {result['errors']:6d}")
+            gc.collect()
+
+    if save:
+        with open(save, "w") as results_file:
+            json.dump(results, results_file, indent=4)
+        print(f"Saved to {save}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--plans", nargs="+", type=int, default=PLANS, help="Plans per deployment")
+    parser.add_argument("--rates", nargs="+", type=int, default=RATES, help="Depth messages per second, 0 - unlimited")
+    parser.add_argument("--duration", type=float, default=5., help="Seconds the feed runs per deployment and rate")
+    parser.add_argument("--save", default=None, help="Save the results to this JSON file")
+    args = parser.parse_args()
+
+    main(args.plans, args.rates, args.duration, args.save)
@@ -0,0 +1,507 @@
+"""Local stand-in for the Binance REST API and combined market data streams, for load tests.
+
+Run from the repository root:
+    python -m tools.mock_exchange [--rate 100] [--latency 0.02] [--recording data.jsonl.gz]
+
+and point the bot at it with the deployment's global settings (printed at start):
+    "api_url": "http://127.0.0.1:8700", "stream_url": "ws://127.0.0.1:8701"
+
+Markets are the ones of the deployment. Their books are synthesized from asset values that move by a
+random walk, so cross prices are consistent up to `--noise` (larger noise makes more opportunities),
+or they are replayed from a replay.Recorder recording. Every stream gets `--rate` partial depth
+updates per second (production is 10). LIMIT IOC/FOK orders fill against the mock's books and
+balances. Served endpoints: ping, time, exchangeInfo, depth, ticker/allPrices, ticker/price,
+account, order (placing, and querying by origClientOrderId) and order/test. The stream port also
+serves the websocket API's order.place at /ws-api/v3 ("ws_api_url" of the bot). Signatures aren't
+checked.
+"""
+
+
+import argparse
+import asyncio
+import gzip
+import json
+import math
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qsl
+
+import websockets
+
+from config import DEPLOYMENT_SETTINGS_SOURCE, SYMBOLS_INFO_SOURCE, FEE
+
+
+# USD values of the assets of the supported markets; other assets get a random one
+VALUES = {"USDT": 1., "BTC": 9400., "ETH": 232., "BNB": 17.2, "XRP": 0.2, "EUR": 1.1, "RUB": 0.0137}
+DEPTH = 10  # Levels in depth messages
+SNAPSHOT_DEPTH = 100  # Levels the books keep (REST depth)
+SPREAD = 0.001  # Relative bid/ask spread
+LEVEL_STEP = 0.0002  # Relative price distance between levels
+LEVEL_VALUE = 500  # Average USD value of a level
+VOLATILITY = 0.0002  # Standard deviation of an asset's log-value change per update
+
+
+class Limits:
+    """Request weight per minute and orders per 10 seconds, counted like the exchange does."""
+
+    def __init__(self, weight_limit, order_limit):
+        self.weight_limit = weight_limit
+        self.order_limit = order_limit
+        self.weights = deque()  # (time, weight)
+        self.orders = deque()  # time
+        self.lock = threading.Lock()
+
+    def add(self, weight, order=False):
+        """Count the request; return (used weight, order count, error) with error None if it's allowed."""
+        now = time.time()
+        with self.lock:
+            while self.weights and self.weights[0][0] < now - 60:
+                self.weights.popleft()
+            while self.orders and self.orders[0] < now - 10:
+                self.orders.popleft()
+            self.weights.append((now, weight))
+            if order:
+                self.orders.append(now)
+            used = sum(weight for _, weight in self.weights)
+            error = None
+            if used > self.weight_limit:
+                error = {"code": -1003, "msg": f"Too much request weight used; current limit is {self.weight_limit} request weight per 1 MINUTE."}
+            elif order and len(self.orders) > self.order_limit:
+                error = {"code": -1015, "msg": f"Too many new orders; current limit is {self.order_limit} orders per 10 SECOND."}
+            return used, len(self.orders), error
+
+
+class MockExchange:
+    """Books, balances and order matching of the mock; thread safe."""
+
+    def __init__(self, markets, symbols_info, balance=1000., noise=0.0002, seed=7):
+        self.rnd = random.Random(seed)
+        self.markets = {symbol: (symbols_info[symbol]["base"], symbols_info[symbol]["quote"], decimals)
+                        for symbol, decimals in markets.items()}
+        assets = sorted({asset for base, quote, _ in self.markets.values() for asset in (base, quote)})
+        self.values = {asset: VALUES.get(asset, 10 ** self.rnd.uniform(-1, 2)) for asset in assets}
+        self.balances = {asset: balance / self.values[asset] for asset in assets}  # `balance` USD of every asset
+        self.noise = noise
+        self.books = {}  # Symbol -> {"lastUpdateId", "bids", "asks"} with float levels
+        self.update_id = 1
+        self.order_id = 0
+        self.orders = {}  # Client order id -> order, as the order query returns it
+        self.lock = threading.Lock()
+        for symbol in self.markets:
+            self.synthesize(symbol)
+
+    def price(self, symbol):
+        base, quote, _ = self.markets[symbol]
+        return self.values[base] / self.values[quote]
+
+    def step(self):
+        """Move every asset's value by a random walk step."""
+        with self.lock:
+            for asset in self.values:
+                if asset != "USDT":
+                    self.values[asset] *= math.exp(self.rnd.gauss(0, VOLATILITY))
+
+    def synthesize(self, symbol):
+        """Make a new book of the symbol around its price."""
+        base = self.markets[symbol][0]
+        with self.lock:
+            mid = self.price(symbol) * (1 + self.rnd.gauss(0, self.noise))
+            qty = LEVEL_VALUE / self.values[base]
+            self.update_id += 1
+            self.books[symbol] = {
+                "lastUpdateId": self.update_id,
+                "bids": [[mid * (1 - SPREAD / 2) * (1 - LEVEL_STEP * i), qty * self.rnd.uniform(0.5, 1.5)] for i in range(SNAPSHOT_DEPTH)],
+                "asks": [[mid * (1 + SPREAD / 2) * (1 + LEVEL_STEP * i), qty * self.rnd.uniform(0.5, 1.5)] for i in range(SNAPSHOT_DEPTH)]}
+
+    def load(self, symbol, data):
+        """Replace the symbol's book with recorded depth data."""
+        with self.lock:
+            self.update_id += 1
+            self.books[symbol] = {"lastUpdateId": self.update_id,
+                                  "bids": [[float(price), float(qty)] for price, qty in data["bids"]],
+                                  "asks": [[float(price), float(qty)] for price, qty in data["asks"]]}
+
+    def depth(self, symbol, limit=DEPTH):
+        """Return depth data of the symbol, as the API sends it."""
+        with self.lock:
+            book = self.books[symbol]
+            return {"lastUpdateId": book["lastUpdateId"],
+                    "bids": [[f"{price:.8f}", f"{qty:.8f}"] for price, qty in book["bids"][:limit]],
+                    "asks": [[f"{price:.8f}", f"{qty:.8f}"] for price, qty in book["asks"][:limit]]}
+
+    def tickers(self):
+        with self.lock:
+            return [{"symbol": symbol, "price": f"{(book['bids'][0][0] + book['asks'][0][0]) / 2:.8f}"}
+                    for symbol, book in self.books.items() if book["bids"] and book["asks"]]
+
+    def exchange_info(self):
+        symbols = []
+        for symbol, (base, quote, decimals) in self.markets.items():
+            step = f"{10 ** -decimals:.8f}"
+            symbols.append({"symbol": symbol, "status": "TRADING", "baseAsset": base, "baseAssetPrecision": 8,
+                            "quoteAsset": quote, "quotePrecision": 8, "orderTypes": ["LIMIT", "MARKET"],
+                            "filters": [{"filterType": "PRICE_FILTER", "minPrice": "0.00000001",
+                                         "maxPrice": "1000000.00000000", "tickSize": "0.00000001"},
+                                        {"filterType": "PERCENT_PRICE", "multiplierUp": "5", "multiplierDown": "0.2",
+                                         "avgPriceMins": 5},
+                                        {"filterType": "LOT_SIZE", "minQty": step, "maxQty": "9000000.00000000",
+                                         "stepSize": step}]})
+        return {"timezone": "UTC", "serverTime": int(time.time() * 1000), "symbols": symbols,
+                "rateLimits": [{"rateLimitType": "REQUEST_WEIGHT", "interval": "MINUTE", "intervalNum": 1, "limit": 1200},
+                               {"rateLimitType": "ORDERS", "interval": "SECOND", "intervalNum": 10, "limit": 100}]}
+
+    def account(self):
+        with self.lock:
+            return {"makerCommission": 10, "takerCommission": 10, "canTrade": True, "accountType": "SPOT",
+                    "updateTime": int(time.time() * 1000),
+                    "balances": [{"asset": asset, "free": f"{amount:.8f}", "locked": "0.00000000"}
+                                 for asset, amount in self.balances.items()]}
+
+    def order(self, params, test=False):
+        """Fill a LIMIT IOC/FOK order; return (status code, response)."""
+        symbol, side = params.get("symbol"), params.get("side")
+        if symbol not in self.markets or side not in ("BUY", "SELL"):
+            return 400, {"code": -1121, "msg": "Invalid symbol."}
+        if params.get("type", "LIMIT") != "LIMIT" or params.get("timeInForce") not in ("IOC", "FOK"):
+            return 400, {"code": -1106, "msg": "The mock fills only LIMIT IOC and FOK orders."}
+        amount, limit_price = float(params["quantity"]), float(params["price"])
+        if test:
+            return 200, {}
+        base, quote, _ = self.markets[symbol]
+        buy = side == "BUY"
+        with self.lock:
+            levels = self.books[symbol]["asks" if buy else "bids"]
+            fills = []
+            left = amount
+            for level in levels:
+                price, qty = level
+                if left <= 1e-12 or (price > limit_price if buy else price < limit_price):
+                    break
+                size = min(left, qty)
+                fills.append((price, size))
+                left -= size
+            if params["timeInForce"] == "FOK" and left > 1e-12:
+                fills = []
+            executed = sum(size for _, size in fills)
+            quote_qty = sum(price * size for price, size in fills)
+            asset_out, amount_out = (quote, quote_qty) if buy else (base, executed)
+            if self.balances[asset_out] < amount_out:
+                return 400, {"code": -2010, "msg": "Account has insufficient balance for requested action."}
+            # Taken liquidity is gone until the book is made again
+            for (price, size), level in zip(fills, levels):
+                level[1] -= size
+            self.books[symbol]["bids" if not buy else "asks"] = [level for level in levels if level[1] > 1e-12]
+            asset_in, amount_in = (base, executed) if buy else (quote, quote_qty)
+            self.balances[asset_out] -= amount_out
+            self.balances[asset_in] += amount_in * (1 - FEE)
+            self.order_id += 1
+            order_id = self.order_id
+
+        status = "FILLED" if executed and amount - executed <= 1e-12 else "EXPIRED"
+        now = int(time.time() * 1000)
+        order = {"symbol": symbol,
+                 "orderId": order_id,
+                 "orderListId": -1,
+                 "clientOrderId": params.get("newClientOrderId", f"mock{order_id}"),
+                 "price": f"{limit_price:.8f}",
+                 "origQty": f"{amount:.8f}",
+                 "executedQty": f"{executed:.8f}",
+                 "cummulativeQuoteQty": f"{quote_qty:.8f}",
+                 "status": status,
+                 "timeInForce": params["timeInForce"],
+                 "type": "LIMIT",
+                 "side": side}
+        with self.lock:
+            self.orders[order["clientOrderId"]] = dict(order, stopPrice="0.00000000", icebergQty="0.00000000", time=now,
+                                                       updateTime=now, isWorking=True, origQuoteOrderQty="0.00000000")
+        return 200, dict(order, transactTime=now,
+                         fills=[{"price": f"{price:.8f}",
+                                 "qty": f"{size:.8f}",
+                                 "commission": f"{size * (1 if buy else price) * FEE:.8f}",
+                                 "commissionAsset": base if buy else quote,
+                                 "tradeId": order_id} for price, size in fills])
+
+    def query(self, params):
+        """Return (status code, order) of the order with the client order id."""
+        with self.lock:
+            order = self.orders.get(params.get("origClientOrderId"))
+        if order is None or order["symbol"] != params.get("symbol"):
+            return 400, {"code": -2013, "msg": "Order does not exist."}
+        return 200, order
+
+
+def rest_server(exchange, limits, host, port, latency=0., reject_rate=0., insufficient_rate=0., seed=7):
+    """Return the HTTP server of the REST endpoints."""
+    rnd = random.Random(seed)
+    weights = {"depth": 1, "exchangeInfo": 1, "ticker/allPrices": 2, "ticker/price": 2, "account": 5, "order": 1,
+               "order/test": 1, "ping": 1, "time": 1}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, like the exchange
+
+        def do_GET(self):
+            self.handle_request("GET")
+
+        def do_POST(self):
+            self.handle_request("POST")
+
+        def handle_request(self, method):
+            url = urlsplit(self.path)
+            params = dict(parse_qsl(url.query))
+            length = int(self.headers.get("Content-Length") or 0)
+            if length:
+                params.update(parse_qsl(self.rfile.read(length).decode()))
+            # /api/v1/depth, /api/v3/order, ...
+            parts = url.path.strip("/").split("/")
+            endpoint = "/".join(parts[2:]) if len(parts) > 2 and parts[0] == "api" else ""
+            if endpoint not in weights:
+                return self.reply(404, {"code": -1100, "msg": f"Unknown endpoint {url.path}."})
+
+            if latency:
+                time.sleep(rnd.uniform(0.5, 1.5) * latency)
+            order = method == "POST" and endpoint == "order"
+            weight = weights[endpoint] * (5 if endpoint == "depth" and int(params.get("limit", 100)) > 100 else 1)
+            weight *= 2 if endpoint == "order" and method == "GET" else 1
+            used, order_count, error = limits.add(weight, order)
+            headers = {"X-MBX-USED-WEIGHT-1M": str(used)}
+            if order:
+                headers["X-MBX-ORDER-COUNT-10S"] = str(order_count)
+            if error is None and rnd.random() < reject_rate:
+                error = {"code": -1003, "msg": "Too many requests (injected)."}
+            if error is not None:
+                headers["Retry-After"] = "1"
+                return self.reply(429, error, headers)
+            if order and rnd.random() < insufficient_rate:
+                return self.reply(400, {"code": -2010, "msg": "Account has insufficient balance for requested action."}, headers)
+
+            if endpoint in ("ping", "order/test") and method == "GET":
+                return self.reply(200, {}, headers)
+            if endpoint == "time":
+                return self.reply(200, {"serverTime": int(time.time() * 1000)}, headers)
+            if endpoint == "exchangeInfo":
+                return self.reply(200, exchange.exchange_info(), headers)
+            if endpoint == "depth":
+                if params.get("symbol") not in exchange.markets:
+                    return self.reply(400, {"code": -1121, "msg": "Invalid symbol."}, headers)
+                return self.reply(200, exchange.depth(params["symbol"], int(params.get("limit", 100))), headers)
+            if endpoint in ("ticker/allPrices", "ticker/price"):
+                return self.reply(200, exchange.tickers(), headers)
+            if endpoint == "account":
+                return self.reply(200, exchange.account(), headers)
+            if endpoint == "order" and method == "GET":
+                return self.reply(*exchange.query(params), headers)
+            status, response = exchange.order(params, test=endpoint == "order/test")
+            return self.reply(status, response, headers)
+
+        def reply(self, status, body, headers=None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+class StreamServer:
+    """Combined-stream websocket server: /stream?streams=<symbol>@depth10@100ms/..., and the websocket
+    API's order.place at /ws-api/v3.
+
+    With `drop_rate`, that share of the orders is placed but the session closes before the response.
+    With `lose_rate`, that share of the orders is placed but its response never comes, the session stays open.
+    """
+
+    def __init__(self, exchange, rate=10., latency=0., recording=None, speed=1., limits=None, drop_rate=0., seed=7,
+                 lose_rate=0.):
+        self.exchange = exchange
+        self.rate = rate  # Updates per stream per second
+        self.latency = latency
+        self.recording = recording
+        self.speed = speed
+        self.limits = limits
+        self.drop_rate = drop_rate
+        self.lose_rate = lose_rate
+        self.rnd = random.Random(seed)
+        self.subscribers = {}  # Stream -> set of send queues
+        self.messages = 0
+
+    async def handler(self, socket_, path=None):
+        path = path or socket_.request.path  # websockets < 10 passes the path
+        if urlsplit(path).path.startswith("/ws-api"):
+            return await self.order_session(socket_)
+        streams = dict(parse_qsl(urlsplit(path).query)).get("streams", "").split("/")
+        queue = asyncio.Queue()
+        for stream in streams:
+            self.subscribers.setdefault(stream, set()).add(queue)
+        try:
+            while True:
+                await socket_.send(await queue.get())
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for stream in streams:
+                self.subscribers[stream].discard(queue)
+
+    async def order_session(self, socket_):
+        """Answer order.place requests like the websocket API, with the rate limits of every response."""
+        try:
+            async for raw in socket_:
+                request = json.loads(raw)
+                reply = {"id": request.get("id")}
+                if request.get("method") != "order.place":
+                    reply.update(status=400, error={"code": -1100, "msg": "The mock only serves order.place."})
+                    await socket_.send(json.dumps(reply))
+                    continue
+                used, order_count, error = self.limits.add(1, order=True) if self.limits else (0, 0, None)
+                status, result = (429, error) if error is not None else self.exchange.order(request["params"])
+                if self.rnd.random() < self.drop_rate:
+                    await socket_.close()  # The order is placed, its response is lost
+                    return
+                if self.lose_rate and self.rnd.random() < self.lose_rate:
+                    continue  # The order is placed, its response never comes
+                reply.update(status=status)
+                reply["result" if status == 200 else "error"] = result
+                if self.limits:
+                    reply["rateLimits"] = [{"rateLimitType": "REQUEST_WEIGHT", "interval": "MINUTE", "intervalNum": 1,
+                                            "limit": self.limits.weight_limit, "count": used},
+                                           {"rateLimitType": "ORDERS", "interval": "SECOND", "intervalNum": 10,
+                                            "limit": self.limits.order_limit, "count": order_count}]
+                await socket_.send(json.dumps(reply))
+        except websockets.ConnectionClosed:
+            pass
+
+    def publish(self, symbol, event_time):
+        """Send the symbol's book to its subscribers."""
+        lower = symbol.lower()
+        for stream in (f"{lower}@depth{DEPTH}@100ms", f"{lower}@depth{DEPTH}"):
+            queues = self.subscribers.get(stream)
+            if not queues:
+                continue
+            data = self.exchange.depth(symbol, DEPTH)
+            data["E"] = event_time  # The partial depth stream has no event time; here it shows the feed delay
+            text = json.dumps({"stream": stream, "data": data})
+            for queue in queues:
+                self.put(queue, text)
+        queues = self.subscribers.get(f"{lower}@bookTicker")
+        if queues:
+            data = self.exchange.depth(symbol, 1)
+            text = json.dumps({"stream": f"{lower}@bookTicker",
+                               "data": {"u": data["lastUpdateId"], "s": symbol, "b": data["bids"][0][0],
+                                        "B": data["bids"][0][1], "a": data["asks"][0][0], "A": data["asks"][0][1]}})
+            for queue in queues:
+                self.put(queue, text)
+
+    def put(self, queue, text):
+        self.messages += 1
+        if self.latency:
+            asyncio.get_event_loop().call_later(self.latency, queue.put_nowait, text)
+        else:
+            queue.put_nowait(text)
+
+    async def synthesize(self):
+        """Update every market `rate` times a second."""
+        interval = 1 / self.rate
+        next_tick = time.perf_counter()
+        while True:
+            self.exchange.step()
+            event_time = int(time.time() * 1000)
+            for symbol in self.exchange.markets:
+                self.exchange.synthesize(symbol)
+                self.publish(symbol, event_time)
+            next_tick += interval
+            await asyncio.sleep(max(0, next_tick - time.perf_counter()))
+
+    async def replay(self):
+        """Send the recorded depth of the markets, `speed` times faster than recorded."""
+        streams = {f"{symbol.lower()}@depth{depth}@100ms": symbol for symbol in self.exchange.markets
+                   for depth in (5, 10, 20)}
+        start, first = time.perf_counter(), None
+        for timestamp, msg in recorded(self.recording):
+            symbol = streams.get(msg.get("stream"))
+            if symbol is None:
+                continue
+            first = timestamp if first is None else first
+            await asyncio.sleep(max(0, start + (timestamp - first) / self.speed - time.perf_counter()))
+            self.exchange.load(symbol, msg["data"])
+            self.publish(symbol, int(time.time() * 1000))
+        print("Recording finished.")
+
+    async def serve(self, host, port):
+        async with websockets.serve(self.handler, host, port, max_queue=None):
+            await (self.replay() if self.recording else self.synthesize())
+            await asyncio.Future()  # Keep serving after the recording
+
+
+def recorded(path):
+    """Yield (timestamp, message) of a replay.Recorder recording (replay.read_recording without the bot imports)."""
+    with gzip.open(path, "rt") as recording:
+        for line in recording:
+            yield json.loads(line)
+
+
+def deployment_markets(path):
+    """Return symbol -> decimals of all plan markets of the deployment."""
+    with open(path) as ds_file:
+        settings = json.load(ds_file)
+    return {market["symbol"]: market["decimals"] for plan in settings["plans"] for market in plan["markets"]}
+
+
+def main(args):
+    with open(SYMBOLS_INFO_SOURCE) as symbols_file:
+        symbols_info = json.load(symbols_file)
+    exchange = MockExchange(deployment_markets(args.deployment), symbols_info, args.balance, args.noise, args.seed)
+    limits = Limits(args.weight_limit, args.order_limit)
+    server = rest_server(exchange, limits, args.host, args.port, args.latency, args.reject_rate, args.insufficient_rate,
+                         args.seed)
+    threading.Thread(target=server.serve_forever, name="rest", daemon=True).start()
+
+    print(f"{len(exchange.markets)} markets, {args.rate:g} updates/sec per stream. Global settings of the bot:")
+    print(json.dumps({"api_url": f"http://{args.host}:{args.port}",
+                      "stream_url": f"ws://{args.host}:{args.stream_port}",
+                      "ws_api_url": f"ws://{args.host}:{args.stream_port}/ws-api/v3"}))
+    streams = StreamServer(exchange, args.rate, args.stream_latency, args.recording, args.speed, limits,
+                           args.drop_rate, args.seed, args.lose_rate)
+    try:
+        asyncio.run(streams.serve(args.host, args.stream_port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        print(f"{streams.messages} messages sent, {exchange.order_id} orders filled.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("deployment", nargs="?", default=DEPLOYMENT_SETTINGS_SOURCE)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700, help="REST port")
+    parser.add_argument("--stream-port", type=int, default=8701, help="Market data websocket port")
+    parser.add_argument("--rate", type=float, default=10., help="Depth updates per stream per second (production: 10)")
+    parser.add_argument("--recording", default=None, help="Replay this replay.Recorder recording instead")
+    parser.add_argument("--speed", type=float, default=1., help="Replay speed")
+    parser.add_argument("--noise", type=float, default=0.0002, help="Relative price noise per market and update")
+    parser.add_argument("--latency", type=float, default=0., help="Average REST response delay (sec)")
+    parser.add_argument("--stream-latency", type=float, default=0., help="Market data delay (sec)")
+    parser.add_argument("--weight-limit", type=int, default=1200, help="Request weight per minute before 429")
+    parser.add_argument("--order-limit", type=int, default=100, help="Orders per 10 seconds before 429")
+    parser.add_argument("--reject-rate", type=float, default=0., help="Share of requests answered with 429")
+    parser.add_argument("--insufficient-rate", type=float, default=0., help="Share of orders rejected with -2010")
+    parser.add_argument("--drop-rate", type=float, default=0.,
+                        help="Share of websocket API orders whose session closes before the response")
+    parser.add_argument("--lose-rate", type=float, default=0.,
+                        help="Share of websocket API orders whose response never comes")
+    parser.add_argument("--balance", type=float, default=1000., help="Starting USD value of every asset")
+    parser.add_argument("--seed", type=int, default=7)
+
+    main(parser.parse_args())
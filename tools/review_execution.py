@@ -25,7 +25,19 @@ def normalize_wallet(wallet_, base, side):
     return norm_wallet
 
 
-def review_execution(op_id, responses_path):
+def journal_orders(op_id, directory):
+    """Return the logged orders of the opportunity from a bot's journal, reading one segment at a time."""
+    from journal import SCHEMAS, decode, scan  # Run from the repository root: python -m tools.review_execution
+    schema = SCHEMAS["bullseye.trades"]
+    orders = []
+    for segment in scan("bullseye.trades", directory=directory, sealed_only=False):
+        for i in (segment["opportunityId"] == op_id.encode()).nonzero()[0]:
+            orders.append(decode(schema, {name: column[i] for name, column in segment.items()}))
+    return orders
+
+
+def review_execution(op_id, responses_path=None, journal_dir=None):
+    """Orders come from the responses JSON or, with `journal_dir`, from the journal of the bot instance."""
 
     def rebalance(asset, qnt):
         if asset not in wallet.keys():
@@ -33,8 +45,11 @@ def review_execution(op_id, responses_path):
         else:
             wallet[asset] += qnt
 
-    with open(responses_path) as responses:
-        response = json.load(responses)[op_id]
+    if journal_dir is not None:
+        response = journal_orders(op_id, journal_dir)
+    else:
+        with open(responses_path) as responses:
+            response = json.load(responses)[op_id]
 
     wallet = {}
     orders_fills = {'BUY': {}, 'SELL': {}}
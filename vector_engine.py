@@ -0,0 +1,197 @@
+"""Vectorized evaluation of many plans at once."""
+
+
+import numpy as np
+
+from config import FEE
+
+
+BIDS, ASKS = 0, 1  # Book side indices in the depth arrays
+
+
+class BatchEngine:
+    """Score plans in one vectorized pass over array-backed depth.
+
+    Plan kernels are laid out once as arrays (leg -> market index, side, rounding scale, wallet slots).
+    Every step of Opportunity.find_opportunity is replayed column-wise, in the same order of
+    floating point operations, so the estimated profits agree with the scalar path.
+    """
+
+    def __init__(self, kernels, plan_markets, fee=FEE):
+        self.fee = fee
+        self.markets = sorted(plan_markets)
+        self.market_index = {market: i for i, market in enumerate(self.markets)}
+        self._compile(kernels)
+
+        # Depth of all markets: [market, side, level]
+        self.depth = 0
+        self.px = np.zeros((len(self.markets), 2, 0))
+        self.qty = np.zeros((len(self.markets), 2, 0))
+        self.levels = np.zeros((len(self.markets), 2), dtype=np.int64)
+        self._loaded = [None] * len(self.markets)  # Which state of each book is in the arrays
+
+    def _compile(self, kernels):
+        """Lay out compiled plans (plan_compiler.PlanKernel) as fixed-shape arrays."""
+        n = len(kernels)
+        legs = max([len(kernel.legs) for kernel in kernels], default=0)
+        slots = max([len(kernel.assets) for kernel in kernels], default=1)
+
+        self.start_amount = np.array([kernel.start_amount for kernel in kernels], dtype=np.float64)
+        self.leg_mask = np.zeros((n, legs), dtype=bool)
+        self.leg_market = np.zeros((n, legs), dtype=np.int64)
+        self.leg_side = np.zeros((n, legs), dtype=np.int64)
+        self.leg_scale = np.ones((n, legs))
+        self.leg_out = np.zeros((n, legs), dtype=np.int64)
+        self.leg_in = np.zeros((n, legs), dtype=np.int64)
+        self.slot_mask = np.zeros((n, slots), dtype=bool)
+        self.slot_market = np.full((n, slots), -1, dtype=np.int64)
+        self.slot_side = np.zeros((n, slots), dtype=np.int64)
+        self.fee_mask = np.zeros((n, slots), dtype=bool)
+        self.fee_order = np.zeros((n, slots), dtype=np.int64)
+
+        for row, kernel in enumerate(kernels):
+            for col, leg in enumerate(kernel.legs):
+                self.leg_mask[row, col] = True
+                self.leg_market[row, col] = self.market_index[leg.symbol]
+                self.leg_side[row, col] = ASKS if leg.inverse else BIDS
+                self.leg_scale[row, col] = leg.scale
+                self.leg_out[row, col] = leg.asset_out
+                self.leg_in[row, col] = leg.asset_in
+            for slot, conversion in enumerate(kernel.conversions):
+                self.slot_mask[row, slot] = True
+                if conversion is not None:
+                    self.slot_market[row, slot] = self.market_index[conversion.symbol]
+                    self.slot_side[row, slot] = ASKS if conversion.inverse else BIDS
+            for i, slot in enumerate(kernel.fee_slots):
+                self.fee_mask[row, i] = True
+                self.fee_order[row, i] = slot
+
+    def load_books(self, books):
+        """Copy books (order_book.Book) of the plan markets into the depth arrays; unchanged books are skipped."""
+        for market, i in self.market_index.items():
+            book = books.get(market)
+            if book is None:
+                continue
+            key = (id(book), book.version, book.timestamp)
+            if key == self._loaded[i]:
+                continue
+            if book.capacity > self.depth:
+                self._grow(book.capacity)
+            for side, (px, qty, count) in ((BIDS, book.side("bids")), (ASKS, book.side("asks"))):
+                self.px[i, side, :count] = px[:count]
+                self.qty[i, side, :count] = qty[:count]
+                self.levels[i, side] = count
+            self._loaded[i] = key
+
+    def _grow(self, depth):
+        """Make room for deeper books."""
+        extra = depth - self.depth
+        self.px = np.concatenate([self.px, np.zeros(self.px.shape[:2] + (extra,))], axis=2)
+        self.qty = np.concatenate([self.qty, np.zeros(self.qty.shape[:2] + (extra,))], axis=2)
+        self.depth = depth
+
+    def evaluate(self, books, plan_ids=None):
+        """Return estimated profits of the plans; NaN where the books can't price the plan."""
+        self.load_books(books)
+        rows = np.arange(len(self.start_amount)) if plan_ids is None else np.asarray(plan_ids, dtype=np.int64)
+        n = len(rows)
+        ok = np.ones(n, dtype=bool)
+        wallet = np.zeros((n, self.slot_mask.shape[1]))
+        fees = np.zeros_like(wallet)
+        wallet[:, 0] = self.start_amount[rows]
+        holding = self.start_amount[rows].copy()
+        everyone = np.arange(n)
+
+        for col in range(self.leg_mask.shape[1]):
+            live = self.leg_mask[rows, col]
+            if not live.any():
+                break
+            market, side = self.leg_market[rows, col], self.leg_side[rows, col]
+            buy = side == ASKS
+            price, filled = self.walk(market, side, holding, inverse=buy)
+            ok &= filled | ~live
+            scale = self.leg_scale[rows, col]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                money_in = np.where(buy, np.trunc(holding * price * scale) / scale, np.trunc(holding * scale) / scale * price)
+                money_out = np.where(buy, money_in / price, np.trunc(holding * scale) / scale)
+            money_in = np.where(live, money_in, 0.)
+            money_out = np.where(live, money_out, 0.)
+            out_slot, in_slot = self.leg_out[rows, col], self.leg_in[rows, col]
+            wallet[everyone, out_slot] -= money_out
+            wallet[everyone, in_slot] += money_in
+            fees[everyone, in_slot] += money_in * self.fee
+            holding = np.where(live, money_in, holding)
+
+        norm_wallet, wallet_ok = self._normalize(rows, wallet)
+        norm_fees, fees_ok = self._normalize(rows, fees)
+        ok &= wallet_ok & fees_ok
+
+        final_balance = np.zeros(n)
+        fee_total = np.zeros(n)
+        for slot in range(wallet.shape[1]):
+            final_balance += np.where(self.slot_mask[rows, slot], norm_wallet[:, slot], 0.)
+            fee_slot = self.fee_order[rows, slot]
+            fee_total += np.where(self.fee_mask[rows, slot], norm_fees[everyone, fee_slot], 0.)
+        profits = final_balance - self.start_amount[rows] - fee_total
+
+        return np.where(ok, profits, np.nan)
+
+    def top_returns(self, plan_ids):
+        """Return log of the plans' top-of-book return, fees included; NaN where a book side is empty.
+
+        Call after evaluate (books loaded). A plan can be profitable at some size only if it is positive.
+        """
+        rows = np.asarray(plan_ids, dtype=np.int64)
+        if not self.depth:
+            return np.full(len(rows), np.nan)
+        market, side = self.leg_market[rows], self.leg_side[rows]
+        mask = self.leg_mask[rows]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            top = np.where(self.levels[market, side] > 0, np.log(self.px[market, side, 0]), np.nan)
+            rates = np.where(side == ASKS, -top, top)
+        return np.where(mask, rates, 0.).sum(axis=1) + mask.sum(axis=1) * np.log(1 - self.fee)
+
+    def _normalize(self, rows, wallet):
+        """Vectorized Opportunity.normalize_wallet; returns converted wallets and validity per plan."""
+        norm = wallet.copy()
+        ok = np.ones(len(rows), dtype=bool)
+        market, side = self.slot_market[rows], self.slot_side[rows]
+        convert = self.slot_mask[rows] & (wallet != 0)
+        convert[:, 0] = False
+        missing = convert & (market < 0)  # No market between the asset and the home asset
+        ok &= ~missing.any(axis=1)
+        plan_idx, slot_idx = np.nonzero(convert & ~missing)
+        if len(plan_idx):
+            amounts = wallet[plan_idx, slot_idx]
+            price, filled = self.walk(market[plan_idx, slot_idx], side[plan_idx, slot_idx], amounts,
+                                      inverse=side[plan_idx, slot_idx] == ASKS)
+            norm[plan_idx, slot_idx] = amounts * price
+            np.logical_and.at(ok, plan_idx, filled)
+
+        return norm, ok
+
+    def walk(self, market, side, amount, inverse):
+        """Vectorized Opportunity.get_best_orders; return average prices and whether the book was deep enough."""
+        r = len(market)
+        px, qty = self.px[market, side], self.qty[market, side]
+        levels = self.levels[market, side]
+        avl = amount.astype(np.float64)
+        num, den = np.zeros(r), np.zeros(r)
+        done = np.zeros(r, dtype=bool)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for level in range(self.depth):
+                live = ~done & (level < levels)
+                if not live.any():
+                    break
+                p, q = px[:, level], qty[:, level]
+                cap = np.where(inverse, q * p, q)
+                fill = live & (avl - cap <= 0)
+                take = np.where(fill, np.where(inverse, avl / p, avl), q)
+                num = np.where(live, num + p * take, num)
+                den = np.where(live, den + take, den)
+                avl = np.where(fill, 0., np.where(live, avl - cap, avl))
+                done |= fill
+            price = num / den
+            price = np.where(inverse, 1 / price, price)
+
+        return price, done